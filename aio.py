@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''aio
+asyncio variant of dns.wsgi, rproxy.wsgi and user.wsgi in one process
+
+    python aio.py --host 127.0.0.1 --port 8080
+
+The apps are mounted under /dns, /rproxy and /user with the same routes,
+parameters and responses as the uWSGI apps; MySQL and Redis are reached
+through asyncio pools, so one process holds many in-flight requests.
+Bulk writes run the BaseRecord implementation in a thread.
+'''
+
+from aiohttp import web
+import argparse
+import json
+
+import config
+from lib import aiodb, aiokvs, aiolisting, aiorecords, aiouser, kvs
+from lib.aioservice import AsyncService, instrument, run_sync, \
+    serve_metrics, text
+from lib.common import message
+from lib.records import DNSRecord, ReverseProxyRecord
+
+RECORD_APPS = {
+    'dns': (DNSRecord, ('type', 'host', 'domain', 'ipv4_addr')),
+    'rproxy': (ReverseProxyRecord, ('host', 'upstream')),
+}
+
+
+def record_app(name):
+    '''Application of dns.wsgi or rproxy.wsgi'''
+    record_class, fields = RECORD_APPS[name]
+
+    async def index(request):
+        return text(message('Hello'))
+
+    @AsyncService.option_param(
+        'after', 'limit', 'fields', *sorted(record_class.filters)
+    )
+    async def list_records(request, params):
+        return await aiolisting.respond(request, record_class, params)
+
+    async def get_record(request):
+        record = await aiorecords.get(
+            record_class, int(request.match_info['id_'])
+        )
+        return text(str(record))
+
+    async def get_record_by_host(request):
+        record = await aiorecords.find_unique(
+            record_class, request.match_info['host']
+        )
+        return text(str(record))
+
+    @AsyncService.token
+    @AsyncService.role('admin')
+    @AsyncService.require_param(*fields)
+    async def add_record(request, params, user):
+        record = await aiorecords.create(record_class, params)
+        return text(str(record))
+
+    @AsyncService.token
+    @AsyncService.role('admin')
+    @AsyncService.option_param(*fields)
+    async def update_record(request, params, user):
+        record = await aiorecords.update(
+            record_class, int(request.match_info['id_']), params
+        )
+        return text(str(record))
+
+    @AsyncService.token
+    @AsyncService.role('admin')
+    async def delete_record(request, user):
+        await aiorecords.delete(record_class, int(request.match_info['id_']))
+        return text(message('Success'))
+
+    def bulk(method):
+        @AsyncService.token
+        @AsyncService.role('admin')
+        @AsyncService.json_array
+        async def handler(request, items, user):
+            return text(json.dumps(await run_sync(method, items)))
+        return handler
+
+    app = web.Application(middlewares=[instrument(name)])
+    app.router.add_get('/', index)
+    app.router.add_get('/json', list_records)
+    app.router.add_get(r'/{id_:\d+}', get_record)
+    app.router.add_get('/host/{host}', get_record_by_host)
+    app.router.add_post('/', add_record)
+    app.router.add_put(r'/{id_:\d+}', update_record)
+    app.router.add_delete(r'/{id_:\d+}', delete_record)
+    app.router.add_post('/bulk', bulk(record_class.bulk_create))
+    app.router.add_put('/bulk', bulk(record_class.bulk_update))
+    app.router.add_delete('/bulk', bulk(record_class.bulk_delete))
+    app.router.add_get('/metrics', serve_metrics)
+    return app
+
+
+def user_app():
+    '''Application of user.wsgi'''
+    async def index(request):
+        return text(message('hello'))
+
+    @AsyncService.require_param('username', 'password')
+    async def add_user(request, params):
+        user = await aiouser.create(params['username'], params['password'])
+        return text(str(user))
+
+    @AsyncService.auth
+    async def user_activate(request, user):
+        await aiouser.activate(user)
+        return text(json.dumps({'token': await aiouser.get_token(user)}))
+
+    @AsyncService.auth
+    async def get_token(request, user):
+        return text(json.dumps({'token': await aiouser.get_token(user)}))
+
+    @AsyncService.token
+    @AsyncService.option_param('username', 'password')
+    async def update_user(request, user, params):
+        await aiouser.update(user, **params)
+        return text(str(user))
+
+    @AsyncService.token
+    async def delete_user(request, user):
+        await aiouser.delete(user)
+        return text(message('Success'))
+
+    app = web.Application(middlewares=[instrument('user')])
+    app.router.add_get('/', index)
+    app.router.add_post('/', add_user)
+    app.router.add_put('/activate', user_activate)
+    app.router.add_post('/token', get_token)
+    app.router.add_put('/', update_user)
+    app.router.add_delete('/', delete_user)
+    app.router.add_get('/metrics', serve_metrics)
+    return app
+
+
+async def startup(app):
+    await aiodb.pool.open()
+    await aiokvs.connect()
+    # starts the lib.kvs listener thread for cache invalidations
+    kvs.client()
+
+
+async def cleanup(app):
+    await aiokvs.close()
+    await aiodb.pool.close()
+
+
+def create_app():
+    '''Root Application mounting /dns, /rproxy and /user'''
+    app = web.Application()
+    for name in RECORD_APPS:
+        app.add_subapp('/' + name, record_app(name))
+    app.add_subapp('/user', user_app())
+    app.on_startup.append(startup)
+    app.on_cleanup.append(cleanup)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default=config.aio['host'])
+    parser.add_argument('--port', type=int, default=config.aio['port'])
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
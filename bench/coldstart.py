@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''bench.coldstart
+startup time and first-request latency with and without lib.warmup
+
+    python -m bench.coldstart --records 1000 --runs 5
+
+Each run spawns a fresh interpreter that plays the uWSGI master: it
+loads dns.wsgi, rproxy.wsgi and user.wsgi (timed as startup_ms), then
+forks a worker which runs the post-fork hook (postfork_ms) and sends
+each request kind once (first_*_ms) and once more (warm_ms, summed).
+`cold` disables config.warmup, `warm` enables all of it.
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from bench import run, standins
+
+MODES = {
+    'cold': {'preload': False, 'listings': False, 'connections': False},
+    'warm': {'preload': True, 'listings': True, 'connections': True},
+}
+
+# kind: (app, method, path, bench.run kind)
+REQUESTS = [
+    ('list', ('dns', 'GET', '/json', 'list')),
+    ('page', ('rproxy', 'GET', '/json', 'page')),
+    ('token', ('user', 'POST', '/token', 'token')),
+    ('update', ('dns', 'PUT', '/', 'update')),
+]
+
+COLUMNS = ['mode', 'runs', 'startup_ms', 'postfork_ms'] + \
+    ['first_{}_ms'.format(kind) for kind, _ in REQUESTS] + ['warm_ms']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='charakoba-coldstart-')
+    try:
+        run.Bench(workdir, args.records)
+        path = os.path.join(workdir, 'bench.db')
+        context = multiprocessing.get_context('spawn')
+        results = []
+        for mode in sorted(MODES):
+            samples = []
+            for _ in range(args.runs):
+                queue = context.Queue()
+                process = context.Process(
+                    target=_master, args=(queue, path, args.records, mode)
+                )
+                process.start()
+                samples.append(queue.get())
+                process.join()
+            result = {'mode': mode, 'runs': args.runs}
+            for column in COLUMNS[2:]:
+                result[column] = _median([s[column] for s in samples])
+            results.append(result)
+    finally:
+        shutil.rmtree(workdir)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        run.print_table(results, COLUMNS)
+
+
+class Worker(run.Bench):
+    '''Bench over already loaded apps'''
+
+    def __init__(self, apps, records, token):
+        self.apps = apps
+        self.records = records
+        self.token = token
+        self._serial = 0
+        self._lock = threading.Lock()
+
+
+def _master(queue, path, records, mode):
+    import config
+    from lib import db, kvs, warmup
+    from lib.user import User
+
+    config.warmup = MODES[mode]
+    started = time.perf_counter()
+    run.connect(path)
+    apps = {name: run.load_app(name) for name in ('dns', 'rproxy', 'user')}
+    result = {'startup_ms': (time.perf_counter() - started) * 1000}
+    redis = kvs.client()
+    token = User(run.ADMIN[0]).get_token()
+    db.pool.clear()
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        kvs.reset(standins.FakeRedis(redis.store))
+        started = time.perf_counter()
+        warmup.postfork()
+        result['postfork_ms'] = (time.perf_counter() - started) * 1000
+        worker = Worker(apps, records, token)
+        for kind, call in REQUESTS:
+            started = time.perf_counter()
+            worker._call(*call)
+            result['first_{}_ms'.format(kind)] = \
+                (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        for _, call in REQUESTS:
+            worker._call(*call)
+        result['warm_ms'] = (time.perf_counter() - started) * 1000
+        with os.fdopen(write, 'w') as f:
+            json.dump(result, f)
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        queue.put(json.load(f))
+    os.waitpid(pid, 0)
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''bench.footprint
+memory and connections of the three uWSGI apps against api.wsgi
+
+    python -m bench.footprint --records 1000 --requests 1000 --threads 1
+
+Each layout runs in freshly spawned processes, like uWSGI instances:
+`split` loads dns.wsgi, rproxy.wsgi and user.wsgi in one process each,
+`single` loads api.wsgi once. The processes serve the `mixed` request
+mix of bench.run between them, against a shared SQLite file and a
+FakeRedis per process (see bench.standins), then report their resident
+memory and the MySQL and Redis connections they opened.
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+from bench import run, standins
+from lib.user import User
+
+LAYOUTS = {
+    'split': [['dns'], ['rproxy'], ['user']],
+    'single': [['api']],
+}
+
+COLUMNS = ['layout', 'processes', 'threads', 'requests', 'errors',
+           'rss_mb', 'mysql_connections', 'redis_connections']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=1,
+                        help='request threads per process')
+    parser.add_argument('--json', action='store_true', help='print JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='charakoba-footprint-')
+    try:
+        run.Bench(workdir, args.records)
+        path = os.path.join(workdir, 'bench.db')
+        results = [
+            measure(layout, path, args.records, args.requests, args.threads)
+            for layout in sorted(LAYOUTS)
+        ]
+    finally:
+        shutil.rmtree(workdir)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        run.print_table(results, COLUMNS)
+
+
+def measure(layout, path, records, requests, threads):
+    '''Run one layout; return a result dict summed over its processes'''
+    weights = {}
+    for weight, app, _, _, _ in run.MIXES['mixed']:
+        weights[app] = weights.get(app, 0) + weight
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    processes = []
+    for names in LAYOUTS[layout]:
+        served = run.MIXES['mixed'] if names == ['api'] else [
+            entry for entry in run.MIXES['mixed'] if entry[1] in names
+        ]
+        share = sum(entry[0] for entry in served) / sum(weights.values())
+        process = context.Process(target=_serve, args=(
+            queue, path, records, names, int(requests * share), threads
+        ))
+        process.start()
+        processes.append(process)
+    reports = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {
+        'layout': layout,
+        'processes': len(processes),
+        'threads': threads,
+        'requests': sum(r['requests'] for r in reports),
+        'errors': sum(r['errors'] for r in reports),
+        'rss_mb': sum(r['rss_kb'] for r in reports) / 1024,
+        'mysql_connections': sum(r['mysql_connections'] for r in reports),
+        'redis_connections': sum(r['redis_connections'] for r in reports),
+    }
+
+
+class Worker(run.Bench):
+    '''Bench over some of the apps, in a process of its own'''
+
+    def __init__(self, path, records, names):
+        run.connect(path)
+        if names == ['api']:
+            api = run.load_app('api')
+            self.apps = {
+                name: _mounted(api, '/' + name)
+                for name in ('dns', 'rproxy', 'user')
+            }
+        else:
+            self.apps = {name: run.load_app(name) for name in names}
+        self.records = records
+        self.token = User(run.ADMIN[0]).get_token()
+        self._serial = 0
+        self._lock = threading.Lock()
+
+
+def _serve(queue, path, records, names, requests, threads):
+    worker = Worker(path, records, names)
+    result = worker.run('mixed', requests, threads)
+    queue.put({
+        'requests': result['requests'],
+        'errors': result['errors'],
+        'rss_kb': _rss_kb(),
+        'mysql_connections': standins.stats['mysql_connections'],
+        'redis_connections': standins.stats['redis_connections'],
+    })
+
+
+def _mounted(app, prefix):
+    '''Call app with prefix put back in front of PATH_INFO'''
+    def mounted(environ, start_response):
+        environ['PATH_INFO'] = prefix + environ['PATH_INFO']
+        return app(environ, start_response)
+    return mounted
+
+
+def _rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''bench.hashers
+cost of lib.hashers on this host, to pick config.password_hasher
+
+    python -m bench.hashers --iterations 50000,100000,200000 --target-ms 100
+
+Prints the median milliseconds of one hash for each iteration count,
+then the iterations which take about --target-ms here.
+'''
+
+import argparse
+
+from lib import hashers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--iterations', default='50000,100000,200000,400000')
+    parser.add_argument('--target-ms', type=float, default=100)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>10} {:>9}'.format('iterations', 'ms/hash'))
+    for iterations in [int(i) for i in args.iterations.split(',')]:
+        elapsed = hashers._time_hash(
+            hashers.PBKDF2Hasher(iterations), args.rounds
+        )
+        print('{:>10} {:>9.1f}'.format(iterations, elapsed * 1000))
+    print('\nsuggested for {:.0f}ms: {}'.format(
+        args.target_ms,
+        hashers.calibrate(args.target_ms, rounds=args.rounds)
+    ))
+
+
+if __name__ == '__main__':
+    main()
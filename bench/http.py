@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''bench.http
+benchmark a running deployment over HTTP, uWSGI or aio.py
+
+    python -m bench.http --url http://localhost --label uwsgi \\
+        --username admin --password secret --concurrency 16,64,256
+    python -m bench.http --url http://127.0.0.1:8080 --label aio ...
+
+The apps are expected under /dns, /rproxy and /user, as nginx/api.conf
+and aio.py serve them. The request mixes are the ones of bench.run; the
+write mixes create, update and delete records, so point this at a
+scratch database. The admin user must exist and be active.
+'''
+
+import aiohttp
+import argparse
+import ast
+import asyncio
+import json
+import os
+import random
+import time
+
+from bench.run import MIXES, _ipv4, _percentile, print_table
+
+COLUMNS = ['label', 'mix', 'concurrency', 'requests', 'errors',
+           'req_per_sec', 'p50_ms', 'p95_ms', 'p99_ms']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='http://localhost')
+    parser.add_argument('--label', default='')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--concurrency', default='16,64,256')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--mix', action='append', choices=sorted(MIXES))
+    parser.add_argument('--json', action='store_true', help='print JSON')
+    args = parser.parse_args()
+
+    results = asyncio.run(run_all(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results, COLUMNS)
+
+
+async def run_all(args):
+    results = []
+    for concurrency in [int(c) for c in args.concurrency.split(',') if c]:
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            bench = HTTPBench(session, args.url.rstrip('/'), args.label)
+            await bench.login(args.username, args.password)
+            for mix in args.mix or sorted(MIXES):
+                results.append(await bench.run(
+                    mix, args.requests, concurrency
+                ))
+    return results
+
+
+class HTTPBench(object):
+    '''Drive the bench.run request mixes against a base URL'''
+
+    def __init__(self, session, url, label=''):
+        self.session = session
+        self.url = url
+        self.label = label
+        self.credentials = None
+        self.token = None
+        self.records = {}
+        self._serial = 0
+
+    async def login(self, username, password):
+        '''Get an admin token and the records to look up and update'''
+        self.credentials = {'username': username, 'password': password}
+        status, body = await self.request(
+            'user', 'POST', '/token', self.credentials
+        )
+        if status != 200:
+            raise SystemExit('cannot get a token: {} {}'.format(status, body))
+        self.token = json.loads(body)['token']
+        for app, address in (('dns', 'ipv4_addr'), ('rproxy', 'upstream')):
+            status, body = await self.request(
+                app, 'GET', '/json', {'fields': 'host,' + address}
+            )
+            self.records[app] = [
+                (r['id_'], r['host'], r[address]) for r in json.loads(body)
+            ]
+
+    async def request(self, app, method, path, params=None):
+        '''Send one request; return (status code, body)'''
+        url = '{}/{}{}'.format(self.url, app, path)
+        if method == 'GET':
+            kw = {'params': params}
+        else:
+            kw = {'data': params}
+        async with self.session.request(method, url, **kw) as response:
+            return response.status, await response.text()
+
+    async def _call(self, app, method, path, kind):
+        params = {}
+        id_, host, address = random.choice(
+            self.records.get(app) or [(0, 'none', '10.0.0.0')]
+        )
+        if kind == 'page':
+            params = {'after': id_, 'limit': 50}
+        elif kind == 'get':
+            path += str(id_)
+        elif kind == 'host':
+            path += host
+        elif kind == 'filter':
+            if app == 'dns':
+                params = {'ipv4_prefix': address.rsplit('.', 1)[0] + '.'}
+            else:
+                params = {'upstream': address}
+        elif kind == 'token':
+            params = dict(self.credentials)
+        elif kind in ('create', 'update', 'delete'):
+            params['token'] = self.token
+            self._serial += 1
+            serial = self._serial
+            host = 'bench{}-{}-{}'.format(os.getpid(), id(self), serial)
+            if kind == 'create' or kind == 'delete':
+                if app == 'dns':
+                    params.update({'type': 'A', 'host': host,
+                                   'domain': 'charakoba.com',
+                                   'ipv4_addr': _ipv4(serial)})
+                else:
+                    params.update({'host': host, 'upstream': host + ':80'})
+                status, body = await self.request(app, 'POST', '/', params)
+                if kind == 'create' or status >= 400:
+                    return status
+                id_ = ast.literal_eval(body)['id_']
+                return (await self.request(
+                    app, 'DELETE', '/{}'.format(id_), {'token': self.token}
+                ))[0]
+            if not self.records[app]:
+                return 404
+            path = '/{}'.format(id_)
+            if app == 'dns':
+                params['ipv4_addr'] = _ipv4(serial)
+            else:
+                params['upstream'] = _ipv4(serial) + ':80'
+        return (await self.request(app, method, path, params))[0]
+
+    async def run(self, mix, requests, concurrency):
+        '''Drive a request mix; return a result dict'''
+        plan = []
+        for weight, app, method, path, kind in MIXES[mix]:
+            plan += [(app, method, path, kind)] * weight
+        latencies = []
+        errors = []
+        per_task = max(1, requests // concurrency)
+
+        async def worker():
+            for _ in range(per_task):
+                call = random.choice(plan)
+                started = time.perf_counter()
+                try:
+                    status = await self._call(*call)
+                except (aiohttp.ClientError, ValueError) as e:
+                    status = e
+                latencies.append(time.perf_counter() - started)
+                if not isinstance(status, int) or status >= 400:
+                    errors.append((call, status))
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+        done = len(latencies) or 1
+        latencies.sort()
+        return {
+            'label': self.label,
+            'mix': mix,
+            'concurrency': concurrency,
+            'requests': done,
+            'errors': len(errors),
+            'req_per_sec': done / elapsed,
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p95_ms': _percentile(latencies, 95) * 1000,
+            'p99_ms': _percentile(latencies, 99) * 1000,
+        }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''bench.output
+benchmark reverse proxy config generation
+
+    python -m bench.output --records 1000,10000 --workers 1,2,4
+
+For each record count and worker count, output.write_rproxy renders and
+writes every file into an empty directory (cold), then runs again with
+nothing changed (warm) and once more with 1% of upstreams changed.
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import config
+import output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--records', default='1000,10000')
+    parser.add_argument('--workers', default='1,2,4,{}'.format(os.cpu_count()))
+    parser.add_argument('--chunk-size', type=int,
+                        default=config.output_chunk_size)
+    args = parser.parse_args()
+    config.output_chunk_size = args.chunk_size
+
+    print('{:>8} {:>7} {:>9} {:>9} {:>9} {:>10}'.format(
+        'records', 'workers', 'cold_s', 'warm_s', '1%_s', 'files/s'
+    ))
+    for records in _ints(args.records):
+        rows = [
+            {'host': 'host{}'.format(i), 'upstream': '10.0.0.1:{}'.format(i)}
+            for i in range(records)
+        ]
+        for workers in sorted(set(_ints(args.workers))):
+            cold, warm, partial = run(rows, workers)
+            print('{:>8} {:>7} {:>9.3f} {:>9.3f} {:>9.3f} {:>10.0f}'.format(
+                records, workers, cold, warm, partial, records / cold
+            ))
+
+
+def run(rows, workers):
+    '''Return (cold, warm, 1% changed) seconds for write_rproxy'''
+    config.output_dir = tempfile.mkdtemp(prefix='charakoba-output-')
+    try:
+        timings = []
+        for _ in range(2):
+            started = time.perf_counter()
+            output.write_rproxy(rows, workers=workers)
+            timings.append(time.perf_counter() - started)
+        changed = [dict(row) for row in rows]
+        for row in changed[::100]:
+            row['upstream'] = '10.0.0.2:80'
+        started = time.perf_counter()
+        output.write_rproxy(changed, workers=workers)
+        timings.append(time.perf_counter() - started)
+        return timings
+    finally:
+        shutil.rmtree(config.output_dir)
+
+
+def _ints(text):
+    return [int(v) for v in text.split(',') if v]
+
+
+if __name__ == '__main__':
+    main()
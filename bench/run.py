@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''bench.run
+benchmark dns.wsgi, rproxy.wsgi and user.wsgi in-process
+
+    python -m bench.run --records 1000 --concurrency 8 --requests 2000
+
+MySQL is replaced with SQLite and Redis with an in-memory fake (see
+bench.standins), so the numbers measure this code base: requests per
+second, latency percentiles, and MySQL queries, MySQL connections and
+Redis round-trips per request.
+'''
+
+import argparse
+import ast
+import io
+import json
+import os
+import random
+import runpy
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from bench import standins
+import config
+from lib import db, kvs
+from lib.json2mysql import load_schema
+from lib.user import Password
+
+ADMIN = ('bench-admin', 'bench-password')
+
+# name: [(weight, app, method, path, kind)]
+MIXES = {
+    'list': [
+        (5, 'dns', 'GET', '/json', 'list'),
+        (5, 'rproxy', 'GET', '/json', 'list'),
+    ],
+    'gzip': [
+        (5, 'dns', 'GET', '/json', 'gzip'),
+        (5, 'rproxy', 'GET', '/json', 'gzip'),
+    ],
+    'page': [
+        (5, 'dns', 'GET', '/json', 'page'),
+        (5, 'rproxy', 'GET', '/json', 'page'),
+    ],
+    'lookup': [
+        (3, 'dns', 'GET', '/', 'get'),
+        (2, 'rproxy', 'GET', '/', 'get'),
+        (3, 'dns', 'GET', '/host/', 'host'),
+        (1, 'dns', 'GET', '/json', 'filter'),
+        (1, 'rproxy', 'GET', '/json', 'filter'),
+    ],
+    'write': [
+        (4, 'dns', 'POST', '/', 'create'),
+        (4, 'dns', 'PUT', '/', 'update'),
+        (2, 'dns', 'DELETE', '/', 'delete'),
+    ],
+    'token': [
+        (1, 'user', 'POST', '/token', 'token'),
+    ],
+    'mixed': [
+        (6, 'dns', 'GET', '/json', 'page'),
+        (6, 'rproxy', 'GET', '/json', 'page'),
+        (4, 'dns', 'PUT', '/', 'update'),
+        (2, 'rproxy', 'PUT', '/', 'update'),
+        (1, 'dns', 'POST', '/', 'create'),
+        (1, 'user', 'POST', '/token', 'token'),
+    ],
+}
+
+COLUMNS = ['mix', 'records', 'concurrency', 'requests', 'errors',
+           'req_per_sec', 'p50_ms', 'p95_ms', 'p99_ms',
+           'queries_per_req', 'connections_per_req', 'redis_per_req']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--mix', action='append', choices=sorted(MIXES))
+    parser.add_argument('--token-format', choices=['uuid', 'signed'],
+                        default=config.token_format)
+    parser.add_argument('--json', action='store_true', help='print JSON')
+    args = parser.parse_args()
+
+    config.token_format = args.token_format
+    if args.token_format == 'signed' and not config.token_secret:
+        config.token_secret = 'bench-secret'
+    workdir = tempfile.mkdtemp(prefix='charakoba-bench-')
+    try:
+        bench = Bench(workdir, args.records)
+        results = []
+        for mix in args.mix or sorted(MIXES):
+            results.append(bench.run(mix, args.requests, args.concurrency))
+    finally:
+        shutil.rmtree(workdir)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+class Bench(object):
+    '''In-process WSGI apps wired to the stand-ins'''
+
+    def __init__(self, workdir, records):
+        path = os.path.join(workdir, 'bench.db')
+        standins.create_tables(path, load_schema('spec/mysql_schema.json'))
+        connect(path)
+        self.path = path
+        self.records = records
+        self._seed()
+        self.apps = {
+            name: load_app(name) for name in ('dns', 'rproxy', 'user')
+        }
+        self.token = json.loads(self.request(
+            'user', 'POST', '/token',
+            {'username': ADMIN[0], 'password': ADMIN[1]}
+        )[1])['token']
+        self._serial = 0
+        self._lock = threading.Lock()
+
+    def _seed(self):
+        with db.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO users (username, password, role, is_active) '
+                'VALUES (%s, %s, %s, %s);',
+                (ADMIN[0], str(Password(ADMIN[1])), 'admin', 1)
+            )
+            cursor.executemany(
+                'INSERT INTO dns (type, host, ipv4_addr) '
+                'VALUES (%s, %s, %s);',
+                [('A', 'host{}'.format(i), _ipv4(i))
+                 for i in range(self.records)]
+            )
+            cursor.executemany(
+                'INSERT INTO rproxy (host, upstream) VALUES (%s, %s);',
+                [('host{}'.format(i), '{}:80'.format(_ipv4(i)))
+                 for i in range(self.records)]
+            )
+
+    def request(self, app, method, path, params=None, headers=None):
+        '''Call a WSGI app; return (status code, body)
+        body stays bytes when the response has a Content-Encoding.'''
+        body = urlencode(params or {}).encode('utf-8')
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if method == 'GET':
+            environ['QUERY_STRING'] = body.decode('utf-8')
+            environ['CONTENT_LENGTH'] = '0'
+        for name, value in (headers or {}).items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+        status = []
+        encoded = []
+
+        def start_response(status_line, response_headers, exc_info=None):
+            status.append(int(status_line.split()[0]))
+            encoded.extend([
+                value for name, value in response_headers
+                if name.lower() == 'content-encoding'
+            ])
+
+        chunks = self.apps[app](environ, start_response)
+        try:
+            out = b''.join(chunks)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        if encoded:
+            return status[0], out
+        return status[0], out.decode('utf-8')
+
+    def _next_serial(self):
+        with self._lock:
+            self._serial += 1
+            return self._serial
+
+    def _call(self, app, method, path, kind):
+        params = {}
+        if kind == 'gzip':
+            return self.request(
+                app, method, path, headers={'Accept-Encoding': 'gzip'}
+            )[0]
+        elif kind == 'page':
+            params = {'after': random.randrange(self.records), 'limit': 50}
+        elif kind == 'get':
+            path += str(random.randrange(1, self.records + 1))
+        elif kind == 'host':
+            path += 'host{}'.format(random.randrange(self.records))
+        elif kind == 'filter':
+            address = _ipv4(random.randrange(self.records))
+            if app == 'dns':
+                params = {'ipv4_prefix': address.rsplit('.', 1)[0] + '.'}
+            else:
+                params = {'upstream': address + ':80'}
+        elif kind == 'token':
+            params = {'username': ADMIN[0], 'password': ADMIN[1]}
+        elif kind in ('create', 'update', 'delete'):
+            params['token'] = self.token
+            serial = self._next_serial()
+            host = 'bench{}-{}'.format(os.getpid(), serial)
+            if kind == 'create' or kind == 'delete':
+                if app == 'dns':
+                    params.update({'type': 'A', 'host': host,
+                                   'domain': 'charakoba.com',
+                                   'ipv4_addr': _ipv4(serial)})
+                else:
+                    params.update({'host': host, 'upstream': host + ':80'})
+                status, body = self.request(app, 'POST', '/', params)
+                if kind == 'create':
+                    return status
+                id_ = _parse_record(body)['id_']
+                return self.request(
+                    app, 'DELETE', '/{}'.format(id_),
+                    {'token': self.token}
+                )[0]
+            path = '/{}'.format(random.randrange(1, self.records + 1))
+            if app == 'dns':
+                params['ipv4_addr'] = _ipv4(serial)
+            else:
+                params['upstream'] = _ipv4(serial) + ':80'
+        return self.request(app, method, path, params)[0]
+
+    def run(self, mix, requests, concurrency):
+        '''Drive a request mix over the loaded apps; return a result dict'''
+        plan = []
+        for weight, app, method, path, kind in MIXES[mix]:
+            if app in self.apps:
+                plan += [(app, method, path, kind)] * weight
+        latencies = []
+        errors = []
+        before = dict(standins.stats)
+        per_thread = max(1, requests // concurrency)
+
+        def worker():
+            own = []
+            for _ in range(per_thread):
+                call = random.choice(plan)
+                started = time.perf_counter()
+                try:
+                    status = self._call(*call)
+                except Exception as e:
+                    status = e
+                own.append(time.perf_counter() - started)
+                if not isinstance(status, int) or status >= 400:
+                    errors.append((call, status))
+            latencies.extend(own)
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done = len(latencies) or 1
+        delta = {k: standins.stats[k] - before.get(k, 0)
+                 for k in standins.stats}
+        latencies.sort()
+        return {
+            'mix': mix,
+            'records': self.records,
+            'concurrency': concurrency,
+            'requests': done,
+            'errors': len(errors),
+            'req_per_sec': done / elapsed,
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p95_ms': _percentile(latencies, 95) * 1000,
+            'p99_ms': _percentile(latencies, 99) * 1000,
+            'queries_per_req': delta.get('mysql_queries', 0) / done,
+            'connections_per_req': delta.get('mysql_connections', 0) / done,
+            'redis_per_req': delta.get('redis_round_trips', 0) / done,
+        }
+
+
+def connect(path):
+    '''Point lib.db at the SQLite file and lib.kvs at a FakeRedis'''
+    db.pool = db.ConnectionPool(
+        lambda **kw: standins.SQLiteConnection(path),
+        {},
+        **config.mysql_pool
+    )
+    kvs.reset(standins.FakeRedis())
+
+
+def load_app(name):
+    '''Return the WSGI application of <name>.wsgi'''
+    return runpy.run_path(name + '.wsgi')['application']
+
+
+def print_table(results, columns=COLUMNS):
+    rows = [[_format(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows))
+              for i, c in enumerate(columns)]
+    print('  '.join(c.rjust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(v.rjust(w) for v, w in zip(row, widths)))
+
+
+def _format(value):
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return str(value)
+
+
+def _parse_record(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return ast.literal_eval(body)
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+def _ipv4(n):
+    return '10.{}.{}.{}'.format((n >> 16) & 255, (n >> 8) & 255, n & 255)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''bench.serve
+serve api.wsgi or aio.py over the stand-ins, for bench.http
+
+    python -m bench.serve --stack wsgi --threads 4 --latency 2 --port 8081
+    python -m bench.serve --stack aio --latency 2 --port 8082
+    python -m bench.http --url http://127.0.0.1:8081 --label wsgi \\
+        --username bench-admin --password bench-password
+
+Every MySQL query and Redis round-trip waits --latency milliseconds, as
+the network hop to the servers would; with no latency both stacks only
+measure the same in-process SQLite and FakeRedis. The wsgi stack runs
+api.wsgi on a pool of --threads threads, like vassals-single/api.ini.
+The admin user is bench.run.ADMIN.
+'''
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pymysql.cursors import DictCursor
+import shutil
+import tempfile
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from bench import run, standins
+from lib import kvs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--stack', choices=['wsgi', 'aio'], required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds per query and round-trip')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='charakoba-serve-')
+    try:
+        bench = run.Bench(workdir, args.records)
+        standins.latency = args.latency / 1000
+        if args.stack == 'wsgi':
+            serve_wsgi(args.host, args.port, args.threads)
+        else:
+            serve_aio(args.host, args.port, bench)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def serve_wsgi(host, port, threads):
+    '''Serve api.wsgi until interrupted'''
+    server = PoolServer((host, port), threads)
+    server.set_app(run.load_app('api'))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_aio(host, port, bench):
+    '''Serve aio.py until interrupted, sharing the stand-ins of bench'''
+    from aiohttp import web
+    import aio
+    from lib import aiodb, aiokvs
+
+    store = kvs.client().store
+
+    async def connect():
+        aiokvs._client = AsyncRedis(store)
+
+    aiodb.pool = AsyncPool(bench.path)
+    aiokvs.connect = connect
+    web.run_app(aio.create_app(), host=host, port=port, print=None)
+
+
+class PoolServer(WSGIServer):
+    '''WSGIServer handling requests on a fixed number of threads'''
+    request_queue_size = 1024
+
+    def __init__(self, address, threads):
+        super().__init__(address, _QuietHandler)
+        self._executor = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+async def _hop():
+    if standins.latency:
+        await asyncio.sleep(standins.latency)
+
+
+class AsyncPool(object):
+    '''lib.aiodb pool stand-in over the SQLite file'''
+
+    def __init__(self, path):
+        self.path = path
+        self._idle = []
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle = []
+
+    @asynccontextmanager
+    async def cursor(self, cursorclass=None):
+        from lib.aiodb import _CountingCursor
+
+        conn = self._idle.pop() if self._idle else \
+            standins.SQLiteConnection(self.path, blocking=False)
+        try:
+            # any cursorclass given is aiomysql's DictCursor
+            cursor = conn.cursor(cursorclass and DictCursor)
+            yield _CountingCursor(AsyncCursor(cursor))
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.append(conn)
+
+    def stats(self):
+        return {'size': len(self._idle), 'idle': len(self._idle),
+                'in_use': 0}
+
+
+class AsyncCursor(object):
+    '''aiomysql-like Cursor over a stand-in cursor'''
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def execute(self, query, args=None):
+        await _hop()
+        return self._cursor.execute(query, args)
+
+    async def executemany(self, query, args):
+        await _hop()
+        return self._cursor.executemany(query, args)
+
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+    async def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size)
+
+    async def fetchall(self):
+        return self._cursor.fetchall()
+
+    async def close(self):
+        self._cursor.close()
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+
+class AsyncRedis(object):
+    '''aioredis-like client over the FakeRedis key space'''
+
+    def __init__(self, store):
+        self._redis = standins.FakeRedis(store, blocking=False)
+
+    def __getattr__(self, name):
+        command = getattr(self._redis, name)
+
+        async def call(*args):
+            await _hop()
+            return command(*args)
+        return call
+
+    async def evalsha(self, digest, keys, args):
+        import aioredis
+        from redis.exceptions import NoScriptError
+
+        await _hop()
+        try:
+            return self._redis.evalsha(digest, len(keys), *keys, *args)
+        except NoScriptError:
+            raise aioredis.ReplyError('NOSCRIPT No matching script')
+
+    async def eval(self, script, keys, args):
+        await _hop()
+        digest = self._redis.store.script_load(script)
+        return self._redis.store.evalsha(digest, len(keys), *keys, *args)
+
+    def pipeline(self):
+        return AsyncPipeline(self._redis.pipeline())
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class AsyncPipeline(object):
+    '''Queue commands and send them in one awaited round-trip'''
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+    async def execute(self):
+        await _hop()
+        return self._pipe.execute()
+
+
+if __name__ == '__main__':
+    main()
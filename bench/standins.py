@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''standins
+local MySQL and Redis stand-ins for benchmarks
+SQLite plays MySQL behind the pymysql connection interface used by
+lib.db, and FakeRedis keeps keys in memory. Both count the work they do
+so that benchmarks can report queries and round-trips per request.
+'''
+
+from collections import Counter
+from contextlib import contextmanager
+import fnmatch
+import hashlib
+from pymysql.constants import ER
+from pymysql.cursors import DictCursorMixin
+from pymysql.err import IntegrityError
+import queue
+from redis.exceptions import NoScriptError
+import sqlite3
+import threading
+import time
+
+from lib.json2mysql import table_keys
+
+stats = Counter()
+_stats_lock = threading.Lock()
+# seconds each query and round-trip waits, as a network hop would
+latency = 0
+
+
+def wait():
+    '''Block for one network hop, if latency is set'''
+    if latency:
+        time.sleep(latency)
+
+
+def count(name, n=1):
+    with _stats_lock:
+        stats[name] += n
+
+
+class SQLiteConnection(object):
+    '''pymysql-like Connection backed by a SQLite database file'''
+
+    def __init__(self, path, blocking=True):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL;')
+        # asyncio stand-ins wait for the latency themselves
+        self._blocking = blocking
+        self.open = True
+        count('mysql_connections')
+
+    def cursor(self, cursorclass=None):
+        as_dict = cursorclass is not None and \
+            issubclass(cursorclass, DictCursorMixin)
+        return SQLiteCursor(self._conn.cursor(), as_dict, self._blocking)
+
+    def ping(self, reconnect=True):
+        pass
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self.open = False
+        self._conn.close()
+
+
+class SQLiteCursor(object):
+    '''pymysql-like Cursor translating MySQL placeholders'''
+
+    def __init__(self, cursor, as_dict, blocking=True):
+        self._cursor = cursor
+        self._as_dict = as_dict
+        self._blocking = blocking
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, query, args=None):
+        count('mysql_queries')
+        if self._blocking:
+            wait()
+        with _mysql_errors():
+            return self._cursor.execute(_translate(query), list(args or []))
+
+    def executemany(self, query, args):
+        # pymysql folds a multi-row INSERT into a single statement
+        count('mysql_queries')
+        if self._blocking:
+            wait()
+        with _mysql_errors():
+            return self._cursor.executemany(_translate(query), args)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._row(row) if row is not None else None
+
+    def fetchmany(self, size=None):
+        return [self._row(r) for r in self._cursor.fetchmany(size or 1)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+    def _row(self, row):
+        if not self._as_dict:
+            return row
+        names = [d[0] for d in self._cursor.description]
+        return dict(zip(names, row))
+
+
+@contextmanager
+def _mysql_errors():
+    '''Raise SQLite constraint violations as pymysql does for MySQL'''
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        if str(e).startswith('UNIQUE'):
+            raise IntegrityError(ER.DUP_ENTRY, str(e))
+        if str(e).startswith('NOT NULL'):
+            raise IntegrityError(ER.BAD_NULL_ERROR, str(e))
+        raise IntegrityError(ER.NO_REFERENCED_ROW_2, str(e))
+
+
+def _translate(query):
+    return query.replace(' FOR UPDATE', '').replace('%s', '?') \
+        .replace('%%', '%')
+
+
+def create_tables(path, schema):
+    '''Create SQLite tables from spec/mysql_schema.json'''
+    conn = sqlite3.connect(path)
+    for table in schema['tables']:
+        definitions = []
+        for col in table['columns']:
+            definition = col['name']
+            if col.get('auto_increment') or col.get('auto increment'):
+                definition += ' INTEGER PRIMARY KEY AUTOINCREMENT'
+            else:
+                if col['type'].lower() in ('int', 'bool', 'tinyint'):
+                    definition += ' INTEGER'
+                else:
+                    definition += ' TEXT'
+                if col.get('primary key') or col.get('primary'):
+                    definition += ' PRIMARY KEY'
+                elif col.get('unique'):
+                    definition += ' UNIQUE'
+                if col.get('not null'):
+                    definition += ' NOT NULL'
+                if col.get('default') is not None:
+                    definition += ' DEFAULT {}'.format(col['default'])
+            definitions.append(definition)
+        conn.execute('CREATE TABLE {} ({});'.format(
+            table['name'], ', '.join(definitions)
+        ))
+        for keyname in ('index', 'key', 'unique'):
+            for key in table_keys(table, keyname):
+                conn.execute('CREATE {}INDEX {} ON {} ({});'.format(
+                    'UNIQUE ' if keyname == 'unique' else '',
+                    key.get('name') or '_'.join(
+                        [table['name']] + key['columns']
+                    ),
+                    table['name'], ', '.join(key['columns'])
+                ))
+    conn.commit()
+    conn.close()
+
+
+class FakeRedis(object):
+    '''In-memory Redis stand-in speaking the redis-py client interface
+    Every command, and every pipeline execution, is one round-trip.'''
+
+    def __init__(self, store=None, blocking=True):
+        self.store = store or _Store()
+        self.connection_pool = FakeConnectionPool()
+        self._blocking = blocking
+
+    def execute_command(self, name, *args):
+        count('redis_round_trips')
+        self.store.connection()
+        if self._blocking:
+            wait()
+        return getattr(self.store, name)(*args)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.store, self._blocking)
+
+    def pubsub(self, **kwargs):
+        return FakePubSub(self.store)
+
+    def scan_iter(self, match=None):
+        count('redis_round_trips')
+        self.store.connection()
+        if self._blocking:
+            wait()
+        return iter(self.store.scan(match))
+
+    def register_script(self, script):
+        from redis.client import Script
+        return Script(self, script)
+
+
+class FakeConnectionPool(object):
+    def disconnect(self):
+        pass
+
+
+class FakePipeline(object):
+    '''Queue commands and run them in one round-trip'''
+
+    def __init__(self, store, blocking=True):
+        self.store = store
+        self._queue = []
+        self._blocking = blocking
+
+    def execute_command(self, name, *args):
+        self._queue.append((name, args))
+        return self
+
+    def execute(self):
+        count('redis_round_trips')
+        self.store.connection()
+        if self._blocking:
+            wait()
+        queued, self._queue = self._queue, []
+        return [getattr(self.store, name)(*args) for name, args in queued]
+
+
+class FakePubSub(object):
+    def __init__(self, store):
+        self.store = store
+        count('redis_connections')
+        self._messages = queue.Queue()
+
+    def subscribe(self, *channels):
+        for channel in channels:
+            self.store.subscribers.setdefault(channel, []).append(
+                self._messages
+            )
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0):
+        try:
+            return self._messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def _command(name):
+    def method(self, *args):
+        return self.execute_command(name, *args)
+    method.__name__ = name
+    return method
+
+
+for _name in ['get', 'mget', 'set', 'setex', 'delete', 'exists', 'hgetall',
+              'hsetnx', 'hincrby', 'hset', 'hdel', 'publish', 'script_load',
+              'evalsha', 'ping', 'pttl']:
+    setattr(FakeRedis, _name, _command(_name))
+    setattr(FakePipeline, _name, _command(_name))
+
+
+class _Store(object):
+    '''Key space shared by FakeRedis clients and pipelines'''
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.scripts = {}
+        self.subscribers = {}
+        self.threads = set()
+        self.lock = threading.RLock()
+
+    def connection(self):
+        '''Count a connection for each thread sending commands
+        redis-py's pool opens at most one per concurrently busy thread.'''
+        ident = threading.get_ident()
+        if ident not in self.threads:
+            with self.lock:
+                self.threads.add(ident)
+            count('redis_connections')
+
+    def _alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires < time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def get(self, key):
+        key = _key(key)
+        with self.lock:
+            return self.data.get(key) if self._alive(key) else None
+
+    def mget(self, keys, *more):
+        keys = list(keys) + list(more) if isinstance(keys, list) \
+            else [keys] + list(more)
+        return [self.get(_key(k)) for k in keys]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[_key(key)] = _value(value)
+            self.expires.pop(_key(key), None)
+        return True
+
+    def pttl(self, key):
+        key = _key(key)
+        with self.lock:
+            if not self._alive(key):
+                return -2
+            if key not in self.expires:
+                return -1
+            return int((self.expires[key] - time.time()) * 1000)
+
+    def setex(self, key, value, ttl):
+        # redis.Redis (not StrictRedis) takes the value before the ttl
+        with self.lock:
+            self.data[_key(key)] = _value(value)
+            self.expires[_key(key)] = time.time() + int(ttl)
+        return True
+
+    def delete(self, *keys):
+        with self.lock:
+            removed = 0
+            for key in map(_key, keys):
+                if self._alive(key):
+                    removed += 1
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return removed
+
+    def exists(self, key):
+        with self.lock:
+            return self._alive(_key(key))
+
+    def hgetall(self, key):
+        with self.lock:
+            if not self._alive(_key(key)):
+                return {}
+            return dict(self.data[_key(key)])
+
+    def hsetnx(self, key, field, value):
+        with self.lock:
+            hash_ = self.data.setdefault(_key(key), {})
+            if _value(field) in hash_:
+                return 0
+            hash_[_value(field)] = _value(value)
+            return 1
+
+    def hset(self, key, field, value):
+        with self.lock:
+            self.data.setdefault(_key(key), {})[_value(field)] = \
+                _value(value)
+            return 1
+
+    def hdel(self, key, *fields):
+        with self.lock:
+            hash_ = self.data.get(_key(key), {})
+            return len([
+                f for f in map(_value, fields) if hash_.pop(f, None)
+            ])
+
+    def hincrby(self, key, field, amount=1):
+        with self.lock:
+            hash_ = self.data.setdefault(_key(key), {})
+            value = int(hash_.get(_value(field), 0)) + int(amount)
+            hash_[_value(field)] = _value(value)
+            return value
+
+    def publish(self, channel, message):
+        channel = _key(channel)
+        for messages in self.subscribers.get(channel, []):
+            messages.put({
+                'type': 'message',
+                'channel': channel.encode(),
+                'data': _value(message),
+            })
+        return len(self.subscribers.get(channel, []))
+
+    def scan(self, match):
+        with self.lock:
+            return [k.encode() for k in list(self.data)
+                    if self._alive(k) and
+                    (match is None or fnmatch.fnmatchcase(k, match))]
+
+    def script_load(self, script):
+        sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+        self.scripts[sha] = script
+        return sha
+
+    def evalsha(self, sha, numkeys, *args):
+        if sha not in self.scripts:
+            raise NoScriptError('NOSCRIPT')
+        keys, argv = args[:numkeys], args[numkeys:]
+        implementation = SCRIPTS[self.scripts[sha].strip()]
+        with self.lock:
+            return implementation(self, list(keys), list(argv))
+
+    def ping(self):
+        return True
+
+
+def _issue_token(store, keys, argv):
+    token = store.get(_key(keys[0]))
+    if token and store.exists(token.decode()):
+        return token
+    store.setex(keys[1], argv[0], argv[1])
+    store.setex(keys[0], keys[1], argv[1])
+    return _value(keys[1])
+
+
+def _scripts():
+    '''Python implementations of the Lua scripts used by lib'''
+    from lib import user
+    return {
+        user._issue_token_script.script.strip(): _issue_token,
+    }
+
+
+class _LazyScripts(dict):
+    def __missing__(self, script):
+        self.update(_scripts())
+        return dict.__getitem__(self, script)
+
+
+SCRIPTS = _LazyScripts()
+
+
+def _key(key):
+    return key.decode() if isinstance(key, bytes) else str(key)
+
+
+def _value(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
@@ -1,12 +1,102 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
+import os
+
 output_dir = 'output'
 dns_conf_filename = 'charakoba.com.db'
+# number of {dns_conf_filename}.{serial}.ixfr diffs kept next to the zone
+dns_journal_keep = 30
 rproxy_conf_filename = '{host}.proxy.conf'
+# 'files': one server block per host in rproxy_conf_filename
+# 'map': one config (rproxy_map_conf_filename) with a `map $host` include
+rproxy_mode = 'files'
+rproxy_map_conf_filename = '_map.proxy.conf'
+rproxy_map_filename = 'rproxy.map'
+rproxy_keepalive = 16
+
+# run by output.py --reload / --watch when an output changed
+reload_commands = {
+    'dns': ['rndc', 'reload'],
+    'rproxy': ['nginx', '-s', 'reload'],
+}
+# output.py --watch: seconds of quiet before regenerating, longest wait
+# after the first change, and full regeneration interval
+output_debounce = 1
+output_max_delay = 10
+output_resync_interval = 3600
+# seconds to wait before a resync after a failed regeneration
+output_retry_delay = 5
+# proxy files are rendered and written in chunks over worker processes
+output_workers = os.cpu_count() or 1
+output_chunk_size = 256
 
 token_prefix = 'chapi'
 token_ttl = 24
+# 'uuid': random tokens kept in Redis, looked up on each token request
+# 'signed': HMAC-signed tokens carrying username, role and expiry, checked
+# without Redis (lib.tokens); signed tokens are accepted while token_secret
+# is set, and it must be the same in every worker. 'signed' without a
+# token_secret fails when lib.tokens is imported
+token_format = 'uuid'
+token_secret = None
+# seconds between full reloads of the revoked signed tokens
+token_revocation = {
+    'reload_interval': 60
+}
+
+# token -> (username, role, is_active) cache of each worker
+principal_cache = {
+    'maxsize': 1024,
+    'ttl': 60
+}
+
+# HMAC(username, password) -> (username, role, is_active) of recent logins
+credential_cache = {
+    'maxsize': 1024,
+    'ttl': 60
+}
+
+# hasher for new passwords; older hashes are upgraded at login
+# pick iterations for ~100ms per hash on the API host:
+#     python -m bench.hashers --target-ms 100
+password_hasher = {
+    'algorithm': 'pbkdf2_sha512',
+    'iterations': 100000
+}
+
+# (table, id) -> column values read through by BaseRecord(id_); changes
+# made elsewhere are dropped on the CHANGES channel, ttl bounds the rest
+record_cache = {
+    'maxsize': 4096,
+    'ttl': 60
+}
+
+# rendered /json bodies, keyed by table version
+listing_cache = {
+    'maxsize': 64,
+    'ttl': 300
+}
+
+# Content-Encoding of /json listings, in order of preference; 'br' is
+# used only with the brotli module installed. nginx must not gzip them.
+listing_compression = {
+    'encodings': ['br', 'gzip'],
+    'gzip_level': 6,
+    'brotli_quality': 5
+}
+
+# lib.warmup: preload in the uWSGI master before fork (and render every
+# /json listing there), open pool connections in each worker after fork
+warmup = {
+    'preload': True,
+    'listings': True,
+    'connections': True
+}
+
+# directory shared by the workers of an app to aggregate /metrics
+# (None: each worker reports only itself)
+metrics_dir = None
 
 mysql = {
     'host': 'localhost',
@@ -16,8 +106,33 @@ mysql = {
     'charset': 'utf8'
 }
 
+mysql_pool = {
+    'min_size': 1,
+    'max_size': 10,
+    'idle_timeout': 300,
+    'timeout': 10
+}
+
 redis = {
     'host': 'localhost',
     'port': 6389,
     'db': 0
 }
+
+# aio.py: asyncio server for the dns, rproxy and user APIs in one process
+aio = {
+    'host': '127.0.0.1',
+    'port': 8080
+}
+
+aio_mysql_pool = {
+    'min_size': 1,
+    'max_size': 50,
+    'idle_timeout': 300,
+    'timeout': 10
+}
+
+aio_redis_pool = {
+    'min_size': 1,
+    'max_size': 20
+}
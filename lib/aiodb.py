@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''aiodb
+asyncio MySQL pool for aio.py, the counterpart of lib.db
+'''
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiomysql
+import pymysql as DB
+
+import config
+from lib import metrics
+
+
+class AsyncConnectionPool(object):
+    '''asyncio MySQL Connection Pool
+    open() creates the aiomysql pool inside the running event loop.'''
+
+    def __init__(
+            self,
+            connect_kw,
+            min_size=1,
+            max_size=10,
+            idle_timeout=300,
+            timeout=10
+    ):
+        self.connect_kw = dict(connect_kw)
+        # aiomysql does not take PyMySQL's legacy `passwd`
+        if 'passwd' in self.connect_kw:
+            self.connect_kw['password'] = self.connect_kw.pop('passwd')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._pool = None
+        self._stats = {'checkouts': 0, 'timeouts': 0}
+
+    async def open(self):
+        '''Create the Pool and its min_size Connections'''
+        from lib.exceptions import DatabaseConnectionError
+
+        try:
+            self._pool = await aiomysql.create_pool(
+                minsize=self.min_size,
+                maxsize=self.max_size,
+                pool_recycle=self.idle_timeout,
+                **self.connect_kw
+            )
+        except (DB.err.MySQLError, OSError):
+            raise DatabaseConnectionError
+
+    async def close(self):
+        '''Close every Connection'''
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    async def get(self):
+        '''Check out a Connection, waiting at most timeout seconds'''
+        from lib.exceptions import DatabaseConnectionError
+
+        size = self._pool.size
+        try:
+            conn = await asyncio.wait_for(self._pool.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._stats['timeouts'] += 1
+            raise DatabaseConnectionError
+        except (DB.err.MySQLError, OSError):
+            raise DatabaseConnectionError
+        self._stats['checkouts'] += 1
+        if self._pool.size > size:
+            metrics.count('mysql_connections')
+        return conn
+
+    def put(self, conn):
+        '''Return a Connection to the Pool'''
+        self._pool.release(conn)
+
+    @asynccontextmanager
+    async def cursor(self, cursorclass=None):
+        '''Yield a Cursor; commit on success, rollback on error'''
+        conn = await self.get()
+        try:
+            if cursorclass is None:
+                cursor = await conn.cursor()
+            else:
+                cursor = await conn.cursor(cursorclass)
+            try:
+                yield _CountingCursor(cursor)
+                await conn.commit()
+            except:
+                await conn.rollback()
+                raise
+            finally:
+                await cursor.close()
+        except (DB.err.OperationalError, DB.err.InterfaceError):
+            conn.close()
+            raise
+        finally:
+            self.put(conn)
+
+    def stats(self):
+        '''Return Pool Statistics'''
+        stats = dict(self._stats)
+        size = self._pool.size if self._pool is not None else 0
+        idle = self._pool.freesize if self._pool is not None else 0
+        stats.update({
+            'size': size,
+            'idle': idle,
+            'in_use': size - idle,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+        })
+        return stats
+
+
+class _CountingCursor(object):
+    '''Cursor proxy counting queries for lib.metrics'''
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def execute(self, query, args=None):
+        metrics.count('mysql_queries')
+        return await self._cursor.execute(query, args)
+
+    async def executemany(self, query, args):
+        metrics.count('mysql_queries')
+        return await self._cursor.executemany(query, args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+pool = AsyncConnectionPool(config.mysql, **config.aio_mysql_pool)
+
+
+def cursor(cursorclass=None):
+    '''Shortcut for pool.cursor()'''
+    return pool.cursor(cursorclass)
+
+
+def stats():
+    '''Shortcut for pool.stats()'''
+    return pool.stats()
+
+
+metrics.register_gauges(
+    'charakoba_aio_mysql_pool_connections',
+    'asyncio MySQL pool connections by state',
+    lambda: {
+        (('state', state),): value
+        for state, value in pool.stats().items()
+        if state in ('size', 'idle', 'in_use')
+    }
+)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''aiokvs
+asyncio Redis client for aio.py, the counterpart of lib.kvs
+Invalidation messages are still received by the lib.kvs listener
+thread, which aio.py starts at startup.
+'''
+
+from hashlib import sha1
+
+import aioredis
+from aioredis.commands import Pipeline
+
+import config
+from lib import metrics
+
+# raised by aioredis for server replies and by the event loop for sockets
+REDIS_ERRORS = (aioredis.RedisError, OSError)
+
+_client = None
+
+
+async def connect():
+    '''Create the Redis pool of this process'''
+    global _client
+    _client = await aioredis.create_redis_pool(
+        (config.redis['host'], config.redis['port']),
+        db=config.redis.get('db', 0),
+        commands_factory=_CountingRedis,
+        minsize=config.aio_redis_pool['min_size'],
+        maxsize=config.aio_redis_pool['max_size']
+    )
+
+
+async def close():
+    '''Close the Redis pool'''
+    global _client
+    if _client is not None:
+        _client.close()
+        await _client.wait_closed()
+        _client = None
+
+
+def client():
+    '''Return the Redis client of this process'''
+    return _client
+
+
+class _CountingRedis(aioredis.Redis):
+    '''Redis commands counting round-trips for lib.metrics
+    A pipeline is counted once, as it is sent in one write.'''
+
+    def execute(self, command, *args, **kwargs):
+        metrics.count('redis_round_trips')
+        return super().execute(command, *args, **kwargs)
+
+    def pipeline(self):
+        metrics.count('redis_round_trips')
+        return Pipeline(self._pool_or_conn, aioredis.Redis)
+
+
+async def publish(channel, message):
+    '''Publish message to the other workers; failures are ignored'''
+    try:
+        await client().publish(channel, message)
+    except REDIS_ERRORS:
+        pass
+
+
+async def run_script(script, keys, args):
+    '''Run a redis.client.Script, one round-trip once it is loaded'''
+    digest = sha1(script.script.encode('utf-8')).hexdigest()
+    try:
+        return await client().evalsha(digest, keys, args)
+    except aioredis.ReplyError as e:
+        if not str(e).startswith('NOSCRIPT'):
+            raise
+    return await client().eval(script.script, keys, args)
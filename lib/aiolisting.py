@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''aiolisting
+conditional GET and per-version body cache for aio.py /json listings
+ETags, cached bodies and their compressed forms are the ones of
+lib.listing; compression runs in the default executor.
+'''
+
+from aiohttp import web
+import asyncio
+from email.utils import formatdate
+
+from lib import aiorecords, listing
+from lib.singleflight import AsyncGroup
+
+flights = AsyncGroup('listing')
+
+
+async def respond(request, record_class, params):
+    '''Serve aiorecords.iter_json(record_class, **params)
+    Answers 304 from the table version alone when the client is fresh.'''
+    from lib.exceptions import RedisConnectionError
+
+    record_class.check_listing(**params)
+    try:
+        version, mtime = await aiorecords.version(record_class)
+    except RedisConnectionError:
+        return await _stream(request, record_class, params)
+    etag, key = listing.tag(record_class, version, params)
+    encoding = listing.negotiate(request.headers.get('Accept-Encoding'))
+    headers = {
+        'Vary': 'Accept-Encoding',
+        'ETag': listing.encoded_tag(etag, encoding),
+        'Last-Modified': formatdate(mtime, usegmt=True),
+    }
+    if listing.not_modified(request.headers, etag, mtime):
+        return web.Response(status=304, headers=headers)
+    body = listing.bodies.get(key)
+    if body is None:
+        body = await flights.do(
+            key, lambda: _render(key, record_class, params)
+        )
+    if encoding is None:
+        return web.Response(
+            text=body, content_type='text/html', headers=headers
+        )
+    data = listing.encoded.get((key, encoding))
+    if data is None:
+        data = await flights.do(
+            (key, encoding), lambda: _compress(key, body, encoding)
+        )
+    headers['Content-Encoding'] = encoding
+    return web.Response(
+        body=data, content_type='text/html', charset='utf-8', headers=headers
+    )
+
+
+async def _render(key, record_class, params):
+    '''Read the listing into the body cache and return it'''
+    body = ''.join([
+        chunk async for chunk in aiorecords.iter_json(record_class, **params)
+    ])
+    listing.bodies.set(key, body)
+    return body
+
+
+async def _compress(key, body, encoding):
+    return await asyncio.get_running_loop().run_in_executor(
+        None, listing.compress, key, body, encoding
+    )
+
+
+async def _stream(request, record_class, params):
+    '''Stream the listing, when the table version is unknown
+    The first chunk is read before the response starts, so parameter
+    and database errors still get their own status.'''
+    chunks = aiorecords.iter_json(record_class, **params)
+    try:
+        first = await chunks.__anext__()
+        response = web.StreamResponse()
+        response.content_type = 'text/html'
+        await response.prepare(request)
+        await response.write(first.encode('utf-8'))
+        async for chunk in chunks:
+            await response.write(chunk.encode('utf-8'))
+        await response.write_eof()
+    finally:
+        await chunks.aclose()
+    return response
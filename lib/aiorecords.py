@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''aiorecords
+asyncio counterparts of the BaseRecord methods for aio.py
+Record classes still describe the tables and build the SQL; these
+functions take the class first and return plain dicts.
+'''
+
+from aiomysql import DictCursor as DC, SSDictCursor as SSDC
+import json
+
+from lib import aiodb, aiokvs
+from lib.superclass import _integrity_guard
+
+
+async def iter_json(record_class, after=None, limit=None, fields=None,
+                    **filters):
+    '''List up Records as JSON chunks, like BaseRecord.iter_json()'''
+    query, bind_values, columns = record_class.page_query(
+        after, limit, fields, **filters
+    )
+    async with aiodb.cursor(SSDC) as cursor:
+        await cursor.execute(query, bind_values)
+        yield '['
+        separator = ''
+        while True:
+            rows = await cursor.fetchmany(record_class.chunk_size)
+            if not rows:
+                break
+            yield separator + ', '.join(
+                json.dumps(record_class._row_to_dict(row, columns))
+                for row in rows
+            )
+            separator = ', '
+        yield ']'
+
+
+async def version(record_class):
+    '''Return (version, last modified time), like BaseRecord.version()'''
+    from lib.exceptions import RedisConnectionError
+
+    redis = aiokvs.client()
+    try:
+        state = await redis.hgetall(record_class._version_key())
+        if not state:
+            pipe = redis.pipeline()
+            record_class.queue_version_init(pipe)
+            state = (await pipe.execute())[-1]
+    except aiokvs.REDIS_ERRORS:
+        raise RedisConnectionError
+    return record_class.parse_version(state)
+
+
+async def get(record_class, id_):
+    '''Return the Record as {'id_': id_, column: value}'''
+    from lib.exceptions import RecordNotFoundError
+
+    async with aiodb.cursor(DC) as cursor:
+        await cursor.execute(record_class.select_sql, (id_, ))
+        row = await cursor.fetchone()
+    if not row:
+        raise RecordNotFoundError
+    return record_class._row_to_dict(
+        dict(row, id=id_), record_class.columns
+    )
+
+
+async def find_unique(record_class, value):
+    '''Return the Record whose unique_column is value, as get() does'''
+    from lib.exceptions import RecordNotFoundError
+
+    async with aiodb.cursor(DC) as cursor:
+        await cursor.execute(record_class.unique_query(), (value, ))
+        row = await cursor.fetchone()
+    if not row:
+        raise RecordNotFoundError
+    return record_class._row_to_dict(row, record_class.columns)
+
+
+async def create(record_class, column_values):
+    '''Create new Record'''
+    query, bind_values = record_class.insert_query(column_values)
+    with _integrity_guard():
+        async with aiodb.cursor() as cursor:
+            await cursor.execute(query, bind_values)
+    await _changed(
+        record_class,
+        [cursor.lastrowid],
+        record_class._keys_of(column_values)
+    )
+    return await get(record_class, cursor.lastrowid)
+
+
+async def update(record_class, id_, values):
+    '''Update Record'''
+    with _integrity_guard():
+        async with aiodb.cursor(DC) as cursor:
+            record = await _lock(cursor, record_class, id_)
+            keys = record_class._keys_of(record)
+            for column_name in record_class.columns:
+                if column_name in values:
+                    record[column_name] = values[column_name]
+            await cursor.execute(
+                record_class.update_sql,
+                [record[c] for c in record_class.columns] + [id_]
+            )
+    await _changed(record_class, [id_], keys + record_class._keys_of(record))
+    return record
+
+
+async def delete(record_class, id_):
+    '''Delete Record'''
+    async with aiodb.cursor(DC) as cursor:
+        record = await _lock(cursor, record_class, id_)
+        await cursor.execute(record_class.delete_sql, (id_, ))
+    await _changed(record_class, [id_], record_class._keys_of(record))
+
+
+async def _lock(cursor, record_class, id_):
+    '''Read and lock the Record in the transaction of cursor'''
+    from lib.exceptions import RecordNotFoundError
+
+    await cursor.execute(record_class.lock_query(1), (id_, ))
+    row = await cursor.fetchone()
+    if not row:
+        raise RecordNotFoundError
+    return record_class._row_to_dict(row, record_class.columns)
+
+
+async def _changed(record_class, ids=(), keys=()):
+    '''Bump the table version and announce the change on CHANGES'''
+    try:
+        pipe = aiokvs.client().pipeline()
+        record_class.queue_change(pipe, ids, keys)
+        await pipe.execute()
+    except aiokvs.REDIS_ERRORS:
+        pass
+
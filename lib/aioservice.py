@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''aioservice
+Service decorators and middleware for the aiohttp handlers of aio.py
+Decorated handlers take the aiohttp request first; everything else
+behaves like lib.service.Service.
+'''
+
+from aiohttp import web
+import asyncio
+import contextvars
+import functools
+import json
+import time
+
+from lib import aiouser, metrics
+from lib.common import message
+from lib.exceptions import CharakobaError
+from lib.service import Parameters
+from lib.user import Role
+
+
+class AsyncService(object):
+    '''Whole Service Class for asyncio handlers'''
+    @staticmethod
+    def auth(func):
+        '''Password-Base Authentication Decorator'''
+        from lib.exceptions import AuthenticationError
+
+        @functools.wraps(func)
+        async def inner(request, *a, **kw):
+            form = await _params(request)
+            username = form.get('username') or kw.get('username')
+            password = form.get('password')
+            if username is None or password is None:
+                raise AuthenticationError
+            user = await aiouser.authenticate(username, password)
+            if user is None:
+                raise AuthenticationError
+            return await func(request, user=user, *a, **kw)
+        return inner
+
+    @staticmethod
+    def token(func):
+        '''Token-base Authentication Decorator'''
+        from lib.exceptions import TokenError
+
+        @functools.wraps(func)
+        async def inner(request, *a, **kw):
+            token = (await _params(request)).get('token')
+            if token is None:
+                raise TokenError
+            user = await aiouser.from_token(token)
+            return await func(request, user=user, *a, **kw)
+        return inner
+
+    @staticmethod
+    def role(role):
+        '''Decorator Method Checking Role
+        Use after auth() decorator'''
+        from lib.exceptions import AuthenticationError
+
+        def outer(func):
+            @functools.wraps(func)
+            async def inner(request, *a, **kw):
+                user = kw.get('user')
+                if user is None:
+                    raise AuthenticationError
+                if not user.role <= Role[role]:
+                    raise AuthenticationError
+                return await func(request, *a, **kw)
+            return inner
+        return outer
+
+    @staticmethod
+    def require_param(*requirements):
+        '''Decorator Method Check the Request Parameter'''
+        from lib.exceptions import ParameterRequirementsError
+
+        def outer(func):
+            @functools.wraps(func)
+            async def inner(request, *a, **kw):
+                form = await _params(request)
+                params = Parameters()
+                for key in requirements:
+                    assert type(key) == str
+                    if key not in form:
+                        raise ParameterRequirementsError
+                    params[key] = form[key]
+                if kw.get('params'):
+                    params = params.update(kw['params'])
+                return await func(request, params=params, *a, **kw)
+            return inner
+        return outer
+
+    @staticmethod
+    def option_param(*options):
+        '''Decorator Method Check the Request Parameter'''
+        def outer(func):
+            @functools.wraps(func)
+            async def inner(request, *a, **kw):
+                form = await _params(request)
+                params = Parameters()
+                for key in options:
+                    assert type(key) == str
+                    if key in form:
+                        params[key] = form[key]
+                if kw.get('params'):
+                    params = params.update(kw['params'])
+                return await func(request, params=params, *a, **kw)
+            return inner
+        return outer
+
+    @staticmethod
+    def json_array(func):
+        '''Decorator Method Passing the JSON Array Request Body as items'''
+        from lib.exceptions import ParameterRequirementsError
+
+        @functools.wraps(func)
+        async def inner(request, *a, **kw):
+            try:
+                items = json.loads((await request.read()).decode('utf-8'))
+            except ValueError:
+                raise ParameterRequirementsError
+            if type(items) != list:
+                raise ParameterRequirementsError
+            return await func(request, items=items, *a, **kw)
+        return inner
+
+
+async def _params(request):
+    '''Query string and form values, like bottle's request.params'''
+    params = request.get('charakoba.params')
+    if params is None:
+        params = dict(request.query)
+        if request.content_type in ('application/x-www-form-urlencoded',
+                                    'multipart/form-data'):
+            params.update(await request.post())
+        request['charakoba.params'] = params
+    return params
+
+
+async def run_sync(func, *a):
+    '''Run a blocking lib function in the default executor
+    The request's metrics context goes along with it.'''
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(context.run, func, *a)
+    )
+
+
+def text(body, status=200):
+    '''Response with the Content-Type the Bottle apps answer with'''
+    return web.Response(status=status, text=body, content_type='text/html')
+
+
+async def serve_metrics(request):
+    '''GET /metrics handler'''
+    return web.Response(
+        body=metrics.render().encode('utf-8'),
+        headers={'Content-Type': 'text/plain; version=0.0.4'}
+    )
+
+
+def instrument(app_name):
+    '''Middleware recording per-route metrics and answering
+    CharakobaError and HTTP errors with message() bodies'''
+    @web.middleware
+    async def middleware(request, handler):
+        if request.match_info.handler is serve_metrics:
+            return await handler(request)
+        metrics.start_request()
+        started = time.time()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except CharakobaError as e:
+            status = e.status_code
+            return text(message(e.body), status)
+        except web.HTTPException as e:
+            status = e.status
+            if status < 400:
+                raise
+            return text(message(e.reason), status)
+        finally:
+            route = request.match_info.route
+            if route.resource is None:
+                label = 'unmatched'
+            else:
+                label = route.method + ' ' + route.resource.canonical
+            metrics.finish_request(app_name, label, str(status), started)
+    return middleware
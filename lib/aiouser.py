@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''aiouser
+asyncio counterparts of the User methods for aio.py
+Users are lib.user.User objects; the principal cache and the token
+issuing script are shared with the synchronous apps.
+'''
+
+from aiomysql import DictCursor as DC
+import asyncio
+
+import config
+from lib import aiodb, aiokvs, tokens
+from lib.singleflight import AsyncGroup
+from lib.user import (
+    Password, Role, User, _PRINCIPAL_CHANNEL, _discard_principal,
+    _issue_token_script, _token_index_key, principal_cache, remember_principal
+)
+
+
+# concurrent get(username) share one read
+lookups = AsyncGroup('user')
+
+
+async def get(username):
+    '''Return the User, like User(username)'''
+    row, token = await lookups.do(username, lambda: _read(username))
+    return User.from_row(username, row, token)
+
+
+async def _read(username):
+    from lib.exceptions import UserNotFoundError
+
+    async with aiodb.cursor(DC) as cursor:
+        await cursor.execute(User.select_sql, (username,))
+        row = await cursor.fetchone()
+    if not row:
+        raise UserNotFoundError
+    return row, await _get_token(username)
+
+
+async def create(username, password, role=Role.user.name):
+    '''Create New User'''
+    async with aiodb.cursor() as cursor:
+        await cursor.execute(
+            User.insert_sql,
+            (username, str(await _hash(password)), role, False)
+        )
+    return await get(username)
+
+
+async def authenticate(username, password):
+    '''Return the User if password is valid, else None
+    Like User.authenticate; hashing runs in the default executor.'''
+    user = User.remembered(username, password)
+    if user is not None:
+        return user
+    user = await get(username)
+    if user.password is None:
+        return None
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, user.password.verify, password):
+        return None
+    if user.password.must_update():
+        old, user.password = user.password, await _hash(password)
+        async with aiodb.cursor() as cursor:
+            await cursor.execute(
+                User.rehash_sql, (str(user.password), username, str(old))
+            )
+    user.remember(password)
+    return user
+
+
+async def from_token(token):
+    '''Get User From Token, using the principal cache
+    Signed tokens are checked locally, like in lib.service.'''
+    if tokens.is_signed(token):
+        username, role = tokens.verify(token)
+        return User.from_principal(token, username, Role[role], True)
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return User.from_principal(token, *principal)
+    username, pttl = await _get_username_from_token(token)
+    user = await get(username)
+    remember_principal(token, user, pttl)
+    return user
+
+
+async def activate(user):
+    '''Activate User'''
+    async with aiodb.cursor() as cursor:
+        await cursor.execute(User.activate_sql, (user.username,))
+    user.is_active = True
+    await invalidate_principal(user.username)
+
+
+async def update(user, password=None, role=None):
+    '''Update User Info'''
+    if password is not None:
+        password = await _hash(password)
+    change = user.apply_update(password, role)
+    if change is None:
+        return
+    async with aiodb.cursor() as cursor:
+        await cursor.execute(*change)
+    await invalidate_principal(user.username)
+    await revoke_tokens(user.username)
+
+
+async def get_token(user):
+    '''Return the current Token, issuing a new one if expired
+    With config.token_format 'signed', a new signed token each time.'''
+    from uuid import uuid4
+    from lib.exceptions import UserNotActivatedError, RedisConnectionError
+
+    if not user.is_active:
+        raise UserNotActivatedError
+    if config.token_format == 'signed':
+        user.token = tokens.sign(user.username, user.role)
+        return user.token
+    new_token = config.token_prefix + '-' + str(uuid4())
+    try:
+        token = await aiokvs.run_script(
+            _issue_token_script,
+            keys=[_token_index_key(user.username), new_token],
+            args=[user.username, config.token_ttl * 60 * 60]
+        )
+    except aiokvs.REDIS_ERRORS:
+        raise RedisConnectionError
+    user.token = token.decode()
+    return user.token
+
+
+async def delete(user):
+    '''Delete User'''
+    from lib.exceptions import RedisConnectionError
+
+    async with aiodb.cursor() as cursor:
+        await cursor.execute(User.delete_sql, (user.username,))
+    keys = [_token_index_key(user.username)]
+    if user.token:
+        keys.append(user.token)
+    try:
+        await aiokvs.client().delete(*keys)
+    except aiokvs.REDIS_ERRORS:
+        raise RedisConnectionError
+    await invalidate_principal(user.username)
+    await revoke_tokens(user.username)
+    user._clear()
+    del user.token
+
+
+async def invalidate_principal(username):
+    '''Drop cached principals of the User in every worker'''
+    _discard_principal(username)
+    await aiokvs.publish(_PRINCIPAL_CHANNEL, username)
+
+
+async def revoke_tokens(username):
+    '''Revoke the signed tokens of the User, like lib.tokens.revoke'''
+    from lib.exceptions import RedisConnectionError
+
+    if not tokens.enabled():
+        return
+    try:
+        pipe = aiokvs.client().pipeline()
+        tokens.queue_revocation(pipe, username)
+        await pipe.execute()
+    except aiokvs.REDIS_ERRORS:
+        raise RedisConnectionError
+
+
+async def _hash(password):
+    '''Password(password), off the event loop'''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, Password, password)
+
+
+async def _get_username_from_token(token):
+    from lib.exceptions import RedisConnectionError, TokenError
+
+    if not tokens.is_random(token):
+        # other keys, e.g. the username -> token index, are no tokens
+        raise TokenError
+    try:
+        pipe = aiokvs.client().pipeline()
+        pipe.get(token)
+        pipe.pttl(token)
+        username, pttl = await pipe.execute()
+    except aiokvs.REDIS_ERRORS:
+        raise RedisConnectionError
+    if username is None:
+        raise TokenError
+    return username.decode(), pttl
+
+
+async def _get_token(username):
+    from lib.exceptions import RedisConnectionError
+
+    try:
+        token = await aiokvs.client().get(_token_index_key(username))
+    except aiokvs.REDIS_ERRORS:
+        raise RedisConnectionError
+    if token is None:
+        return None
+    return token.decode()
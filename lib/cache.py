@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''cache
+bounded in-process caches
+'''
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    '''Thread-safe LRU Cache with per-entry TTL'''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        '''Return cached value, or default if missing or expired'''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        '''Store value, evicting the least recently used entry if full'''
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        '''Remove an entry'''
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_if(self, predicate):
+        '''Remove every entry whose (key, value) matches predicate'''
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items()
+                        if predicate(k, v)]:
+                del self._data[key]
+
+    def clear(self):
+        '''Remove every entry'''
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        '''Return Cache Statistics'''
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''db
+pooled MySQL connections shared by records, users and output
+'''
+
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+import pymysql as DB
+
+import config
+from lib import metrics
+
+
+class ConnectionPool(object):
+    '''Fork-safe MySQL Connection Pool'''
+
+    def __init__(
+            self,
+            connect,
+            connect_kw,
+            min_size=1,
+            max_size=10,
+            idle_timeout=300,
+            timeout=10
+    ):
+        self.connect = connect
+        self.connect_kw = connect_kw
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        '''Forget every Connection, e.g. after fork()
+        Inherited sockets are shared with the parent process, so they are
+        dropped without being closed.'''
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._idle = []
+        self._size = 0
+        self._stats = {
+            'opened': 0,
+            'closed': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'health_check_failures': 0,
+        }
+
+    def get(self):
+        '''Check out a healthy Connection
+        Idle Connections are pinged after the lock is released, so that
+        a slow or hung server only holds up the caller of that one.'''
+        from lib.exceptions import DatabaseConnectionError
+
+        if self._pid != os.getpid():
+            self.reset()
+        deadline = time.time() + self.timeout
+        while True:
+            with self._cond:
+                conn = self._checkout(deadline)
+            if conn is None:
+                break
+            if self._healthy(conn):
+                with self._cond:
+                    self._stats['checkouts'] += 1
+                return conn
+        try:
+            conn = self.connect(**self.connect_kw)
+        except DB.err.MySQLError:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise DatabaseConnectionError
+        with self._cond:
+            self._stats['opened'] += 1
+            self._stats['checkouts'] += 1
+        metrics.count('mysql_connections')
+        return conn
+
+    def put(self, conn):
+        '''Return a Connection to the Pool'''
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if conn.open:
+                self._idle.append((conn, time.time()))
+            else:
+                self._size -= 1
+                self._stats['closed'] += 1
+            self._cond.notify()
+
+    @contextmanager
+    def cursor(self, cursorclass=None):
+        '''Yield a Cursor; commit on success, rollback on error'''
+        conn = self.get()
+        try:
+            cursor = conn.cursor(cursorclass)
+            try:
+                yield _CountingCursor(cursor)
+                conn.commit()
+            except:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        except (DB.err.OperationalError, DB.err.InterfaceError):
+            self._discard(conn)
+            raise
+        except:
+            self.put(conn)
+            raise
+        else:
+            self.put(conn)
+
+    def clear(self):
+        '''Close idle Connections, e.g. in the uWSGI master before fork()'''
+        with self._cond:
+            idle, self._idle = self._idle, []
+            for conn, _ in idle:
+                self._close(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        '''Return Pool Statistics'''
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+        return stats
+
+    def _checkout(self, deadline):
+        '''Pop an idle Connection, or reserve room for a new one and
+        return None; called with the lock held'''
+        from lib.exceptions import DatabaseConnectionError
+
+        while True:
+            self._reap()
+            if self._idle:
+                conn, _ = self._idle.pop()
+                return conn
+            if self._size < self.max_size:
+                self._size += 1
+                return None
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise DatabaseConnectionError
+            self._stats['waits'] += 1
+            self._cond.wait(remaining)
+
+    def _healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+        except Exception:
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            self._discard(conn)
+            return False
+        return True
+
+    def _reap(self):
+        now = time.time()
+        keep = []
+        for conn, last_used in self._idle:
+            expired = now - last_used > self.idle_timeout
+            if expired and self._size > self.min_size:
+                self._close(conn)
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+
+    def _close(self, conn):
+        self._size -= 1
+        self._stats['closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _discard(self, conn):
+        with self._cond:
+            self._close(conn)
+            self._cond.notify()
+
+
+class _CountingCursor(object):
+    '''Cursor proxy counting queries for lib.metrics'''
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, args=None):
+        metrics.count('mysql_queries')
+        return self._cursor.execute(query, args)
+
+    def executemany(self, query, args):
+        metrics.count('mysql_queries')
+        return self._cursor.executemany(query, args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+pool = ConnectionPool(DB.connect, config.mysql, **config.mysql_pool)
+
+
+def cursor(cursorclass=None):
+    '''Shortcut for pool.cursor()'''
+    return pool.cursor(cursorclass)
+
+
+def stats():
+    '''Shortcut for pool.stats()'''
+    return pool.stats()
+
+
+metrics.register_gauges(
+    'charakoba_mysql_pool_connections',
+    'MySQL pool connections by state',
+    lambda: {
+        (('state', state),): value
+        for state, value in pool.stats().items()
+        if state in ('size', 'idle', 'in_use')
+    }
+)
+
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    pass
+else:
+    postfork(pool.reset)
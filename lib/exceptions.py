@@ -3,6 +3,7 @@
 
 from bottle import HTTPError
 
+from lib import metrics
 import lib.message as msg
 
 
@@ -19,6 +20,7 @@ class CharakobaError(HTTPError):
             **more_headers
     ):
         body = body or self.default_body
+        metrics.inc('charakoba_errors_total', {'error': type(self).__name__})
         super().__init__(status, body, exception, traceback, **more_headers)
 
 
@@ -27,6 +29,11 @@ class AuthenticationError(CharakobaError):
     default_body = msg.AUTH_ERROR
 
 
+class DatabaseConnectionError(CharakobaError):
+    default_status = 500
+    default_body = msg.DATABASE_CONNECTION_ERROR
+
+
 class ParameterRequirementsError(CharakobaError):
     default_status = 400
     default_body = msg.PARAM_ERROR
@@ -37,6 +44,11 @@ class PermissionError(CharakobaError):
     default_body = msg.PERMISSION_ERROR
 
 
+class RecordConflictError(CharakobaError):
+    default_status = 409
+    default_body = msg.RECORD_CONFLICT_ERROR
+
+
 class RecordNotFoundError(CharakobaError):
     default_status = 404
     default_body = msg.RECORD_NOT_FOUND_ERROR
@@ -56,6 +68,6 @@ class UserNotActivatedError(CharakobaError):
     default_body = msg.USER_NOT_ACTIVATED_ERROR
 
 
-class UserNotFoundError(HTTPError):
+class UserNotFoundError(CharakobaError):
     default_status = 404
     default_body = msg.USER_NOT_FOUND_ERROR
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''hashers
+password hashers, selected by the prefix of the stored hash
+New hashes use config.password_hasher; a hash made by another hasher,
+or with a lower cost, is reported by must_update() so that it can be
+replaced at the next successful login.
+'''
+
+import base64
+import hashlib
+import hmac
+import os
+import time
+
+import config
+
+
+class PBKDF2Hasher(object):
+    '''Salted PBKDF2-HMAC-SHA512
+    Stored as pbkdf2_sha512$<iterations>$<salt>$<hash>.'''
+    algorithm = 'pbkdf2_sha512'
+    digest = 'sha512'
+    salt_bytes = 16
+
+    def __init__(self, iterations=100000):
+        self.iterations = iterations
+
+    def encode(self, password, salt=None, iterations=None):
+        '''Return the stored form of password'''
+        if salt is None:
+            salt = _b64encode(os.urandom(self.salt_bytes))
+        iterations = iterations or self.iterations
+        derived = hashlib.pbkdf2_hmac(
+            self.digest, _to_bytes(password), salt.encode('ascii'), iterations
+        )
+        return '{}${}${}${}'.format(
+            self.algorithm, iterations, salt, _b64encode(derived)
+        )
+
+    def verify(self, password, encoded):
+        '''Return True if password matches the stored hash'''
+        try:
+            algorithm, iterations, salt, _ = encoded.split('$')
+            iterations = int(iterations)
+        except ValueError:
+            return False
+        if algorithm != self.algorithm:
+            return False
+        return hmac.compare_digest(
+            self.encode(password, salt, iterations), encoded
+        )
+
+    def must_update(self, encoded):
+        '''Return True if encoded was made with a lower cost'''
+        try:
+            return int(encoded.split('$')[1]) < self.iterations
+        except (IndexError, ValueError):
+            return True
+
+
+class SHA512Hasher(object):
+    '''Legacy unsalted hex SHA-512, verified only to be replaced'''
+    algorithm = 'sha512'
+
+    def __init__(self, **kw):
+        pass
+
+    def encode(self, password):
+        return hashlib.sha512(_to_bytes(password)).hexdigest()
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(self.encode(password), encoded)
+
+    def must_update(self, encoded):
+        return True
+
+
+# algorithm: hasher class
+HASHERS = {
+    PBKDF2Hasher.algorithm: PBKDF2Hasher,
+    SHA512Hasher.algorithm: SHA512Hasher,
+}
+
+
+def default_hasher():
+    '''Return the hasher configured in config.password_hasher'''
+    options = dict(config.password_hasher)
+    return HASHERS[options.pop('algorithm')](**options)
+
+
+def identify(encoded):
+    '''Return the hasher of a stored hash
+    Legacy hashes are bare hex digests without an algorithm prefix.'''
+    algorithm = encoded.split('$', 1)[0] if '$' in encoded else 'sha512'
+    hasher = default_hasher()
+    if hasher.algorithm == algorithm:
+        return hasher
+    return HASHERS.get(algorithm, SHA512Hasher)()
+
+
+def calibrate(target_ms, hasher_class=PBKDF2Hasher, rounds=5):
+    '''Return the iterations for one hash to take about target_ms here'''
+    iterations = 10000
+    while True:
+        elapsed = _time_hash(hasher_class(iterations), rounds)
+        if elapsed >= 0.05 or iterations >= 10 ** 8:
+            break
+        iterations *= 4
+    per_iteration = elapsed / iterations
+    return max(1000, int(target_ms / 1000 / per_iteration) // 1000 * 1000)
+
+
+def _time_hash(hasher, rounds):
+    '''Median seconds of one encode()'''
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        hasher.encode('calibration password')
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _to_bytes(str_or_bytes):
+    if type(str_or_bytes) == str:
+        return str_or_bytes.encode('utf-8')
+    return str_or_bytes
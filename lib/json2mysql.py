@@ -3,19 +3,37 @@
 
 '''json2mysql
 convert json table schema to mysql query
+
+    python -m lib.json2mysql spec/mysql_schema.json
+    python -m lib.json2mysql --migrate --dry-run spec/mysql_schema.json
+
+--migrate compares the schema with information_schema of config.mysql
+and applies online ALTER TABLE migrations (see build_migrations()).
 '''
 
+import argparse
 import json
-import sys
+import re
+import time
 
 
 def main():
-    args = sys.argv
-    if len(args) < 1:
-        print('{} filename'.format(args[0]))
-        quit()
-    schema = load_schema(args[1])
-    print(build_queries(schema))
+    parser = argparse.ArgumentParser(
+        description='convert json table schema to mysql query'
+    )
+    parser.add_argument('filename')
+    parser.add_argument('--migrate', action='store_true',
+                        help='alter the database of config.mysql to match')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='with --migrate, print the plan only')
+    parser.add_argument('--allow-copy', action='store_true',
+                        help='with --migrate, also run table copies')
+    args = parser.parse_args()
+    schema = load_schema(args.filename)
+    if args.migrate:
+        migrate(schema, dry_run=args.dry_run, allow_copy=args.allow_copy)
+    else:
+        print(build_queries(schema))
 
 
 def load_schema(filename):
@@ -45,9 +63,10 @@ def create_definitions(table):
     for col in table['columns']:
         defs.append(create_definition(col))
     for keyname in ['primary key', 'index', 'key', 'unique']:
-        if table.get(keyname):
-            key = table[keyname]
+        for key in table_keys(table, keyname):
             state = ' ' + keyname.upper()
+            if key.get('name'):
+                state += ' ' + key['name']
             state += index_type(key)
             state += '(' + ', '.join(key['columns']) + ')'
             defs.append(state)
@@ -72,7 +91,8 @@ def create_definition(col):
     return definition
 
 
-def column_definition(col):
+def column_definition(col, keys=True):
+    '''keys=False leaves out the key and reference clauses, for ALTER'''
     definition = data_type(col)
 
     if col.get('null'):
@@ -86,7 +106,9 @@ def column_definition(col):
     if col.get('auto_increment') or col.get('auto increment'):
         definition += ' AUTO_INCREMENT'
 
-    if col.get('unique'):
+    if not keys:
+        pass
+    elif col.get('unique'):
         definition += ' UNIQUE KEY'
     elif col.get('primary key') or col.get('primary'):
         definition += ' PRIMARY KEY'
@@ -100,7 +122,8 @@ def column_definition(col):
     if col.get('storage'):
         definition += ' STORAGE {}'.format(col['storage'])
 
-    definition += reference_definition(col)
+    if keys:
+        definition += reference_definition(col)
     return definition
 
 
@@ -179,6 +202,14 @@ def index_type(key):
     return ''
 
 
+def table_keys(table, keyname):
+    '''Return the keys declared under keyname, one dict or a list'''
+    keys = table.get(keyname) or []
+    if type(keys) == dict:
+        keys = [keys]
+    return keys
+
+
 def table_opts(table):
     opts = []
     if table.get('engine'):
@@ -201,5 +232,289 @@ def table_opts(table):
         opts.append('MIN_ROWS {}'.format(table['min_rows']))
     return ', '.join(opts)
 
+# migration phase, in the order applied
+PHASES = ['create table', 'add column', 'modify column', 'add index',
+          'drop index', 'extra column']
+
+INTEGER_TYPES = ['tinyint', 'smallint', 'mediumint', 'int', 'integer',
+                 'bigint']
+
+
+def migrate(schema, dry_run=False, allow_copy=False):
+    '''Bring the database of config.mysql to schema
+    Prints each step with its row estimate; with dry_run nothing is run.
+    Steps needing a table copy are skipped unless allow_copy.'''
+    import config
+    from lib import db
+    from pymysql.cursors import DictCursor
+
+    with db.cursor(DictCursor) as cursor:
+        live = read_live_schema(cursor, config.mysql['db'])
+    steps = build_migrations(schema, live)
+    if not steps:
+        print('-- up to date')
+    for step in steps:
+        print(format_step(step))
+        if dry_run or step['sql'] is None:
+            continue
+        if step['copy'] and not allow_copy:
+            print('-- skipped: table copy, rerun with --allow-copy')
+            continue
+        started = time.time()
+        with db.cursor() as cursor:
+            cursor.execute(step['sql'])
+        print('-- done in {:.1f}s'.format(time.time() - started))
+    return steps
+
+
+def read_live_schema(cursor, database):
+    '''Return {table: {'rows', 'columns', 'indexes'}} of database
+    rows is the estimate of information_schema.TABLES.'''
+    live = {}
+    cursor.execute(
+        'SELECT TABLE_NAME AS table_name, TABLE_ROWS AS table_rows '
+        'FROM information_schema.TABLES '
+        'WHERE TABLE_SCHEMA=%s;',
+        (database,)
+    )
+    for row in cursor.fetchall():
+        live[row['table_name']] = {
+            'rows': int(row['table_rows'] or 0),
+            'columns': {},
+            'indexes': {},
+        }
+    cursor.execute(
+        'SELECT TABLE_NAME AS table_name, COLUMN_NAME AS name, '
+        'COLUMN_TYPE AS type, IS_NULLABLE AS nullable, '
+        'COLUMN_DEFAULT AS `default`, EXTRA AS extra, '
+        'CHARACTER_MAXIMUM_LENGTH AS chars, '
+        'CHARACTER_OCTET_LENGTH AS octets '
+        'FROM information_schema.COLUMNS '
+        'WHERE TABLE_SCHEMA=%s '
+        'ORDER BY TABLE_NAME, ORDINAL_POSITION;',
+        (database,)
+    )
+    for row in cursor.fetchall():
+        live[row.pop('table_name')]['columns'][row['name']] = row
+    cursor.execute(
+        'SELECT TABLE_NAME AS table_name, INDEX_NAME AS name, '
+        'NON_UNIQUE AS non_unique, COLUMN_NAME AS column_name '
+        'FROM information_schema.STATISTICS '
+        'WHERE TABLE_SCHEMA=%s '
+        'ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX;',
+        (database,)
+    )
+    for row in cursor.fetchall():
+        indexes = live[row['table_name']]['indexes']
+        index = indexes.setdefault(row['name'], {
+            'columns': [], 'unique': not int(row['non_unique'])
+        })
+        index['columns'].append(row['column_name'])
+    return live
+
+
+def declared_indexes(table):
+    '''Return {index name: {'columns', 'unique'}} named as MySQL does'''
+    indexes = {}
+    for col in table['columns']:
+        if col.get('unique'):
+            indexes[col['name']] = {'columns': [col['name']], 'unique': True}
+        elif col.get('primary key') or col.get('primary'):
+            indexes['PRIMARY'] = {'columns': [col['name']], 'unique': True}
+    for keyname in ['primary key', 'index', 'key', 'unique']:
+        for key in table_keys(table, keyname):
+            if keyname == 'primary key':
+                name = 'PRIMARY'
+            else:
+                name = key.get('name') or key['columns'][0]
+            indexes[name] = {
+                'columns': list(key['columns']),
+                'unique': keyname in ['primary key', 'unique'],
+            }
+    return indexes
+
+
+def build_migrations(schema, live):
+    '''Return the ordered steps turning live into schema
+    Each step is a dict of table, phase, sql, copy (True if MySQL must
+    copy the table, blocking writes), rows (estimated rows read) and
+    note. ALTERs name ALGORITHM and LOCK, so that MySQL refuses instead
+    of silently falling back to a copy.'''
+    steps = []
+    for table in schema['tables']:
+        name = table['name']
+        if name not in live:
+            steps.append(_step(name, 'create table', build_create_table(table),
+                               note='new table'))
+            continue
+        current = live[name]
+        rows = current['rows']
+        previous = None
+        for col in table['columns']:
+            live_col = current['columns'].get(col['name'])
+            if live_col is None:
+                steps.append(_add_column(name, col, previous, rows))
+            else:
+                change = _column_change(col, live_col)
+                if change is not None:
+                    copy, rebuild, note = change
+                    steps.append(_alter(
+                        name, 'modify column',
+                        'MODIFY COLUMN ' + col['name'] + ' ' +
+                        column_definition(col, keys=False),
+                        copy=copy, rows=rows if rebuild or copy else 0,
+                        note=note
+                    ))
+            previous = col['name']
+        declared = declared_indexes(table)
+        for index_name, index in declared.items():
+            live_index = current['indexes'].get(index_name)
+            if live_index == index:
+                continue
+            clause = _add_index(index_name, index)
+            if live_index is not None:
+                clause = _drop_index(index_name) + ', ' + clause
+            steps.append(_alter(
+                name, 'add index', clause, rows=rows,
+                note=(index_name + ' changed' if live_index else index_name)
+            ))
+        for index_name in current['indexes']:
+            if index_name not in declared:
+                steps.append(_alter(
+                    name, 'drop index', _drop_index(index_name),
+                    copy=index_name == 'PRIMARY', rows=0, note=index_name
+                ))
+        declared_columns = [c['name'] for c in table['columns']]
+        for column_name in current['columns']:
+            if column_name not in declared_columns:
+                steps.append(_step(
+                    name, 'extra column', None,
+                    note=column_name + ' is not in the schema; left in place'
+                ))
+    steps.sort(key=lambda step: PHASES.index(step['phase']))
+    return steps
+
+
+def format_step(step):
+    '''Return a step as SQL with a comment line'''
+    if step['sql'] is None:
+        return '-- {table}: {note}'.format(**step)
+    if step['phase'] == 'create table':
+        return '-- {table}: {note}\n{sql}'.format(**step)
+    if step['copy']:
+        mode = 'TABLE COPY, writes blocked'
+    else:
+        mode = 'online'
+    comment = '-- {table}: {phase} {note}; ~{rows} rows, {mode}'.format(
+        mode=mode, **step
+    )
+    return comment + '\n' + step['sql']
+
+
+def _step(table, phase, sql, copy=False, rows=0, note=''):
+    return {'table': table, 'phase': phase, 'sql': sql, 'copy': copy,
+            'rows': rows, 'note': note}
+
+
+def _alter(table, phase, clause, copy=False, rows=0, note=''):
+    lock = 'ALGORITHM=COPY, LOCK=SHARED' if copy else \
+        'ALGORITHM=INPLACE, LOCK=NONE'
+    sql = 'ALTER TABLE {} {}, {};'.format(table, clause, lock)
+    return _step(table, phase, sql, copy=copy, rows=rows, note=note)
+
+
+def _add_column(table, col, previous, rows):
+    '''ADD COLUMN rebuilds in place, unless it is an auto_increment'''
+    clause = 'ADD COLUMN {} {}'.format(
+        col['name'], column_definition(col, keys=False)
+    )
+    clause += ' AFTER ' + previous if previous else ' FIRST'
+    copy = bool(col.get('auto_increment') or col.get('auto increment'))
+    return _alter(table, 'add column', clause, copy=copy, rows=rows,
+                  note=col['name'])
+
+
+def _add_index(name, index):
+    columns = '(' + ', '.join(index['columns']) + ')'
+    if name == 'PRIMARY':
+        return 'ADD PRIMARY KEY ' + columns
+    kind = 'UNIQUE INDEX' if index['unique'] else 'INDEX'
+    return 'ADD {} {} {}'.format(kind, name, columns)
+
+
+def _drop_index(name):
+    if name == 'PRIMARY':
+        return 'DROP PRIMARY KEY'
+    return 'DROP INDEX ' + name
+
+
+def _column_change(col, live_col):
+    '''Return (copy, rebuild, note) if col differs from live_col, or None
+    Follows the MySQL 5.7 online DDL rules for MODIFY COLUMN.'''
+    type_ = _normalize_type(data_type(col))
+    live_type = _normalize_type(live_col['type'])
+    not_null = bool(col.get('not null') or col.get('primary key') or
+                    col.get('primary'))
+    live_not_null = live_col['nullable'] == 'NO'
+    default = _normalize_default(col.get('default'))
+    live_default = _normalize_default(live_col['default'])
+    if type_ == live_type:
+        if not_null != live_not_null:
+            return False, True, '{} {}'.format(
+                col['name'], 'NOT NULL' if not_null else 'NULL'
+            )
+        if default != live_default:
+            return False, False, '{} default {}'.format(col['name'], default)
+        return None
+    note = '{} {} -> {}'.format(col['name'], live_type, type_)
+    if not_null != live_not_null:
+        return True, True, note
+    if _extends_varchar(type_, live_type, live_col) or \
+            _appends_members(type_, live_type):
+        return False, False, note
+    return True, True, note
+
+
+def _normalize_type(type_):
+    type_ = type_.lower().split(' character set')[0].split(' collate')[0]
+    type_ = re.sub(r',\s+', ',', type_.strip())
+    type_ = re.sub(r'^bool(ean)?$', 'tinyint', type_)
+    type_ = re.sub(r'^integer\b', 'int', type_)
+    # display widths, e.g. int(11), do not change storage
+    return re.sub(
+        r'^({})\(\d+\)'.format('|'.join(INTEGER_TYPES)), r'\1', type_
+    )
+
+
+def _normalize_default(default):
+    if default is None:
+        return None
+    return str(default).strip("'")
+
+
+def _extends_varchar(type_, live_type, live_col):
+    '''VARCHAR grown without crossing 255 bytes is changed in place'''
+    match = re.match(r'^varchar\((\d+)\)$', type_)
+    live_match = re.match(r'^varchar\((\d+)\)$', live_type)
+    if not (match and live_match):
+        return False
+    length, live_length = int(match.group(1)), int(live_match.group(1))
+    if length < live_length:
+        return False
+    bytes_per_char = (live_col['octets'] or live_length) // \
+        (live_col['chars'] or live_length)
+    return (length * bytes_per_char < 256) == \
+        (live_length * bytes_per_char < 256)
+
+
+def _appends_members(type_, live_type):
+    '''ENUM or SET members added at the end are a metadata change'''
+    match = re.match(r'^(enum|set)\((.*)\)$', type_)
+    live_match = re.match(r'^(enum|set)\((.*)\)$', live_type)
+    if not (match and live_match) or match.group(1) != live_match.group(1):
+        return False
+    return match.group(2).startswith(live_match.group(2))
+
+
 if __name__ == '__main__':
     main()
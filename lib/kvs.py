@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''kvs
+process-wide Redis client backed by a shared connection pool
+'''
+
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+from redis import Connection, ConnectionPool, Redis, RedisError
+
+import config
+from lib import metrics
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_pid = None
+_handlers = {}
+_periodic = []
+_listener_pid = None
+_listen_enabled = True
+
+
+def client():
+    '''Return the Redis client of this process'''
+    global _client, _pid
+    if _client is None or _pid != os.getpid():
+        reset()
+    if (_handlers or _periodic) and _listen_enabled and \
+            _listener_pid != _pid:
+        _start_listener()
+    return _client
+
+
+def reset(redis=None):
+    '''Re-create the Connection Pool, e.g. after fork()
+    A ready client may be given instead, e.g. a stand-in for benchmarks.'''
+    global _client, _pid
+    if redis is None:
+        redis = Redis(connection_pool=ConnectionPool(
+            connection_class=_CountingConnection,
+            **config.redis
+        ))
+    _client = redis
+    _pid = os.getpid()
+
+
+def disconnect():
+    '''Close the connections of this process' client'''
+    if _client is not None and _pid == os.getpid():
+        _client.connection_pool.disconnect()
+
+
+@contextmanager
+def no_listener():
+    '''Use the client without starting the listener thread
+    e.g. in the uWSGI master, whose threads would not survive fork().'''
+    global _listen_enabled
+    _listen_enabled = False
+    try:
+        yield
+    finally:
+        _listen_enabled = True
+
+
+class _CountingConnection(Connection):
+    '''Connection counting round-trips for lib.metrics
+    A pipeline is sent as one packed command.'''
+
+    def send_packed_command(self, command):
+        metrics.count('redis_round_trips')
+        return super().send_packed_command(command)
+
+
+def publish(channel, message):
+    '''Publish message to the other workers; failures are ignored'''
+    try:
+        client().publish(channel, message)
+    except RedisError:
+        pass
+
+
+def subscribe(channel, callback):
+    '''Call callback(message) for each message published on channel
+    Messages are received by one daemon thread per process, started on
+    first use of the client so that it runs in each forked worker.'''
+    _handlers.setdefault(channel, []).append(callback)
+
+
+def every(interval, callback):
+    '''Call callback() every interval seconds from the listener thread
+    It is also called each time the listener (re)connects, so state
+    kept current by subscribe() can be reloaded after missed messages.'''
+    _periodic.append((interval, callback))
+
+
+def _start_listener():
+    global _listener_pid
+    _listener_pid = os.getpid()
+    thread = threading.Thread(target=_listen, name='kvs-subscriber')
+    thread.daemon = True
+    thread.start()
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = client().pubsub(ignore_subscribe_messages=True)
+            subscribed = set()
+            due = {}
+            while True:
+                channels = set(_handlers) - subscribed
+                if channels:
+                    pubsub.subscribe(*channels)
+                    subscribed |= channels
+                now = time.monotonic()
+                for interval, callback in list(_periodic):
+                    if due.get(callback, now) <= now:
+                        _call(callback)
+                        due[callback] = now + interval
+                message = pubsub.get_message(timeout=1)
+                if message is None:
+                    continue
+                channel = message['channel'].decode()
+                for callback in _handlers.get(channel, []):
+                    _call(callback, message['data'].decode())
+        except RedisError:
+            time.sleep(1)
+
+
+def _call(callback, *args):
+    '''Run a callback of the listener; its errors must not end the thread
+    A RedisError still makes the listener reconnect.'''
+    try:
+        callback(*args)
+    except RedisError:
+        raise
+    except Exception:
+        logger.exception('kvs listener: %r failed', callback)
+
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    pass
+else:
+    postfork(reset)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''listing
+conditional GET and per-version body cache for /json listings
+Concurrent misses of the same body are rendered once (lib.singleflight).
+Bodies are compressed for the Accept-Encoding of the client, once per
+table version and coding; brotli is used when the module is installed.
+'''
+
+from bottle import parse_date, request, response
+from email.utils import formatdate
+import gzip
+import hashlib
+from urllib.parse import urlencode
+
+import config
+from lib.cache import LRUCache
+from lib.singleflight import Group
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+bodies = LRUCache(**config.listing_cache)
+# (body cache key, content coding) -> compressed body
+encoded = LRUCache(**config.listing_cache)
+flights = Group('listing')
+
+# content coding: compress(bytes) -> bytes
+ENCODERS = {
+    'gzip': lambda data: gzip.compress(
+        data, config.listing_compression['gzip_level']
+    ),
+}
+if brotli is not None:
+    ENCODERS['br'] = lambda data: brotli.compress(
+        data, quality=config.listing_compression['brotli_quality']
+    )
+
+
+def respond(record_class, params):
+    '''Serve record_class.iter_json(**params) with ETag/Last-Modified
+    Answers 304 from the table version alone when the client is fresh.'''
+    from lib.exceptions import RedisConnectionError
+
+    record_class.check_listing(**params)
+    try:
+        version, mtime = record_class.version()
+    except RedisConnectionError:
+        return record_class.iter_json(**params)
+    etag, key = tag(record_class, version, params)
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+    response.set_header('Vary', 'Accept-Encoding')
+    response.set_header('ETag', encoded_tag(etag, encoding))
+    response.set_header('Last-Modified', formatdate(mtime, usegmt=True))
+    if not_modified(request.headers, etag, mtime):
+        response.status = 304
+        return ''
+    body = bodies.get(key)
+    if body is None:
+        body = flights.do(key, lambda: render(key, record_class, params))
+    if encoding is None:
+        return body
+    response.set_header('Content-Encoding', encoding)
+    return encode(key, body, encoding)
+
+
+def prime(record_class):
+    '''Render the full listing into the body cache, e.g. before fork()'''
+    version, _ = record_class.version()
+    _, key = tag(record_class, version, {})
+    render(key, record_class, {})
+
+
+def render(key, record_class, params):
+    '''Read the listing into the body cache and return it'''
+    body = record_class.json(**params)
+    bodies.set(key, body)
+    return body
+
+
+def negotiate(accept_encoding):
+    '''Return the content coding of ENCODERS to use, or None
+    Highest q-value wins; on a tie the order of config wins.'''
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, *parameters = part.split(';')
+        q = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.replace(' ', '').partition('=')
+            if name.lower() == 'q':
+                try:
+                    q = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for coding in config.listing_compression['encodings']:
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if coding in ENCODERS and q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def encode(key, body, encoding):
+    '''Return body compressed with encoding, once per body cache key'''
+    data = encoded.get((key, encoding))
+    if data is None:
+        data = flights.do(
+            (key, encoding), lambda: compress(key, body, encoding)
+        )
+    return data
+
+
+def encoded_tag(etag, encoding):
+    '''ETag of the representation in encoding'''
+    if encoding is None:
+        return etag
+    return etag[:-1] + '-' + encoding + '"'
+
+
+def tag(record_class, version, params):
+    '''Return (ETag, body cache key) of a listing
+    The query is URL-encoded, so that distinct params never share a key.
+    params may be a lib.service.Parameters, which hides dict methods.'''
+    query = urlencode(sorted([(k, params[k]) for k in params]))
+    etag = '"{tablename}-{version}-{query}"'.format(
+        tablename=record_class.tablename,
+        version=version,
+        query=hashlib.sha1(query.encode('utf-8')).hexdigest()
+    )
+    return etag, (record_class.tablename, version, query)
+
+
+def not_modified(headers, etag, mtime):
+    '''Return True if the request headers show a fresh client copy
+    The copy may be in any content coding of the same version.'''
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        if '*' in tags:
+            return True
+        for encoding in [None] + list(ENCODERS):
+            current = encoded_tag(etag, encoding)
+            if current in tags or 'W/' + current in tags:
+                return True
+        return False
+    if_modified_since = parse_date(headers.get('If-Modified-Since', ''))
+    return bool(if_modified_since) and int(mtime) <= if_modified_since
+
+
+def compress(key, body, encoding):
+    '''Compress body into the encoded cache and return it'''
+    data = ENCODERS[encoding](body.encode('utf-8'))
+    encoded.set((key, encoding), data)
+    return data
@@ -1,6 +1,8 @@
 AUTH_ERROR = 'Authentication Error'
+DATABASE_CONNECTION_ERROR = 'Connect to Database is Refused'
 PARAM_ERROR = 'Parameter Not Valid'
 PERMISSION_ERROR = 'Permission Error'
+RECORD_CONFLICT_ERROR = 'Record Conflicts With Existing Record'
 RECORD_NOT_FOUND_ERROR = 'Record Not Found'
 REDIS_CONNECTION_ERROR = 'Connect to Redis is Refused'
 TOKEN_ERROR = 'Token Not Valid'
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''metrics
+request instrumentation exposed in Prometheus text format
+Each worker keeps its own counters and histograms and, when
+config.metrics_dir is set, dumps them to <metrics_dir>/<pid>.json so
+that /metrics on any worker reports the sum over live workers.
+'''
+
+import contextvars
+import json
+import os
+import threading
+import time
+
+import config
+
+DURATION_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+                    5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name: (type, help, buckets)
+METRICS = {
+    'charakoba_requests_total': (
+        'counter', 'Requests by app, route and status', None),
+    'charakoba_request_duration_seconds': (
+        'histogram', 'Request latency', DURATION_BUCKETS),
+    'charakoba_request_mysql_queries': (
+        'histogram', 'MySQL queries per request', COUNT_BUCKETS),
+    'charakoba_request_mysql_connections': (
+        'histogram', 'MySQL connections opened per request', COUNT_BUCKETS),
+    'charakoba_request_redis_round_trips': (
+        'histogram', 'Redis round-trips per request', COUNT_BUCKETS),
+    'charakoba_mysql_queries_total': (
+        'counter', 'MySQL queries', None),
+    'charakoba_mysql_connections_total': (
+        'counter', 'MySQL connections opened', None),
+    'charakoba_redis_round_trips_total': (
+        'counter', 'Redis round-trips', None),
+    'charakoba_errors_total': (
+        'counter', 'Raised CharakobaError by class', None),
+    'charakoba_record_cache_total': (
+        'counter', 'Record cache lookups by table and result', None),
+    'charakoba_singleflight_calls_total': (
+        'counter', 'Single-flight reads by group, executed or coalesced',
+        None),
+    'charakoba_signed_tokens_total': (
+        'counter', 'Signed token checks by result', None),
+}
+
+# per-request quantity: (histogram, total counter)
+_REQUEST_COUNTS = {
+    'mysql_queries': ('charakoba_request_mysql_queries',
+                      'charakoba_mysql_queries_total'),
+    'mysql_connections': ('charakoba_request_mysql_connections',
+                          'charakoba_mysql_connections_total'),
+    'redis_round_trips': ('charakoba_request_redis_round_trips',
+                          'charakoba_redis_round_trips_total'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = []
+_counts = contextvars.ContextVar('charakoba_request_counts', default=None)
+_last_dump = 0
+
+
+def inc(name, labels=None, n=1):
+    '''Add n to a counter'''
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def observe(name, labels, value):
+    '''Record value in a histogram'''
+    key = (name, _labels(labels))
+    buckets = METRICS[name][2]
+    with _lock:
+        state = _histograms.get(key)
+        if state is None:
+            state = _histograms[key] = [[0] * len(buckets), 0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                state[0][i] += 1
+        state[1] += value
+        state[2] += 1
+
+
+def count(name, n=1):
+    '''Count DB/Redis work of the current request
+    name is one of mysql_queries, mysql_connections, redis_round_trips.'''
+    counts = _counts.get()
+    if counts is not None:
+        counts[name] += n
+    inc(_REQUEST_COUNTS[name][1], n=n)
+
+
+def register_gauges(name, help_, collect):
+    '''Register collect() -> {labels dict as tuple: value}, read on scrape'''
+    METRICS[name] = ('gauge', help_, None)
+    _gauges.append((name, collect))
+
+
+def instrument(app, app_name):
+    '''WSGI middleware recording per-route metrics and serving /metrics'''
+    def middleware(environ, start_response):
+        if environ.get('PATH_INFO') == '/metrics':
+            body = render().encode('utf-8')
+            start_response('200 OK', [
+                ('Content-Type', 'text/plain; version=0.0.4'),
+                ('Content-Length', str(len(body))),
+            ])
+            return [body]
+        start_request()
+        state = {'started': time.time(), 'status': '500'}
+
+        def _start_response(status, headers, exc_info=None):
+            state['status'] = status.split()[0]
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = app(environ, _start_response)
+        except:
+            _finish(app_name, environ, state)
+            raise
+        return _ClosingIterator(body, app_name, environ, state)
+    return middleware
+
+
+class _ClosingIterator(object):
+    '''Record request metrics once the body has been sent'''
+
+    def __init__(self, body, app_name, environ, state):
+        self._body = body
+        self._args = (app_name, environ, state)
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            _finish(*self._args)
+
+
+def start_request():
+    '''Start counting DB/Redis work of the current request
+    Counts live in a context variable, so this works per thread under
+    WSGI and per task under asyncio.'''
+    _counts.set(dict.fromkeys(_REQUEST_COUNTS, 0))
+
+
+def finish_request(app_name, route, status, started):
+    '''Record metrics of the request started with start_request()'''
+    labels = {'app': app_name, 'route': route}
+    inc('charakoba_requests_total', dict(labels, status=status))
+    observe(
+        'charakoba_request_duration_seconds',
+        labels,
+        time.time() - started
+    )
+    counts = _counts.get() or {}
+    _counts.set(None)
+    for name, value in counts.items():
+        observe(_REQUEST_COUNTS[name][0], labels, value)
+    _maybe_dump()
+
+
+def _finish(app_name, environ, state):
+    route = environ.get('bottle.route')
+    route = route.method + ' ' + route.rule if route else 'unmatched'
+    finish_request(app_name, route, state['status'], state['started'])
+
+
+def snapshot():
+    '''Return metrics of this process as a JSON-able dict'''
+    with _lock:
+        counters = [[k[0], k[1], v] for k, v in _counters.items()]
+        histograms = [[k[0], k[1], s[0], s[1], s[2]]
+                      for k, s in _histograms.items()]
+    gauges = []
+    for name, collect in _gauges:
+        for labels, value in collect().items():
+            gauges.append([name, list(labels), value])
+    return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+
+def render():
+    '''Render metrics of every live worker in Prometheus text format'''
+    snapshots = [snapshot()]
+    if config.metrics_dir:
+        try:
+            dump(snapshots[0])
+            snapshots = list(_load_snapshots())
+        except OSError:
+            pass
+    counters, histograms, gauges = {}, {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            key = (name, _labels(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, sum_, count_ in snap['histograms']:
+            key = (name, _labels(labels))
+            state = histograms.setdefault(
+                key, [[0] * len(buckets), 0, 0]
+            )
+            state[0] = [a + b for a, b in zip(state[0], buckets)]
+            state[1] += sum_
+            state[2] += count_
+        for name, labels, value in snap['gauges']:
+            key = (name, _labels(labels))
+            gauges[key] = gauges.get(key, 0) + value
+    lines = []
+    for name in sorted(METRICS):
+        type_, help_, buckets = METRICS[name]
+        source = {'counter': counters, 'gauge': gauges,
+                  'histogram': histograms}[type_]
+        keys = sorted(k for k in source if k[0] == name)
+        if not keys:
+            continue
+        lines.append('# HELP {} {}'.format(name, help_))
+        lines.append('# TYPE {} {}'.format(name, type_))
+        for key in keys:
+            labels = key[1]
+            if type_ != 'histogram':
+                lines.append(_sample(name, labels, source[key]))
+                continue
+            counts, sum_, count_ = source[key]
+            for bound, value in zip(buckets, counts):
+                lines.append(_sample(
+                    name + '_bucket', labels + (('le', repr(bound)),), value
+                ))
+            lines.append(_sample(
+                name + '_bucket', labels + (('le', '+Inf'),), count_
+            ))
+            lines.append(_sample(name + '_sum', labels, sum_))
+            lines.append(_sample(name + '_count', labels, count_))
+    return '\n'.join(lines) + '\n'
+
+
+def dump(snap=None):
+    '''Write this process' snapshot to config.metrics_dir'''
+    if not config.metrics_dir:
+        return
+    os.makedirs(config.metrics_dir, exist_ok=True)
+    path = os.path.join(config.metrics_dir, '{}.json'.format(os.getpid()))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snap or snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def _maybe_dump():
+    global _last_dump
+    now = time.time()
+    if config.metrics_dir and now - _last_dump >= 1:
+        _last_dump = now
+        try:
+            dump()
+        except OSError:
+            pass
+
+
+def _load_snapshots():
+    for filename in os.listdir(config.metrics_dir):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(config.metrics_dir, filename)
+        try:
+            pid = int(filename[:-len('.json')])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            os.remove(path)
+            continue
+        except PermissionError:
+            pass
+        try:
+            with open(path) as f:
+                yield json.load(f)
+        except (IOError, ValueError):
+            continue
+
+
+def _labels(labels):
+    if labels is None:
+        return ()
+    if isinstance(labels, dict):
+        labels = labels.items()
+    return tuple(sorted((str(k), str(v)) for k, v in labels))
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join(
+            '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"'))
+            for k, v in labels
+        ) + '}'
+    return '{} {}'.format(name, repr(float(value)))
@@ -7,10 +7,17 @@ from lib.superclass import BaseRecord
 class DNSRecord(BaseRecord):
     '''DNS Record Class'''
     tablename = 'dns'
-    columns = ['type', 'host', 'ipv4_addr']
+    unique_column = 'host'
+    filters = {
+        'type': ('type', 'eq'),
+        'ipv4_prefix': ('ipv4_addr', 'prefix'),
+    }
 
 
 class ReverseProxyRecord(BaseRecord):
     '''Reverse Proxy Record Class'''
     tablename = 'rproxy'
-    columns = ['host', 'upstream']
+    unique_column = 'host'
+    filters = {
+        'upstream': ('upstream', 'eq'),
+    }
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''schema
+record classes generated from spec/mysql_schema.json
+The same file creates the tables (lib.json2mysql), so a column added
+there reaches the classes, their __slots__ and their SQL statements.
+'''
+
+import functools
+import os
+
+from lib.json2mysql import load_schema
+
+SCHEMA_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'spec', 'mysql_schema.json'
+)
+
+# column type: decoder of the value read by the driver
+# Types missing here are used as returned.
+DECODERS = {
+    'bool': bool,
+    'boolean': bool,
+}
+
+# column type: Python types of the values a request may give for it
+# Types missing here take strings.
+VALUE_TYPES = {
+    'int': (int,),
+    'bool': (bool,),
+    'boolean': (bool,),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def tables():
+    '''Return {name: table} of SCHEMA_FILE, read once per process'''
+    return {
+        table['name']: table for table in load_schema(SCHEMA_FILE)['tables']
+    }
+
+
+def primary_key(table):
+    '''Return the primary key column of table'''
+    for column in table['columns']:
+        if column.get('primary key') or column.get('primary'):
+            return column
+    raise ValueError('{}: no primary key in {}'.format(
+        table['name'], SCHEMA_FILE
+    ))
+
+
+def check(record_class):
+    '''Raise ValueError if record_class names a column its table lacks
+    Besides the columns and key read from the schema, this covers
+    unique_column, filters, decoders and ignored_columns of the class.'''
+    table = tables()[record_class.tablename]
+    named = set(record_class.columns) | {record_class.key}
+    named.update(getattr(record_class, 'ignored_columns', ()))
+    named.update(record_class.decoders)
+    if getattr(record_class, 'unique_column', None) is not None:
+        named.add(record_class.unique_column)
+    named.update(
+        column for column, _ in getattr(record_class, 'filters', {}).values()
+    )
+    missing = named - {c['name'] for c in table['columns']}
+    if missing:
+        raise ValueError('{}: no column {} in table {} of {}'.format(
+            record_class.__name__, ', '.join(sorted(missing)),
+            table['name'], SCHEMA_FILE
+        ))
+
+
+class RecordType(type):
+    '''Metaclass of the classes naming a `tablename`
+    Reads the table from the schema and sets, once per class:
+    `columns` (all but the primary key and `ignored_columns`), `key` and
+    `key_attribute`, `decoders` (over those given in the class body),
+    `value_types` of the columns,
+    `fields` as __slots__, and select_sql, insert_sql, update_sql and
+    delete_sql, each taking the key value last. `_queries` keeps the
+    statements a class builds on first use.'''
+
+    def __new__(mcs, name, bases, namespace):
+        if namespace.get('tablename') is not None:
+            namespace.update(_describe(namespace))
+        namespace.setdefault('__slots__', ())
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class Row(object, metaclass=RecordType):
+    '''Base of the generated classes'''
+    __slots__ = ()
+    tablename = None
+    columns = []
+    fields = ()
+    decoders = {}
+    value_types = {}
+
+    def _load(self, row):
+        '''Set the columns from a DictCursor row'''
+        decoders = self.decoders
+        for column_name in self.columns:
+            value = row[column_name]
+            if column_name in decoders and value is not None:
+                value = decoders[column_name](value)
+            setattr(self, column_name, value)
+
+    def _clear(self):
+        '''Drop every field, as after delete()'''
+        for name in self.fields:
+            if hasattr(self, name):
+                delattr(self, name)
+
+
+def _describe(namespace):
+    table = tables()[namespace['tablename']]
+    key = primary_key(table)
+    ignored = namespace.get('ignored_columns', ())
+    columns = [
+        c for c in table['columns']
+        if c is not key and c['name'] not in ignored
+    ]
+    column_names = [c['name'] for c in columns]
+    decoders = {
+        c['name']: DECODERS[c['type']]
+        for c in columns if c['type'] in DECODERS
+    }
+    decoders.update(namespace.get('decoders', {}))
+    value_types = {
+        c['name']: VALUE_TYPES.get(c['type'], (str,)) for c in columns
+    }
+    key_attribute = 'id_' if key['name'] == 'id' else key['name']
+    inserted = column_names
+    if not (key.get('auto_increment') or key.get('auto increment')):
+        inserted = [key['name']] + column_names
+    values = {
+        'tablename': table['name'],
+        'key': key['name'],
+        'columns': ', '.join(column_names),
+        'inserted': ', '.join(inserted),
+        'placeholders': ', '.join(['%s' for _ in inserted]),
+        'assignments': ', '.join([c + '=%s' for c in column_names]),
+    }
+    return {
+        'columns': column_names,
+        'insert_columns': inserted,
+        'key': key['name'],
+        'key_attribute': key_attribute,
+        'decoders': decoders,
+        'value_types': value_types,
+        'fields': tuple([key_attribute] + column_names),
+        '__slots__': tuple([key_attribute] + column_names) +
+        tuple(namespace.get('__slots__', ())),
+        'select_sql': 'SELECT {columns} FROM {tablename} '
+                      'WHERE {key}=%s;'.format(**values),
+        'insert_sql': 'INSERT INTO {tablename} ({inserted}) '
+                      'VALUES ({placeholders});'.format(**values),
+        'update_sql': 'UPDATE {tablename} SET {assignments} '
+                      'WHERE {key}=%s;'.format(**values),
+        'delete_sql': 'DELETE FROM {tablename} '
+                      'WHERE {key}=%s;'.format(**values),
+        '_queries': {},
+    }
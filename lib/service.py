@@ -3,10 +3,11 @@
 
 from bottle import request
 import functools
-from redis import Redis
+import json
+from redis import RedisError
 
-import config
-from lib.user import User, Role
+from lib import kvs, tokens
+from lib.user import User, Role, principal_cache, remember_principal
 
 
 class Service(object):
@@ -22,8 +23,8 @@ class Service(object):
             password = request.params.get('password')
             if username is None or password is None:
                 raise AuthenticationError
-            user = User(username)
-            if not user.password_auth(password):
+            user = User.authenticate(username, password)
+            if user is None:
                 raise AuthenticationError
             return func(user=user, *a, **kw)
         return inner
@@ -38,7 +39,7 @@ class Service(object):
             token = request.params.get('token')
             if token is None:
                 raise TokenError
-            user = User(Service._get_username_from_token(token))
+            user = Service._get_user_from_token(token)
             return func(user=user, *a, **kw)
         return inner
 
@@ -99,17 +100,55 @@ class Service(object):
             return inner
         return outer
 
+    @staticmethod
+    def json_array(func):
+        '''Decorator Method Passing the JSON Array Request Body as items'''
+        from lib.exceptions import ParameterRequirementsError
+
+        @functools.wraps(func)
+        def inner(*a, **kw):
+            try:
+                items = json.loads(request.body.read().decode('utf-8'))
+            except ValueError:
+                raise ParameterRequirementsError
+            if type(items) != list:
+                raise ParameterRequirementsError
+            return func(items=items, *a, **kw)
+        return inner
+
+    @staticmethod
+    def _get_user_from_token(token):
+        '''Get User From Token, using the principal cache
+        Signed tokens are checked locally, without Redis or MySQL.'''
+        if tokens.is_signed(token):
+            username, role = tokens.verify(token)
+            return User.from_principal(token, username, Role[role], True)
+        principal = principal_cache.get(token)
+        if principal is not None:
+            return User.from_principal(token, *principal)
+        username, pttl = Service._get_username_from_token(token)
+        user = User(username)
+        remember_principal(token, user, pttl)
+        return user
 
     @staticmethod
     def _get_username_from_token(token):
-        '''Get Username From Token'''
-        from lib.exceptions import TokenError
+        '''Return (username, remaining lifetime in ms) of a Token'''
+        from lib.exceptions import RedisConnectionError, TokenError
 
-        redis = Redis(**config.redis)
-        username = redis.get(token)
+        if not tokens.is_random(token):
+            # other keys, e.g. the username -> token index, are no tokens
+            raise TokenError
+        try:
+            pipe = kvs.client().pipeline()
+            pipe.get(token)
+            pipe.pttl(token)
+            username, pttl = pipe.execute()
+        except RedisError:
+            raise RedisConnectionError
         if username is None:
             raise TokenError
-        return username
+        return username.decode(), pttl
 
 
 class Parameters(dict):
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''singleflight
+coalescing of concurrent identical reads within a process
+While a call for a key is running, callers with the same key wait for
+it and share its result, or its exception, instead of running their own.
+Nothing is kept once the call returns; caching is up to the caller.
+'''
+
+import asyncio
+import functools
+import threading
+
+from lib import metrics
+
+
+class Group(object):
+    '''Single-flight calls of threads'''
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        '''Return func(), or the result of the running call for key'''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            _count(self.name, 'coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        _count(self.name, 'executed')
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncGroup(object):
+    '''Single-flight calls of asyncio tasks, for aio.py'''
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    async def do(self, key, func):
+        '''Return await func(), or the result of the running call for key
+        The call runs as a task of its own: a cancelled caller, leader
+        or not, stops waiting for it while the others get its result.'''
+        task = self._calls.get(key)
+        if task is None:
+            _count(self.name, 'executed')
+            task = self._calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(functools.partial(self._finish, key))
+        else:
+            _count(self.name, 'coalesced')
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # mark it retrieved, in case nobody is waiting any more
+            task.exception()
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _count(group, result):
+    metrics.inc('charakoba_singleflight_calls_total', {
+        'group': group, 'result': result
+    })
@@ -1,102 +1,636 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
+from contextlib import contextmanager
 import json
-import pymysql as DB
-from pymysql.cursors import DictCursor as DC
+import os
+from pymysql.constants import ER
+from pymysql.err import IntegrityError
+from pymysql.cursors import DictCursor as DC, SSDictCursor as SSDC
+import re
+from redis import RedisError
+import socket
+import time
 
 import config
+from lib import db, kvs, metrics
+from lib.cache import LRUCache
+from lib.exceptions import CharakobaError
+import lib.message as msg
+from lib.schema import Row
 
+# Redis channel of record change events, consumed by output.py --watch
+CHANGES = config.token_prefix + ':changes'
 
-class BaseRecord(object):
-    '''Super Class of Records'''
-    tablename = None
-    columns = []
+# (tablename, id) -> column values of recently read Records
+record_cache = LRUCache(**config.record_cache)
+
+
+class BaseRecord(Row):
+    '''Super Class of Records
+    Subclasses name a table of spec/mysql_schema.json, which gives their
+    columns, slots and SQL statements (see lib.schema.RecordType).'''
+    __slots__ = ()
+    unique_column = None
+    # listing parameter: (column, operator of _CONDITIONS)
+    filters = {}
+    chunk_size = 500
 
     @classmethod
-    def json(cls):
-        '''List up All Records'''
-        with DB.connect(cursorclass=DC, **config.mysql) as cursor:
-            cursor.execute(
-                'SELECT id '
-                'FROM {tablename};'.format(tablename=cls.tablename)
+    def json(cls, after=None, limit=None, fields=None, **filters):
+        '''List up Records as a JSON string'''
+        return ''.join(cls.iter_json(after, limit, fields, **filters))
+
+    @classmethod
+    def iter_json(cls, after=None, limit=None, fields=None, **filters):
+        '''List up Records as JSON chunks
+        Records are read with a single query ordered by id; `after` and
+        `limit` give keyset pagination, `fields` projects columns and
+        filters are parameters named in cls.filters.'''
+        query, bind_values, columns = cls.page_query(
+            after, limit, fields, **filters
+        )
+        with db.cursor(SSDC) as cursor:
+            cursor.execute(query, bind_values)
+            yield '['
+            separator = ''
+            while True:
+                rows = cursor.fetchmany(cls.chunk_size)
+                if not rows:
+                    break
+                yield separator + ', '.join(
+                    json.dumps(cls._row_to_dict(row, columns)) for row in rows
+                )
+                separator = ', '
+            yield ']'
+
+    @classmethod
+    def page_query(cls, after=None, limit=None, fields=None, **filters):
+        '''Return (query, bind values, columns) of a listing page'''
+        columns = cls._projection(fields)
+        names = sorted(filters)
+        cls._check_filters(filters)
+        bind_values = [
+            _filter_value(cls.filters[name][1], filters[name])
+            for name in names
+        ]
+        if after is not None:
+            bind_values.append(_to_int(after))
+        if limit is not None:
+            bind_values.append(_to_int(limit))
+        # queries of the full projection are built once per class
+        full = columns == cls.columns
+        cache_key = ('page', tuple(names), after is None, limit is None)
+        query = cls._queries.get(cache_key) if full else None
+        if query is None:
+            conditions = [
+                _CONDITIONS[cls.filters[name][1]].format(cls.filters[name][0])
+                for name in names
+            ]
+            if after is not None:
+                conditions.append('id>%s')
+            query = 'SELECT id, {columns} FROM {tablename}'.format(
+                columns=', '.join(columns),
+                tablename=cls.tablename
             )
-            rows = cursor.fetchall()
-        records = []
-        for row in rows:
-            records.append(cls(row['id']).__dict__)
-        return json.dumps(records)
+            if conditions:
+                query += ' WHERE ' + ' AND '.join(conditions)
+            query += ' ORDER BY id'
+            if limit is not None:
+                query += ' LIMIT %s'
+            query += ';'
+            if full:
+                cls._queries[cache_key] = query
+        return query, bind_values, columns
 
     @classmethod
-    def create(cls, **column_values):
-        '''Create new Record'''
+    def check_listing(cls, after=None, limit=None, fields=None, **filters):
+        '''Raise ParameterRequirementsError if page_query() would
+        reject the parameters; lib.listing checks them before keying
+        its caches.'''
+        cls._projection(fields)
+        for value in (after, limit):
+            if value is not None:
+                _to_int(value)
+        cls._check_filters(filters)
+
+    @classmethod
+    def _check_filters(cls, filters):
+        from lib.exceptions import ParameterRequirementsError
+
+        for name, value in filters.items():
+            if name not in cls.filters or not isinstance(value, str) or \
+                    not _FILTER_VALUE.fullmatch(value):
+                raise ParameterRequirementsError
+
+    @classmethod
+    def find_unique(cls, value):
+        '''Return the Record whose unique_column is value
+        One query on the unique index; the Record is cached by id.'''
+        from lib.exceptions import RecordNotFoundError
+
+        with db.cursor(DC) as cursor:
+            cursor.execute(cls.unique_query(), (value, ))
+            row = cursor.fetchone()
+        if not row:
+            raise RecordNotFoundError
+        record = cls.__new__(cls)
+        record.id_ = row['id']
+        record._load(row)
+        record._remember()
+        return record
+
+    @classmethod
+    def unique_query(cls):
+        '''Return the query reading one Record by unique_column'''
+        query = cls._queries.get('unique')
+        if query is None:
+            query = cls._queries['unique'] = (
+                'SELECT id, {columns} FROM {tablename} '
+                'WHERE {key}=%s;'.format(
+                    columns=', '.join(cls.columns),
+                    tablename=cls.tablename,
+                    key=cls.unique_column
+                )
+            )
+        return query
+
+    @classmethod
+    def insert_query(cls, column_values):
+        '''Return (query, bind values) inserting one Record'''
         bind_values = []
         for column_name in cls.columns:
             if column_name not in column_values:
                 raise KeyError
             bind_values.append(column_values[column_name])
-        with DB.connect(**config.mysql) as cursor:
-            cursor.execute(
-                'INSERT INTO {tablename} '
-                '({columns}) '
-                'VALUES ({placeholders});'.format(
-                    tablename=cls.tablename,
-                    columns=', '.join(cls.columns),
-                    placeholders=', '.join(['%s' for _ in cls.columns]),
-                ),
-                bind_values
+        return cls.insert_sql, bind_values
+
+    @classmethod
+    def version(cls):
+        '''Return (version, last modified time) of the table
+        The version is bumped by create(), update() and delete().'''
+        from lib.exceptions import RedisConnectionError
+
+        redis = kvs.client()
+        try:
+            state = redis.hgetall(cls._version_key())
+            if not state:
+                pipe = redis.pipeline()
+                cls.queue_version_init(pipe)
+                state = pipe.execute()[-1]
+        except RedisError:
+            raise RedisConnectionError
+        return cls.parse_version(state)
+
+    @classmethod
+    def queue_version_init(cls, pipe):
+        '''Queue the commands starting the version of the table
+        The last reply is the version hash, for parse_version().
+        Shared with lib.aiorecords, as are the two methods below.'''
+        key = cls._version_key()
+        now = time.time()
+        pipe.hsetnx(key, 'version', int(now * 1000))
+        pipe.hsetnx(key, 'mtime', now)
+        pipe.hgetall(key)
+
+    @staticmethod
+    def parse_version(state):
+        '''Return (version, last modified time) of a version hash'''
+        return int(state[b'version']), float(state[b'mtime'])
+
+    @classmethod
+    def queue_change(cls, pipe, ids=(), keys=()):
+        '''Queue the commands bumping the version and announcing the change
+        on CHANGES; ids leave the record cache of this process'''
+        key = cls._version_key()
+        for id_ in ids:
+            record_cache.pop((cls.tablename, id_))
+        pipe.hincrby(key, 'version', 1)
+        pipe.hset(key, 'mtime', time.time())
+        pipe.publish(CHANGES, cls.change_event(ids, keys))
+
+    @classmethod
+    def _changed(cls, ids=(), keys=()):
+        '''Bump the table version and announce the change on CHANGES
+        keys are the unique_column values touched, before and after.'''
+        try:
+            pipe = kvs.client().pipeline()
+            cls.queue_change(pipe, ids, keys)
+            pipe.execute()
+        except RedisError:
+            pass
+
+    @classmethod
+    def change_event(cls, ids=(), keys=()):
+        '''Return the message announcing a change on CHANGES'''
+        return json.dumps({
+            'table': cls.tablename,
+            'ids': sorted(ids),
+            'keys': sorted(set(keys)),
+            'origin': _origin(),
+        })
+
+    @classmethod
+    def _keys_of(cls, values):
+        if cls.unique_column is None or cls.unique_column not in values:
+            return []
+        return [values[cls.unique_column]]
+
+    @classmethod
+    def _version_key(cls):
+        return '{prefix}:version:{tablename}'.format(
+            prefix=config.token_prefix,
+            tablename=cls.tablename
+        )
+
+    @classmethod
+    def _projection(cls, fields):
+        from lib.exceptions import ParameterRequirementsError
+
+        if not fields:
+            return list(cls.columns)
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        fields = [f.strip() for f in fields if f.strip()]
+        if not fields or any(f not in cls.columns for f in fields):
+            raise ParameterRequirementsError
+        return fields
+
+    @classmethod
+    def _row_to_dict(cls, row, columns):
+        record = {'id_': row['id']}
+        for column_name in columns:
+            record[column_name] = row[column_name]
+        for column_name, decoder in cls.decoders.items():
+            if record.get(column_name) is not None:
+                record[column_name] = decoder(record[column_name])
+        return record
+
+    @classmethod
+    def create(cls, **column_values):
+        '''Create new Record'''
+        query, bind_values = cls.insert_query(column_values)
+        with _integrity_guard(), db.cursor() as cursor:
+            cursor.execute(query, bind_values)
+        cls._changed([cursor.lastrowid], cls._keys_of(column_values))
+        record = cls.__new__(cls)
+        record.id_ = cursor.lastrowid
+        record._load(column_values)
+        record._remember()
+        return record
+
+    @classmethod
+    def bulk_create(cls, items):
+        '''Create Records in a single transaction
+        Return one result dict per item, in order.'''
+        results = [None] * len(items)
+        rows = []
+        for index, item in enumerate(items):
+            if not _valid_item(item, cls.value_types, required=cls.columns):
+                results[index] = _result(400, msg.PARAM_ERROR)
+                continue
+            rows.append((index, [item[c] for c in cls.columns]))
+        if rows:
+            key_index = cls.columns.index(cls.unique_column)
+            keys = [values[key_index] for _, values in rows]
+            with _integrity_guard(), db.cursor(DC) as cursor:
+                cursor.executemany(
+                    cls.insert_sql, [values for _, values in rows]
+                )
+                ids = {}
+                for chunk in _chunks(keys, cls.chunk_size):
+                    cursor.execute(
+                        'SELECT id, {key} FROM {tablename} '
+                        'WHERE {key} IN ({placeholders});'.format(
+                            key=cls.unique_column,
+                            tablename=cls.tablename,
+                            placeholders=', '.join(['%s' for _ in chunk])
+                        ),
+                        chunk
+                    )
+                    for row in cursor.fetchall():
+                        ids[row[cls.unique_column]] = row['id']
+            for index, values in rows:
+                record = dict(zip(cls.columns, values))
+                record['id_'] = ids.get(values[key_index])
+                results[index] = _result(201, record=record)
+            cls._changed(ids.values(), keys)
+        return results
+
+    @classmethod
+    def bulk_update(cls, items):
+        '''Update Records in a single transaction
+        Each item is a dict with `id_` and the columns to change.'''
+        results = [None] * len(items)
+        changes = []
+        for index, item in enumerate(items):
+            if not _valid_item(item, cls.value_types, extra=('id_',)):
+                results[index] = _result(400, msg.PARAM_ERROR)
+                continue
+            try:
+                id_ = _to_int(item.get('id_'))
+            except CharakobaError:
+                results[index] = _result(400, msg.PARAM_ERROR)
+                continue
+            changes.append((index, id_, item))
+        if changes:
+            with _integrity_guard(), db.cursor(DC) as cursor:
+                current = cls._lock_rows(cursor, [c[1] for c in changes])
+                keys = []
+                for row in current.values():
+                    keys += cls._keys_of(row)
+                updated = {}
+                applied = []
+                for index, id_, item in changes:
+                    if id_ not in current:
+                        results[index] = _result(
+                            404, msg.RECORD_NOT_FOUND_ERROR
+                        )
+                        continue
+                    record = updated.setdefault(id_, current[id_])
+                    for column_name in cls.columns:
+                        if column_name in item:
+                            record[column_name] = item[column_name]
+                    applied.append((index, id_))
+                for chunk in _chunks(list(updated.items()), cls.chunk_size):
+                    cls._update_chunk(cursor, chunk)
+            for index, id_ in applied:
+                record = dict(updated[id_], id_=id_)
+                results[index] = _result(200, record=record)
+            if updated:
+                for record in updated.values():
+                    keys += cls._keys_of(record)
+                cls._changed(updated, keys)
+        return results
+
+    @classmethod
+    def bulk_delete(cls, items):
+        '''Delete Records in a single transaction
+        Each item is an id or a dict with `id_`.'''
+        results = [None] * len(items)
+        targets = []
+        for index, item in enumerate(items):
+            try:
+                if isinstance(item, dict):
+                    item = item.get('id_')
+                targets.append((index, _to_int(item)))
+            except CharakobaError:
+                results[index] = _result(400, msg.PARAM_ERROR)
+        if targets:
+            with db.cursor(DC) as cursor:
+                found = cls._lock_rows(cursor, [t[1] for t in targets])
+                for chunk in _chunks(list(found), cls.chunk_size):
+                    cursor.execute(
+                        'DELETE FROM {tablename} '
+                        'WHERE id IN ({placeholders});'.format(
+                            tablename=cls.tablename,
+                            placeholders=', '.join(['%s' for _ in chunk])
+                        ),
+                        chunk
+                    )
+            for index, id_ in targets:
+                if id_ in found:
+                    results[index] = _result(200, record={'id_': id_})
+                else:
+                    results[index] = _result(404, msg.RECORD_NOT_FOUND_ERROR)
+            if found:
+                keys = []
+                for row in found.values():
+                    keys += cls._keys_of(row)
+                cls._changed(found, keys)
+        return results
+
+    @classmethod
+    def _lock_rows(cls, cursor, ids):
+        '''SELECT ... FOR UPDATE the given ids; return {id: row}'''
+        rows = {}
+        for chunk in _chunks(sorted(set(ids)), cls.chunk_size):
+            cursor.execute(cls.lock_query(len(chunk)), chunk)
+            for row in cursor.fetchall():
+                id_ = row.pop('id')
+                rows[id_] = row
+        return rows
+
+    @classmethod
+    def lock_query(cls, count):
+        '''Return the SELECT ... FOR UPDATE of count ids
+        Writes read the rows they change with it, within their own
+        transaction: record_cache may hold values another writer changed.'''
+        return 'SELECT id, {columns} FROM {tablename} ' \
+            'WHERE id IN ({placeholders}) FOR UPDATE;'.format(
+                columns=', '.join(cls.columns),
+                tablename=cls.tablename,
+                placeholders=', '.join(['%s' for _ in range(count)])
             )
-        return cls(cursor.lastrowid)
+
+    @classmethod
+    def _update_chunk(cls, cursor, chunk):
+        '''UPDATE many rows with one statement using CASE id'''
+        assignments = []
+        bind_values = []
+        for column_name in cls.columns:
+            assignments.append('{column} = CASE id {cases} END'.format(
+                column=column_name,
+                cases=' '.join(['WHEN %s THEN %s' for _ in chunk])
+            ))
+            for id_, record in chunk:
+                bind_values += [id_, record[column_name]]
+        bind_values += [id_ for id_, _ in chunk]
+        cursor.execute(
+            'UPDATE {tablename} '
+            'SET {assignments} '
+            'WHERE id IN ({placeholders});'.format(
+                tablename=cls.tablename,
+                assignments=', '.join(assignments),
+                placeholders=', '.join(['%s' for _ in chunk])
+            ),
+            bind_values
+        )
 
     def __init__(self, id_):
         from lib.exceptions import RecordNotFoundError
 
         self.id_ = id_
-        with DB.connect(cursorclass=DC, **config.mysql) as cursor:
-            cursor.execute(
-                'SELECT {columns} '
-                'FROM {tablename} '
-                'WHERE id=%s;'.format(
-                    tablename=self.tablename,
-                    columns=', '.join(self.columns)
-                ),
-                (self.id_, )
-            )
+        values = record_cache.get((self.tablename, id_))
+        if values is not None:
+            _count_lookup(self.tablename, 'hit')
+            for column_name, value in zip(self.columns, values):
+                setattr(self, column_name, value)
+            return
+        _count_lookup(self.tablename, 'miss')
+        with db.cursor(DC) as cursor:
+            cursor.execute(self.select_sql, (self.id_, ))
             row = cursor.fetchone()
         if not row:
             raise RecordNotFoundError
-        for key, value in row.items():
-            setattr(self, key, value)
+        self._load(row)
+        self._remember()
+
+    def _remember(self):
+        '''Put the column values in record_cache'''
+        record_cache.set(
+            (self.tablename, self.id_),
+            tuple(getattr(self, c) for c in self.columns)
+        )
 
     def __repr__(self):
-        return self.__class__.__name__ + '({id_})'.formart(id_=self.id_)
+        return self.__class__.__name__ + '({id_})'.format(id_=self.id_)
 
     def __str__(self):
-        return str(self.__dict__)
+        return str(self.as_dict())
 
-    def update(self, **kw):
-        '''Update Record'''
-        # set new value to member if new value in kw
+    def as_dict(self):
+        '''Return {'id_': id_, column: value}'''
+        record = {'id_': self.id_}
         for column_name in self.columns:
-            if column_name in kw:
-                self.__dict__[column_name] = kw[column_name]
-        with DB.connect(**config.mysql) as cursor:
+            record[column_name] = getattr(self, column_name)
+        return record
+
+    def update(self, **kw):
+        '''Update Record
+        Only the columns in kw change; the others keep their values in
+        the database, not the ones this object may have from record_cache.'''
+        with _integrity_guard(), db.cursor(DC) as cursor:
+            self._reload_locked(cursor)
+            keys = self._keys_of(self.as_dict())
+            # set new value to member if new value in kw
+            for column_name in self.columns:
+                if column_name in kw:
+                    setattr(self, column_name, kw[column_name])
             cursor.execute(
-                'UPDATE {tablename} '
-                'SET {update_columns} '
-                'WHERE id=%s;'.format(
-                    tablename=self.tablename,
-                    update_columns=', '.join([c + '=%s' for c in self.columns])
-                ),
-                [self.__dict__[c] for c in self.columns] + [self.id_]
+                self.update_sql,
+                [getattr(self, c) for c in self.columns] + [self.id_]
             )
+        self._changed([self.id_], keys + self._keys_of(self.as_dict()))
+        self._remember()
 
     def delete(self):
         '''Delete Record'''
-        with DB.connect(**config.mysql) as cursor:
-            cursor.execute(
-                'DELETE FROM {tablename} '
-                'WHERE id=%s;'.format(tablename=self.tablename),
-                (self.id_, )
-            )
-        self.__dict__ = {}
+        with db.cursor(DC) as cursor:
+            self._reload_locked(cursor)
+            cursor.execute(self.delete_sql, (self.id_, ))
+        self._changed([self.id_], self._keys_of(self.as_dict()))
+        self._clear()
+
+    def _reload_locked(self, cursor):
+        '''Read and lock the row in the transaction of cursor'''
+        from lib.exceptions import RecordNotFoundError
+
+        row = self._lock_rows(cursor, [self.id_]).get(self.id_)
+        if row is None:
+            raise RecordNotFoundError
+        self._load(row)
+
+
+def _origin():
+    '''Identify this worker in change events'''
+    return '{}:{}'.format(_HOSTNAME, os.getpid())
+
+
+def _forget_changed(message):
+    '''Drop the Records changed by other workers from record_cache'''
+    event = json.loads(message)
+    if event.get('origin') == _origin():
+        return
+    for id_ in event['ids']:
+        record_cache.pop((event['table'], id_))
+
+
+def _count_lookup(tablename, result):
+    metrics.inc('charakoba_record_cache_total', {
+        'table': tablename, 'result': result
+    })
+
+
+_HOSTNAME = socket.gethostname()
+kvs.subscribe(CHANGES, _forget_changed)
+
+metrics.register_gauges(
+    'charakoba_record_cache_entries',
+    'Records held in the read-through cache of this worker',
+    lambda: {(): len(record_cache)}
+)
+
+
+# filter operator: condition on the column
+# LIKE patterns escape with '!', which MySQL and SQLite both accept.
+_CONDITIONS = {
+    'eq': '{}=%s',
+    'prefix': "{} LIKE %s ESCAPE '!'",
+}
+
+
+# filter values: host names, addresses and host:port, as stored
+_FILTER_VALUE = re.compile(r'[A-Za-z0-9.:_\[\]-]{1,255}')
+
+
+def _filter_value(operator, value):
+    '''Bind value of a filter'''
+    if operator == 'prefix':
+        for char in '!%_':
+            value = value.replace(char, '!' + char)
+        return value + '%'
+    return value
+
+
+# ids, offsets and limits given as strings
+_DIGITS = re.compile(r'[0-9]{1,20}')
+
+
+def _to_int(value):
+    '''Return value as a non-negative int
+    Only ints and decimal strings are taken: int() would also turn
+    true, 2.9 or ' 3' into ids.'''
+    from lib.exceptions import ParameterRequirementsError
+
+    if isinstance(value, str) and _DIGITS.fullmatch(value):
+        return int(value)
+    if type(value) is int and value >= 0:
+        return value
+    raise ParameterRequirementsError
+
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _result(status, message=None, record=None):
+    '''Result of one item of a bulk operation'''
+    result = {'status': status}
+    if message is not None:
+        result['message'] = message
+    if record is not None:
+        result['record'] = record
+    return result
+
+
+def _valid_item(item, value_types, required=(), extra=()):
+    '''Return True if item is a dict of known columns, each with a value
+    of one of its value_types (e.g. a string for host and address)
+    Checked before a bulk transaction, so that the driver never sees a
+    nested value nor turns true into "1". Values of extra names are left
+    to the caller.'''
+    if not isinstance(item, dict):
+        return False
+    if any(name not in item for name in required):
+        return False
+    return all(
+        name in extra or
+        name in value_types and type(value) in value_types[name]
+        for name, value in item.items()
+    )
+
+
+@contextmanager
+def _integrity_guard():
+    '''Turn duplicate key errors into RecordConflictError and other
+    constraint violations (e.g. NOT NULL) into ParameterRequirementsError'''
+    from lib.exceptions import ParameterRequirementsError, RecordConflictError
+
+    try:
+        yield
+    except IntegrityError as e:
+        if e.args and e.args[0] == ER.DUP_ENTRY:
+            raise RecordConflictError
+        raise ParameterRequirementsError
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''template
+config templates in templates/, loaded and checked once per process
+'''
+
+import os
+from string import Formatter
+
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'templates'
+)
+
+_templates = {}
+
+
+class TemplateError(ValueError):
+    '''Template does not match its expected placeholders'''
+
+
+class Template(object):
+    '''str.format() Template parsed and validated at load time'''
+
+    def __init__(self, text, name='<string>', fields=None):
+        self.name = name
+        self.text = text
+        self.fields = set()
+        try:
+            for _, field_name, _, _ in Formatter().parse(text):
+                if field_name is not None:
+                    self.fields.add(field_name)
+        except ValueError as e:
+            raise TemplateError('{}: {}'.format(name, e))
+        if fields is not None and self.fields != set(fields):
+            raise TemplateError('{}: expected {{{}}}, found {{{}}}'.format(
+                name,
+                ', '.join(sorted(fields)),
+                ', '.join(sorted(self.fields))
+            ))
+        if any(not f.isidentifier() for f in self.fields):
+            raise TemplateError('{}: placeholders must be names'.format(name))
+        self.render = text.format
+
+    def __repr__(self):
+        return self.__class__.__name__ + '({})'.format(self.name)
+
+
+def load(name, fields=None):
+    '''Return the compiled templates/<name>.tmpl, reading it only once'''
+    template = _templates.get(name)
+    if template is None:
+        with open(os.path.join(TEMPLATE_DIR, name + '.tmpl'), 'r') as f:
+            template = Template(f.read(), name, fields)
+        _templates[name] = template
+    elif fields is not None and template.fields != set(fields):
+        raise TemplateError('{}: unexpected placeholders'.format(name))
+    return template
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''tokens
+HMAC-signed access tokens, checked without Redis
+A token is <token_prefix>.<payload>.<signature>, the payload carrying
+username, role, issue and expiry time. Revoking a user's tokens stores
+"revoked before" in a Redis hash; each process keeps a copy, reloaded
+by the lib.kvs listener thread and updated by its messages.
+'''
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from redis import RedisError
+
+import config
+from lib import kvs, metrics
+
+REVOKED_KEY = config.token_prefix + ':revoked'
+REVOKED_CHANNEL = config.token_prefix + ':invalidate:token'
+
+# username -> milliseconds; tokens issued until then are revoked
+_revoked = {}
+_loaded_pid = None
+# guards _revoked between reload() and the listener's _apply()
+_lock = threading.Lock()
+
+
+def check_config():
+    '''Raise ValueError if config.token_format cannot be served
+    Runs when this module is imported, so that a worker fails at startup
+    rather than on its first token request.'''
+    if config.token_format not in ('uuid', 'signed'):
+        raise ValueError('config.token_format: {!r} is neither uuid nor '
+                         'signed'.format(config.token_format))
+    if config.token_format == 'signed' and not config.token_secret:
+        raise ValueError('config.token_format is signed, but '
+                         'config.token_secret is not set')
+
+
+def enabled():
+    '''Return True if signed tokens are accepted'''
+    return bool(config.token_secret)
+
+
+def is_signed(token):
+    '''Return True if token has the signed format'''
+    return token.startswith(config.token_prefix + '.')
+
+
+def is_random(token):
+    '''Return True if token has the format of a token kept in Redis'''
+    return token.startswith(config.token_prefix + '-')
+
+
+def sign(username, role):
+    '''Return a new token of username with role (a lib.user.Role)'''
+    issued = _now_ms()
+    expires = issued // 1000 + config.token_ttl * 60 * 60
+    payload = _b64encode(json.dumps(
+        [username, role.name, issued, expires], separators=(',', ':')
+    ).encode('utf-8'))
+    signed = config.token_prefix + '.' + payload
+    return signed + '.' + _signature(signed)
+
+
+def verify(token):
+    '''Return (username, role name) of a valid signed token
+    Raises TokenError if it is forged, expired or revoked.'''
+    from lib.exceptions import TokenError
+
+    signed, _, signature = token.rpartition('.')
+    if not enabled() or not hmac.compare_digest(
+            _signature(signed), signature):
+        _count('invalid')
+        raise TokenError
+    try:
+        username, role, issued, expires = json.loads(
+            _b64decode(signed[len(config.token_prefix) + 1:]).decode('utf-8')
+        )
+    except ValueError:
+        _count('invalid')
+        raise TokenError
+    if expires <= time.time():
+        _count('expired')
+        raise TokenError
+    if issued <= _revocations().get(username, -1):
+        _count('revoked')
+        raise TokenError
+    _count('valid')
+    return username, role
+
+
+def revoke(username):
+    '''Revoke every token of username issued until now, if enabled()'''
+    from lib.exceptions import RedisConnectionError
+
+    if not enabled():
+        return
+    try:
+        pipe = kvs.client().pipeline()
+        queue_revocation(pipe, username)
+        pipe.execute()
+    except RedisError:
+        raise RedisConnectionError
+
+
+def queue_revocation(pipe, username):
+    '''Apply a revocation locally and queue storing and publishing it
+    Shared with lib.aiouser, whose pipeline is awaited instead.'''
+    revoked_before = _now_ms()
+    message = json.dumps([username, revoked_before])
+    _apply(message)
+    pipe.hset(REVOKED_KEY, username, revoked_before)
+    pipe.publish(REVOKED_CHANNEL, message)
+
+
+def reload():
+    '''Merge the revocations in Redis into the local ones
+    Entries older than config.token_ttl only concern expired tokens;
+    they are dropped, here and in Redis. _revoked is updated in place,
+    so that a revocation applied meanwhile is kept.'''
+    global _loaded_pid
+    if not enabled():
+        return
+    redis = kvs.client()
+    oldest = _now_ms() - config.token_ttl * 60 * 60 * 1000
+    revoked, stale = {}, []
+    for username, revoked_before in redis.hgetall(REVOKED_KEY).items():
+        if int(revoked_before) < oldest:
+            stale.append(username)
+        else:
+            revoked[username.decode()] = int(revoked_before)
+    if stale:
+        redis.hdel(REVOKED_KEY, *stale)
+    with _lock:
+        for username, revoked_before in list(_revoked.items()):
+            if revoked_before < oldest:
+                del _revoked[username]
+        for username, revoked_before in revoked.items():
+            if revoked_before > _revoked.get(username, -1):
+                _revoked[username] = revoked_before
+    _loaded_pid = os.getpid()
+
+
+def _revocations():
+    '''Return the local revocations, loaded once per process
+    If Redis cannot be reached, the listener thread loads them later.'''
+    global _loaded_pid
+    if _loaded_pid != os.getpid():
+        try:
+            reload()
+        except RedisError:
+            _loaded_pid = os.getpid()
+    return _revoked
+
+
+def _apply(message):
+    username, revoked_before = json.loads(message)
+    with _lock:
+        if revoked_before > _revoked.get(username, -1):
+            _revoked[username] = revoked_before
+
+
+def _signature(signed):
+    return _b64encode(hmac.new(
+        config.token_secret.encode('utf-8'), signed.encode('utf-8'),
+        hashlib.sha256
+    ).digest())
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _count(result):
+    metrics.inc('charakoba_signed_tokens_total', {'result': result})
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+check_config()
+kvs.subscribe(REVOKED_CHANNEL, _apply)
+kvs.every(config.token_revocation['reload_interval'], reload)
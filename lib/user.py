@@ -2,22 +2,28 @@
 # -*- coding:utf-8 -*-
 
 from enum import Enum
+import hmac
 import json
-import pymysql as DB
+import os
 from pymysql.cursors import DictCursor as DC
-from redis import Redis
+from redis import RedisError
+from redis.client import Script
 
 import config
+from lib import db, hashers, kvs, tokens
+from lib.cache import LRUCache
+from lib.schema import Row
+from lib.singleflight import Group
 
 
 class Password(object):
     '''Enhashed Password Class
-    This class provide comparable enhashed password'''
-    from hashlib import sha512
+    This class holds a salted hash made by lib.hashers'''
+    __slots__ = ('hasher', 'password')
 
-    def __init__(self, password, alg=sha512):
-        self.alg = alg
-        self.password = self.alg(self._to_bytes(password)).hexdigest()
+    def __init__(self, password, hasher=None):
+        self.hasher = hasher or hashers.default_hasher()
+        self.password = self.hasher.encode(password)
 
     def __eq__(self, other):
         if other is None or not type(other) == type(self):
@@ -27,15 +33,19 @@ class Password(object):
     def __repr__(self):
         return self.password
 
-    def _to_bytes(self, str_or_bytes):
-        if type(str_or_bytes) == str:
-            return str_or_bytes.encode('utf-8')
-        else:
-            return str_or_bytes
+    def verify(self, password):
+        '''Return True if password matches this hash'''
+        return self.hasher.verify(password, self.password)
+
+    def must_update(self):
+        '''Return True if this hash is legacy or below the current cost'''
+        return self.hasher.must_update(self.password)
 
     @classmethod
     def get_instance(cls, password):
-        instance = cls('')
+        '''Wrap a stored hash'''
+        instance = cls.__new__(cls)
+        instance.hasher = hashers.identify(password)
         instance.password = password
         return instance
 
@@ -53,38 +63,72 @@ class Role(Enum):
         return self.value <= Role(other).value
 
 
-class User(object):
-    '''Service User Class'''
+class User(Row):
+    '''Service User Class
+    Columns and SQL come from the users table of spec/mysql_schema.json'''
+    tablename = 'users'
+    ignored_columns = ('is_delete',)
+    decoders = {
+        'password': Password.get_instance,
+        'role': lambda role: Role[role],
+    }
+    __slots__ = ('token',)
+    # shared with lib.aiouser, as are the methods building statements
+    activate_sql = 'UPDATE users SET is_active=1 WHERE username=%s;'
+    # replaces the hash only if it did not change in the meantime
+    rehash_sql = 'UPDATE users SET password=%s ' \
+        'WHERE username=%s AND password=%s;'
+
     @classmethod
     def create(cls, username, password, role=Role.user.name):
         '''this method create New User'''
-        with DB.connect(**config.mysql) as cursor:
+        with db.cursor() as cursor:
             cursor.execute(
-                'INSERT INTO users '
-                '(username, password, role) '
-                'VALUES (%s, %s, %s);',
-                (username, str(Password(password)), role)
+                cls.insert_sql,
+                (username, str(Password(password)), role, False)
             )
-        return cls(cursor.lastrowid)
+        return cls(username)
 
     def __init__(self, username):
+        self.username = username
+        row, token = lookups.do(username, lambda: self._read(username))
+        self._set_row(row, token)
+
+    @classmethod
+    def _read(cls, username):
+        '''Return (users row, token) of the User'''
         from lib.exceptions import UserNotFoundError
 
-        self.username = username
-        with DB.connect(cursorclass=DC, **config.mysql) as cursor:
-            cursor.execute(
-                'SELECT password, role, is_active '
-                'FROM users '
-                'WHERE username=%s;',
-                (self.username,)
-            )
+        with db.cursor(DC) as cursor:
+            cursor.execute(cls.select_sql, (username,))
             row = cursor.fetchone()
         if not row:
             raise UserNotFoundError
-        self.password = Password.get_instance(row['password'])
-        self.role = Role[row['role']]
-        self.is_active = bool(row['is_active'])
-        self.token = _get_username_token_dict().get(str(self.username))
+        return row, _get_token(username)
+
+    @classmethod
+    def from_row(cls, username, row, token):
+        '''Build User from a users row read elsewhere, e.g. by lib.aiouser'''
+        user = cls.__new__(cls)
+        user.username = username
+        user._set_row(row, token)
+        return user
+
+    @classmethod
+    def from_principal(cls, token, username, role, is_active):
+        '''Build User from a cached principal without touching MySQL
+        password is not loaded, so password_auth() always fails.'''
+        user = cls.__new__(cls)
+        user.username = username
+        user.password = None
+        user.role = role
+        user.is_active = is_active
+        user.token = token
+        return user
+
+    def _set_row(self, row, token):
+        self._load(row)
+        self.token = token
 
     def __repr__(self):
         return self.__class__.__name__ + '({})'.format(self.username)
@@ -96,90 +140,210 @@ class User(object):
             "is_active": self.is_active
         })
 
+    @classmethod
+    def authenticate(cls, username, password):
+        '''Return the User if password is valid, else None
+        Successful logins are remembered in credential_cache, so that
+        repeated token requests skip MySQL and the password hasher.'''
+        user = cls.remembered(username, password)
+        if user is not None:
+            return user
+        user = cls(username)
+        if not user.password_auth(password):
+            return None
+        user.remember(password)
+        return user
+
+    @classmethod
+    def remembered(cls, username, password):
+        '''Return the User of a recent successful login, or None'''
+        principal = credential_cache.get(_credential_key(username, password))
+        if principal is None:
+            return None
+        return cls.from_principal(None, *principal)
+
+    def remember(self, password):
+        '''Remember a successful login in credential_cache'''
+        credential_cache.set(
+            _credential_key(self.username, password), self.principal()
+        )
+
+    def principal(self):
+        '''Return (username, role, is_active), as the caches keep it'''
+        return (self.username, self.role, self.is_active)
+
     def password_auth(self, password):
-        '''Return True if given password is valid'''
-        return self.password == Password(password)
+        '''Return True if given password is valid
+        A legacy or cheaper hash is replaced with a current one.'''
+        if self.password is None or not self.password.verify(password):
+            return False
+        if self.password.must_update():
+            self._rehash(password)
+        return True
 
-    def activate(self):
-        '''Activate User'''
-        with DB.connect(**config.mysql) as cursor:
+    def _rehash(self, password):
+        old, new = self.password, Password(password)
+        with db.cursor() as cursor:
             cursor.execute(
-                'UPDATE users '
-                'SET is_active=1 '
-                'WHERE username=%s;',
-                (self.username,)
+                self.rehash_sql, (str(new), self.username, str(old))
             )
+        self.password = new
+
+    def activate(self):
+        '''Activate User'''
+        with db.cursor() as cursor:
+            cursor.execute(self.activate_sql, (self.username,))
+        self.is_active = True
+        invalidate_principal(self.username)
 
     def update(self, password=None, role=None):
         '''Update User Info'''
         if password is not None:
-            self.password = Password(password)
+            password = Password(password)
+        change = self.apply_update(password, role)
+        if change is None:
+            return
+        with db.cursor() as cursor:
+            cursor.execute(*change)
+        invalidate_principal(self.username)
+        tokens.revoke(self.username)
+
+    def apply_update(self, password=None, role=None):
+        '''Set a new Password and/or role name on self
+        Return the (query, args) storing them, or None if nothing changes.'''
+        columns = {}
+        if password is not None:
+            self.password = password
+            columns['password'] = str(password)
         if role is not None:
             self.role = Role[role]
-        with DB.connect(**config.mysql) as cursor:
-            cursor.execute(
-                'UPDATE users '
-                'SET password=%s, role=%s '
-                'WHERE username=%s;',
-                (str(self.password), self.role.value, self.username)
-            )
+            columns['role'] = self.role.name
+        if not columns:
+            return None
+        return (
+            'UPDATE users SET {} WHERE username=%s;'.format(
+                ', '.join([c + '=%s' for c in columns])
+            ),
+            list(columns.values()) + [self.username]
+        )
 
     def get_token(self):
+        '''Return the current Token, issuing a new one if expired
+        With config.token_format 'signed', a new signed token each time.'''
         from uuid import uuid4
         from lib.exceptions import UserNotActivatedError, RedisConnectionError
 
         if not self.is_active:
             raise UserNotActivatedError
-        redis = Redis(**config.redis)
-        try:
-            redis.ping()
-        except:
-            raise RedisConnectionError
-        if redis.get(self.token):
+        if config.token_format == 'signed':
+            self.token = tokens.sign(self.username, self.role)
             return self.token
         new_token = config.token_prefix + '-' + str(uuid4())
-        redis.setex(new_token, self.username, config.token_ttl * 60 * 60)
-        self.token = new_token
+        try:
+            token = _issue_token(
+                keys=[_token_index_key(self.username), new_token],
+                args=[self.username, config.token_ttl * 60 * 60]
+            )
+        except RedisError:
+            raise RedisConnectionError
+        self.token = token.decode()
         return self.token
 
     def delete(self):
         '''Delete User'''
-        with DB.connect(**config.mysql) as cursor:
-            cursor.execute(
-                'DELETE FROM users '
-                'WHERE username=%s;',
-                (self.username,)
-            )
-        self.__dict__ = {}
+        from lib.exceptions import RedisConnectionError
 
+        with db.cursor() as cursor:
+            cursor.execute(self.delete_sql, (self.username,))
+        keys = [_token_index_key(self.username)]
+        if self.token:
+            keys.append(self.token)
+        try:
+            kvs.client().delete(*keys)
+        except RedisError:
+            raise RedisConnectionError
+        invalidate_principal(self.username)
+        tokens.revoke(self.username)
+        self._clear()
+        del self.token
 
-def _get_username_token_dict():
-    from lib.exceptions import RedisConnectionError
 
-    redis = Redis(**config.redis)
-    try:
-        redis.ping()
-    except:
-        raise RedisConnectionError
-    token_dict = {}
-    for k in redis.keys('*'):
-        k = k.decode()
-        if k.startswith(config.token_prefix):
-            token_dict[redis.get(k).decode()] = k
-    return token_dict
+principal_cache = LRUCache(**config.principal_cache)
+# HMAC(username, password) -> (username, role, is_active) of recent logins
+credential_cache = LRUCache(**config.credential_cache)
+_CREDENTIAL_SECRET = os.urandom(32)
+# concurrent User(username) share one read
+lookups = Group('user')
+_PRINCIPAL_CHANNEL = config.token_prefix + ':invalidate:principal'
+
+
+def invalidate_principal(username):
+    '''Drop cached principals of the User in every worker'''
+    _discard_principal(username)
+    kvs.publish(_PRINCIPAL_CHANNEL, username)
+
 
+def remember_principal(token, user, pttl):
+    '''Cache the principal of an opaque token for at most its remaining
+    lifetime, pttl milliseconds as Redis PTTL returns it'''
+    ttl = principal_cache.ttl
+    if pttl is not None and pttl >= 0:
+        ttl = pttl / 1000 if ttl is None else min(ttl, pttl / 1000)
+    principal_cache.set(token, user.principal(), ttl)
 
-def _token_username_dict():
+
+def _discard_principal(username):
+    principal_cache.discard_if(lambda token, p: p[0] == username)
+    credential_cache.discard_if(lambda key, p: p[0] == username)
+
+
+def _credential_key(username, password):
+    '''HMAC of the credentials under a per-process random key'''
+    return hmac.new(
+        _CREDENTIAL_SECRET,
+        json.dumps([username, password]).encode('utf-8'),
+        'sha256'
+    ).digest()
+
+
+kvs.subscribe(_PRINCIPAL_CHANNEL, _discard_principal)
+
+
+# KEYS: username -> token index, new token / ARGV: username, ttl
+# Reuse the indexed token while it lives, otherwise store the new one
+_issue_token_script = Script(None, '''
+local token = redis.call('GET', KEYS[1])
+if token and redis.call('EXISTS', token) == 1 then
+    return token
+end
+redis.call('SETEX', KEYS[2], ARGV[2], ARGV[1])
+redis.call('SETEX', KEYS[1], ARGV[2], KEYS[2])
+return KEYS[2]
+''')
+
+
+def _issue_token(keys, args):
+    '''Run the token issuing script, one round-trip once it is loaded'''
+    return _issue_token_script(keys=keys, args=args, client=kvs.client())
+
+
+def _token_index_key(username):
+    '''Redis Key of the username -> token Index'''
+    return '{prefix}:user:{username}'.format(
+        prefix=config.token_prefix,
+        username=username
+    )
+
+
+def _get_token(username):
+    '''Get Current Token of the User, or None'''
     from lib.exceptions import RedisConnectionError
 
-    redis = Redis(**config.redis)
     try:
-        redis.ping()
-    except:
+        token = kvs.client().get(_token_index_key(username))
+    except RedisError:
         raise RedisConnectionError
-    token_dict = {}
-    for k in redis.keys('*'):
-        k = k.decode()
-        if k.startswith(config.token_prefix):
-            token_dict[k] = redis.get(k).decode()
-    return token_dict
+    if token is None:
+        return None
+    return token.decode()
+
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''warmup
+preload in the uWSGI master and connection warm-up in each worker
+The .wsgi files call preload() when they are loaded; without lazy-apps
+uWSGI does that once in the master and forks the workers from it, so
+imports, templates, schema and primed caches are shared copy-on-write.
+Sockets must not be shared: postfork() runs in each worker after the
+lib.db and lib.kvs hooks have dropped the inherited ones.
+'''
+
+import importlib
+import os
+import time
+
+from pymysql.err import MySQLError
+from redis import RedisError
+
+import config
+from lib import db, kvs, metrics, template
+
+# modules otherwise imported on first use, e.g. inside decorators
+MODULES = [
+    'email.utils',
+    'gzip',
+    'hashlib',
+    'json',
+    'uuid',
+    'pymysql.cursors',
+    'redis.client',
+    'lib.common',
+    'lib.exceptions',
+    'lib.hashers',
+    'lib.json2mysql',
+    'lib.listing',
+    'lib.message',
+    'lib.records',
+    'lib.schema',
+    'lib.service',
+    'lib.template',
+    'lib.tokens',
+    'lib.user',
+]
+
+# step: seconds, of this process
+timings = {}
+
+
+def preload():
+    '''Import, parse and prime everything that does not need a socket
+    Runs once per process; return timings.'''
+    if not config.warmup['preload'] or 'preload' in timings:
+        return timings
+    started = time.time()
+    _step('imports', _import_modules)
+    _step('templates', _load_templates)
+    _step('schema', _check_schema)
+    if config.warmup['listings']:
+        _step('listings', _prime_listings)
+    timings['preload'] = time.time() - started
+    return timings
+
+
+def postfork():
+    '''Open connections in a freshly forked worker
+    Failures are left to the first request, which retries.'''
+    from lib.exceptions import CharakobaError
+
+    if not config.warmup['connections']:
+        return
+
+    def connect():
+        try:
+            conns = [db.pool.get() for _ in range(db.pool.min_size)]
+            for conn in conns:
+                db.pool.put(conn)
+        except CharakobaError:
+            pass
+        try:
+            kvs.client().ping()
+        except RedisError:
+            pass
+    _step('connections', connect)
+
+
+def _step(name, func):
+    started = time.time()
+    func()
+    timings[name] = time.time() - started
+
+
+def _import_modules():
+    for name in MODULES:
+        importlib.import_module(name)
+
+
+def _load_templates():
+    for filename in sorted(os.listdir(template.TEMPLATE_DIR)):
+        if filename.endswith('.tmpl'):
+            template.load(filename[:-len('.tmpl')])
+
+
+def _check_schema():
+    '''Fail at startup if the schema does not build, or if a record class
+    names a column that its table lacks (see lib.schema.check())'''
+    from lib import schema
+    from lib.json2mysql import build_queries
+    from lib.records import DNSRecord, ReverseProxyRecord
+    from lib.user import User
+
+    build_queries({'tables': list(schema.tables().values())})
+    for record_class in (DNSRecord, ReverseProxyRecord, User):
+        schema.check(record_class)
+
+
+def _prime_listings():
+    '''Render the full /json of each table into lib.listing, then close
+    the connections used so that workers inherit no socket'''
+    from lib import listing
+    from lib.exceptions import CharakobaError
+    from lib.records import DNSRecord, ReverseProxyRecord
+
+    try:
+        with kvs.no_listener():
+            for record_class in (DNSRecord, ReverseProxyRecord):
+                listing.prime(record_class)
+    except (CharakobaError, MySQLError, RedisError):
+        pass
+    finally:
+        db.pool.clear()
+        kvs.disconnect()
+
+
+metrics.register_gauges(
+    'charakoba_warmup_seconds',
+    'Seconds spent in each warm-up step of this process',
+    lambda: {(('step', step),): value for step, value in timings.items()}
+)
+
+
+try:
+    from uwsgidecorators import postfork as _postfork
+except ImportError:
+    pass
+else:
+    _postfork(postfork)
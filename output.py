@@ -1,68 +1,447 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
-import pymysql as DB
+import hashlib
+import json
+import logging
 from pymysql.cursors import DictCursor as DC
+from pymysql.err import MySQLError
 import os
+from redis import RedisError
+import re
 import shutil
+import subprocess
+import sys
+import tempfile
+import time
 
 import config
-from lib.exceptions import RecordNotFoundError
+from lib import db, kvs, template
+from lib.exceptions import CharakobaError, RecordNotFoundError
+from lib.superclass import CHANGES
+
+logger = logging.getLogger('output')
+
+MANIFEST_FILENAME = '.manifest.json'
+DNS_FIELDS = {'serial', 'records'}
+RPROXY_FIELDS = {'host', 'upstream'}
+RPROXY_MAP_FIELDS = {'map_path', 'upstreams'}
+UPSTREAM_FIELDS = {'name', 'upstream', 'keepalive'}
+# host[:port], as `server` of an nginx upstream block takes it
+UPSTREAM_SERVER = re.compile(
+    r'^(\[[0-9A-Fa-f:.]+\]|[A-Za-z0-9_.-]+)(:[0-9]{1,5})?$'
+)
 
 
 def main():
-    output_dns()
-    output_rproxy()
+    parser = argparse.ArgumentParser(description='Output DNS/Proxy Config')
+    parser.add_argument(
+        '--reload', action='store_true',
+        help='run config.reload_commands for changed outputs'
+    )
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='keep running and regenerate outputs as records change'
+    )
+    args = parser.parse_args()
+    if args.watch:
+        watch()
+    else:
+        output_all(reload=args.reload)
+
+
+def output_all(reload=False):
+    '''Regenerate every output; return changed files by output name'''
+    changed = {
+        'dns': output_dns(),
+        'rproxy': output_rproxy(),
+    }
+    report(changed, reload)
+    return changed
+
+
+def report(changed, reload=False):
+    '''Print whether each output needs a reload, and reload if asked'''
+    for name in sorted(changed):
+        if changed[name]:
+            print('{}: reload required ({} files changed)'.format(
+                name, len(changed[name])
+            ))
+            if reload and config.reload_commands.get(name):
+                subprocess.call(config.reload_commands[name])
+        else:
+            print('{}: unchanged'.format(name))
+    sys.stdout.flush()
+
+
+def watch():
+    '''Regenerate outputs from record change events
+    Events published by BaseRecord on CHANGES are debounced and only the
+    affected outputs (and proxy hosts) are regenerated. Pub/sub does not
+    queue messages, so everything is regenerated on start, after a lost
+    Redis connection and every config.output_resync_interval seconds.
+    A failed regeneration (e.g. an empty table, MySQL being down, a full
+    disk or a missing reload command) or a malformed event is logged and
+    followed by a resync config.output_retry_delay seconds later.'''
+    resync_at = 0
+    while True:
+        try:
+            pubsub = kvs.client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANGES)
+            pending = {}
+            first = last = None
+            while True:
+                now = time.time()
+                if now >= resync_at:
+                    output_all(reload=True)
+                    resync_at = now + config.output_resync_interval
+                    pending = {}
+                    first = last = None
+                message = pubsub.get_message(timeout=config.output_debounce)
+                now = time.time()
+                if message is not None:
+                    event = json.loads(message['data'].decode())
+                    pending.setdefault(event['table'], set()).update(
+                        event['keys']
+                    )
+                    first = first or now
+                    last = now
+                if pending and (
+                        now - last >= config.output_debounce or
+                        now - first >= config.output_max_delay
+                ):
+                    _flush(pending)
+                    pending = {}
+                    first = last = None
+        except RedisError:
+            resync_at = 0
+            time.sleep(1)
+        except (CharakobaError, MySQLError, OSError,
+                subprocess.SubprocessError, ValueError, KeyError, TypeError):
+            logger.exception('watch: regenerating outputs failed')
+            resync_at = 0
+            time.sleep(config.output_retry_delay)
+
+
+def _flush(pending):
+    changed = {}
+    if 'dns' in pending:
+        changed['dns'] = output_dns()
+    if 'rproxy' in pending:
+        changed['rproxy'] = output_rproxy(hosts=pending['rproxy'])
+    report(changed, reload=True)
 
 
 def output_dns():
-    '''Output DNS Zone File'''
+    '''Output DNS Zone File
+    The serial is a monotonic YYYYMMDDnn, bumped only when the record set
+    changes, and each change is journaled as {zone}.{serial}.ixfr.
+    Return the list of changed files'''
     def _build_record(row):
         return row['host'] + ' IN ' + row['type'] + ' ' + row['ipv4_addr']
 
-    serial = date.today().strftime('%Y%m%d')
-    with DB.connect(cursorclass=DC, **config.mysql) as cursor:
+    with db.cursor(DC) as cursor:
         cursor.execute('SELECT type, host, ipv4_addr FROM dns;')
         rows = cursor.fetchall()
     if not rows:
         raise RecordNotFoundError
     records = [_build_record(row) for row in rows]
-    template = _load_template('dns')
-    output_path = os.path.join(config.output_dir, config.dns_conf_filename)
-    with open(output_path, 'w') as f:
-        f.write(
-            template.format(
-                serial=serial,
-                records='\n'.join(records)
-            ) + '\n'
-        )
+    manifest = _load_manifest()
+    entries = manifest.setdefault('dns', {})
+    filename = config.dns_conf_filename
+    entry = entries.get(filename) or {}
+    previous = entry.get('records')
+    if not isinstance(previous, list):
+        # manifests written before serials were tracked hold a digest
+        previous = None
+    if previous is not None and set(previous) == set(records) \
+            and _exists(filename):
+        return []
+    serial = _next_serial(entry.get('serial', 0))
+    content = template.load('dns', DNS_FIELDS).render(
+        serial=serial,
+        records='\n'.join(records)
+    ) + '\n'
+    changed = [filename]
+    journal = entry.get('journal', [])
+    keep = max(config.dns_journal_keep, 0)
+    if keep and previous is not None and set(previous) != set(records):
+        changed.append(_write_journal(
+            entry['serial'], serial, previous, records
+        ))
+        journal.append(serial)
+    expired, journal = journal[:len(journal) - keep], \
+        journal[len(journal) - keep:]
+    for old_serial in expired:
+        _remove(_journal_filename(old_serial))
+    _atomic_write(filename, content)
+    entries[filename] = {
+        'hash': _hash(content),
+        'serial': serial,
+        'records': records,
+        'journal': journal,
+    }
+    _save_manifest(manifest)
+    return changed
+
 
+def _next_serial(previous):
+    '''Return the next YYYYMMDDnn serial, always above previous'''
+    today = int(date.today().strftime('%Y%m%d')) * 100
+    return max(today, previous + 1)
 
-def output_rproxy():
-    with DB.connect(cursorclass=DC, **config.mysql) as cursor:
-        cursor.execute('SELECT host, upstream FROM rproxy;')
+
+def _write_journal(old_serial, new_serial, old_records, new_records):
+    '''Write the difference between two zone versions in IXFR order:
+    old SOA, deleted RRs, new SOA, added RRs'''
+    removed = sorted(set(old_records) - set(new_records))
+    added = sorted(set(new_records) - set(old_records))
+    lines = ['; {} {} -> {}'.format(
+        config.dns_conf_filename, old_serial, new_serial
+    )]
+    lines.append('- @ IN SOA ' + _soa(old_serial))
+    lines += ['- ' + record for record in removed]
+    lines.append('+ @ IN SOA ' + _soa(new_serial))
+    lines += ['+ ' + record for record in added]
+    filename = _journal_filename(new_serial)
+    _atomic_write(filename, '\n'.join(lines) + '\n')
+    return filename
+
+
+def _soa(serial):
+    '''SOA rdata of the zone at serial, as rendered from dns.tmpl:
+    MNAME RNAME SERIAL REFRESH RETRY EXPIRE MINIMUM'''
+    zone = template.load('dns', DNS_FIELDS).render(serial=serial, records='')
+    rdata = zone.split('SOA', 1)[1].split(')', 1)[0]
+    return ' '.join(
+        field
+        for line in rdata.splitlines()
+        for field in line.split(';', 1)[0].replace('(', ' ').split()
+    )
+
+
+def _journal_filename(serial):
+    return '{}.{}.ixfr'.format(config.dns_conf_filename, serial)
+
+
+def output_rproxy(hosts=None):
+    '''Output Reverse Proxy Config Files
+    Only changed files are written and files of deleted hosts are removed.
+    If hosts is given, only the files of those hosts are considered.
+    With config.rproxy_mode == 'map' this is output_rproxy_map().
+    Return the list of changed files'''
+    if config.rproxy_mode == 'map':
+        return output_rproxy_map()
+    if hosts is not None and not hosts:
+        return []
+    with db.cursor(DC) as cursor:
+        if hosts is None:
+            cursor.execute('SELECT host, upstream FROM rproxy;')
+        else:
+            hosts = sorted(hosts)
+            cursor.execute(
+                'SELECT host, upstream FROM rproxy '
+                'WHERE host IN ({});'.format(', '.join(['%s'] * len(hosts))),
+                hosts
+            )
+        rows = cursor.fetchall()
+    if not rows and hosts is None:
+        raise RecordNotFoundError
+    return write_rproxy(rows, hosts)
+
+
+def output_rproxy_map():
+    '''Output one nginx config for every reverse proxy
+    A `map $host` include file picks the upstream block, so adding a host
+    changes one map line instead of adding a server block.
+    Return the list of changed files'''
+    with db.cursor(DC) as cursor:
+        cursor.execute('SELECT host, upstream FROM rproxy ORDER BY host;')
         rows = cursor.fetchall()
     if not rows:
         raise RecordNotFoundError
-    template = _load_template('rproxy')
+    return write_rproxy_map(rows)
+
+
+def write_rproxy_map(rows):
+    '''Write the map include file and the consolidated config of rows
+    Hosts whose upstream is not host[:port] are left out (and logged), as
+    one invalid `server` line would make the whole config fail to load.
+    Return the list of changed files'''
+    upstream_template = template.load('rproxy_upstream', UPSTREAM_FIELDS)
+    names = {}
     for row in rows:
-        output_path = os.path.join(
-            config.output_dir,
-            config.rproxy_conf_filename.format(host=row['host'])
+        if UPSTREAM_SERVER.match(row['upstream']):
+            names.setdefault(row['upstream'], _upstream_name(row['upstream']))
+        else:
+            logger.warning('rproxy map: %s: upstream %r is not host[:port]',
+                           row['host'], row['upstream'])
+    map_content = ''.join(
+        '{}.charakoba.com {};\n'.format(row['host'], names[row['upstream']])
+        for row in rows if row['upstream'] in names
+    )
+    upstreams = '\n'.join(
+        upstream_template.render(
+            name=name,
+            upstream=upstream,
+            keepalive=config.rproxy_keepalive
         )
-        with open(output_path, 'w') as f:
-            f.write(
-                template.format(
-                    host=row['host'],
-                    upstream=row['upstream']
-                ) + '\n'
-            )
+        for upstream, name in sorted(names.items())
+    )
+    conf_content = template.load('rproxy_map', RPROXY_MAP_FIELDS).render(
+        map_path=os.path.abspath(_output_path(config.rproxy_map_filename)),
+        upstreams=upstreams
+    )
+    manifest = _load_manifest()
+    entries = manifest.setdefault('rproxy_map', {})
+    changed = []
+    # the map first, so that the config never includes a missing upstream
+    for filename, content in [
+            (config.rproxy_map_filename, map_content),
+            (config.rproxy_map_conf_filename, conf_content),
+    ]:
+        digest = _hash(content)
+        if entries.get(filename) == digest and _exists(filename):
+            continue
+        _atomic_write(filename, content)
+        entries[filename] = digest
+        changed.append(filename)
+    # files of the per-host mode are no longer wanted
+    for filename in sorted(manifest.pop('rproxy', {})):
+        _remove(filename)
+        changed.append(filename)
+    if changed:
+        _save_manifest(manifest)
+    return changed
+
+
+def _upstream_name(upstream):
+    '''nginx upstream block name for an upstream address
+    The digest keeps names apart when only punctuation differs.'''
+    return 'charakoba_{}_{}'.format(
+        ''.join(c if c.isalnum() else '_' for c in upstream),
+        hashlib.sha1(upstream.encode('utf-8')).hexdigest()[:8]
+    )
+
+
+def write_rproxy(rows, hosts=None, workers=None):
+    '''Render and write the proxy files of rows
+    Rows are rendered and written in chunks of config.output_chunk_size,
+    fanned out over config.output_workers processes.
+    Return the list of changed files'''
+    if workers is None:
+        workers = config.output_workers
+    template.load('rproxy', RPROXY_FIELDS)
+    manifest = _load_manifest()
+    entries = manifest.setdefault('rproxy', {})
+    jobs = []
+    for start in range(0, len(rows), config.output_chunk_size):
+        chunk = []
+        for row in rows[start:start + config.output_chunk_size]:
+            filename = config.rproxy_conf_filename.format(host=row['host'])
+            chunk.append((
+                filename,
+                {'host': row['host'], 'upstream': row['upstream']},
+                entries.get(filename)
+            ))
+        jobs.append((config.output_dir, chunk))
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(min(workers, len(jobs))) as executor:
+            results = list(executor.map(_write_rproxy_chunk, jobs))
+    else:
+        results = [_write_rproxy_chunk(job) for job in jobs]
+    changed = []
+    filenames = set()
+    for result in results:
+        for filename, digest, written in result:
+            filenames.add(filename)
+            entries[filename] = digest
+            if written:
+                changed.append(filename)
+    # files of the map mode are no longer wanted
+    for filename in sorted(manifest.pop('rproxy_map', {})):
+        _remove(filename)
+        changed.append(filename)
+    stale = set(entries)
+    if hosts is not None:
+        stale &= set(config.rproxy_conf_filename.format(host=h) for h in hosts)
+    for filename in sorted(stale - filenames):
+        _remove(filename)
+        del entries[filename]
+        changed.append(filename)
+    if changed:
+        _save_manifest(manifest)
+    return changed
+
+
+def _write_rproxy_chunk(job):
+    '''Render and write one chunk; runs in a worker process'''
+    output_dir, chunk = job
+    render = template.load('rproxy', RPROXY_FIELDS).render
+    result = []
+    for filename, values, known_digest in chunk:
+        content = render(**values) + '\n'
+        digest = _hash(content)
+        written = digest != known_digest or \
+            not _exists(filename, output_dir)
+        if written:
+            _atomic_write(filename, content, output_dir)
+        result.append((filename, digest, written))
+    return result
+
+
+def _load_manifest():
+    '''Load content hashes of generated files'''
+    try:
+        with open(_output_path(MANIFEST_FILENAME), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest):
+    _atomic_write(MANIFEST_FILENAME, json.dumps(manifest, indent=2) + '\n')
+
+
+def _atomic_write(filename, content, output_dir=None):
+    '''Write via temporary file and rename, so readers never see
+    half-written files'''
+    fd, tmp_path = tempfile.mkstemp(
+        dir=output_dir or config.output_dir,
+        prefix='.' + filename + '.'
+    )
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, _output_path(filename, output_dir))
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def _remove(filename):
+    try:
+        os.remove(_output_path(filename))
+    except FileNotFoundError:
+        pass
+
+
+def _exists(filename, output_dir=None):
+    return os.path.exists(_output_path(filename, output_dir))
+
+
+def _output_path(filename, output_dir=None):
+    return os.path.join(output_dir or config.output_dir, filename)
 
 
-def _load_template(template_name):
-    with open(os.path.join('templates', template_name + '.tmpl'), 'r') as f:
-        return f.read()
+def _hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
 
 
 if __name__ == '__main__':
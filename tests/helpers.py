@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+'''helpers
+TestCase running the apps over the bench stand-ins
+MySQL is replaced with SQLite and Redis with bench.standins.FakeRedis,
+so these tests need neither server.
+'''
+
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from bench import run
+from lib import db, listing, superclass, tokens, user
+
+
+class StandinTestCase(TestCase):
+    '''Fresh database, Redis stand-in and caches for each test
+    self.bench is a bench.run.Bench: self.bench.request() calls the
+    dns, rproxy and user apps, self.bench.token is an admin token.'''
+    records = 10
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='charakoba-test-')
+        clear_caches()
+        self.bench = run.Bench(self.workdir, self.records)
+
+    def tearDown(self):
+        db.pool.clear()
+        clear_caches()
+        shutil.rmtree(self.workdir)
+
+    def request(self, app, method, path, params=None, headers=None):
+        '''self.bench.request(), returning (status, headers, body)'''
+        response_headers = {}
+        application = self.bench.apps[app]
+
+        def capture(environ, start_response):
+            def inner(status, headers, exc_info=None):
+                response_headers.update(headers)
+                return start_response(status, headers, exc_info)
+            return application(environ, inner)
+
+        with mock.patch.dict(self.bench.apps, {app: capture}):
+            status, body = self.bench.request(
+                app, method, path, params, headers
+            )
+        return status, response_headers, body
+
+    def execute(self, query, args=None):
+        '''Run a query as another writer would, bypassing the caches'''
+        with db.cursor() as cursor:
+            cursor.execute(query, args)
+
+
+def clear_caches():
+    '''Empty the per-process caches'''
+    for cache in (superclass.record_cache, listing.bodies, listing.encoded,
+                  user.principal_cache, user.credential_cache):
+        cache.clear()
+    tokens._revoked.clear()
+    tokens._loaded_pid = None
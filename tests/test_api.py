@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import json
+
+from bench import run
+from bench.run import ADMIN
+from helpers import StandinTestCase
+
+
+class APITestCase(StandinTestCase):
+    records = 3
+
+    def setUp(self):
+        super().setUp()
+        self.bench.apps['api'] = run.load_app('api')
+
+    def request(self, method, path, params=None):
+        return self.bench.request('api', method, path, params)
+
+    def test_apps_are_mounted(self):
+        status, body = self.request('GET', '/dns/1')
+        self.assertEqual(status, 200)
+        self.assertIn("'host': 'host0'", body)
+        status, body = self.request('GET', '/rproxy/json')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)), self.records)
+        status, body = self.request(
+            'POST', '/user/token',
+            {'username': ADMIN[0], 'password': ADMIN[1]}
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['token'], self.bench.token)
+        for path in ('/dns', '/dns/'):
+            with self.subTest(path):
+                status, body = self.request('GET', path)
+                self.assertEqual(status, 200)
+                self.assertIn('Hello', body)
+
+    def test_unknown_prefix_is_not_found(self):
+        for path in ('/', '/users/token', '/dnsx/1', ''):
+            with self.subTest(path):
+                status, body = self.request('GET', path)
+                self.assertEqual(status, 404)
+                self.assertIn('Not found', json.loads(body)['message'])
+
+    def test_apps_share_the_process_state(self):
+        status, body = self.request('GET', '/dns/json')
+        self.assertEqual(len(json.loads(body)), self.records)
+        status, _ = self.request('POST', '/dns/', {
+            'token': self.bench.token, 'type': 'A', 'host': 'new',
+            'domain': 'charakoba.com', 'ipv4_addr': '10.9.0.1'
+        })
+        self.assertEqual(status, 200)
+        # the listing cache of the dns app sees the write of the api app
+        status, body = self.bench.request('dns', 'GET', '/json')
+        self.assertEqual(len(json.loads(body)), self.records + 1)
+        status, body = self.request('GET', '/dns/metrics')
+        self.assertIn('app="dns",route="POST /"', body)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import hashlib
+from redis import RedisError
+import time
+from unittest import TestCase, mock
+
+from bench import standins
+from bench.run import ADMIN
+import config
+from helpers import StandinTestCase
+from lib import hashers, kvs
+from lib.exceptions import RedisConnectionError, TokenError
+from lib.service import Service
+from lib.user import (
+    _PRINCIPAL_CHANNEL, Password, Role, User, credential_cache,
+    principal_cache
+)
+
+FAST_HASHER = {'algorithm': 'pbkdf2_sha512', 'iterations': 1000}
+
+
+class HasherTestCase(TestCase):
+    def test_pbkdf2(self):
+        hasher = hashers.PBKDF2Hasher(1000)
+        encoded = hasher.encode('secret')
+        self.assertTrue(encoded.startswith('pbkdf2_sha512$1000$'))
+        self.assertNotEqual(encoded, hasher.encode('secret'))
+        self.assertTrue(hasher.verify('secret', encoded))
+        self.assertFalse(hasher.verify('Secret', encoded))
+        self.assertFalse(hasher.must_update(encoded))
+        self.assertTrue(hashers.PBKDF2Hasher(2000).must_update(encoded))
+
+    def test_legacy_sha512(self):
+        password = Password.get_instance(
+            hashlib.sha512(b'secret').hexdigest()
+        )
+        self.assertIsInstance(password.hasher, hashers.SHA512Hasher)
+        self.assertTrue(password.verify('secret'))
+        self.assertFalse(password.verify('Secret'))
+        self.assertTrue(password.must_update())
+
+    def test_malformed_hash_is_rejected(self):
+        hasher = hashers.PBKDF2Hasher(1000)
+        self.assertFalse(hasher.verify('secret', 'pbkdf2_sha512$x$y'))
+
+
+class AuthenticateTestCase(StandinTestCase):
+    records = 1
+
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch.object(config, 'password_hasher', FAST_HASHER)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.execute(
+            'INSERT INTO users (username, password, role, is_active) '
+            'VALUES (%s, %s, %s, %s);',
+            ('legacy', hashlib.sha512(b'secret').hexdigest(), 'user', 1)
+        )
+
+    def stored_hash(self, username):
+        return str(User(username).password)
+
+    def test_legacy_login_rehashes(self):
+        self.assertIsNotNone(User.authenticate('legacy', 'secret'))
+        stored = self.stored_hash('legacy')
+        self.assertTrue(stored.startswith('pbkdf2_sha512$1000$'))
+        credential_cache.clear()
+        self.assertIsNotNone(User.authenticate('legacy', 'secret'))
+        self.assertEqual(self.stored_hash('legacy'), stored)
+
+    def test_wrong_password_is_rejected(self):
+        legacy = self.stored_hash('legacy')
+        self.assertIsNone(User.authenticate('legacy', 'Secret'))
+        self.assertEqual(self.stored_hash('legacy'), legacy)
+        self.assertIsNone(User.authenticate(ADMIN[0], 'Secret'))
+        status, _ = self.bench.request(
+            'user', 'POST', '/token', {'username': ADMIN[0], 'password': 'x'}
+        )
+        self.assertEqual(status, 401)
+
+    def test_cached_login_needs_the_same_password(self):
+        self.assertIsNotNone(User.authenticate('legacy', 'secret'))
+        self.assertIsNone(User.authenticate('legacy', 'Secret'))
+
+
+class PrincipalCacheTestCase(StandinTestCase):
+    records = 1
+
+    def test_entry_expires_with_the_token(self):
+        token = self.bench.token
+        kvs.client().setex(token, ADMIN[0], 1)
+        user = Service._get_user_from_token(token)
+        self.assertEqual(user.username, ADMIN[0])
+        self.assertIsNotNone(principal_cache.get(token))
+        time.sleep(1.1)
+        self.assertIsNone(principal_cache.get(token))
+        with self.assertRaises(TokenError):
+            Service._get_user_from_token(token)
+
+    def test_cached_principal_skips_redis_and_mysql(self):
+        token = self.bench.token
+        first = Service._get_user_from_token(token)
+        before = dict(standins.stats)
+        user = Service._get_user_from_token(token)
+        self.assertEqual(standins.stats['mysql_queries'],
+                         before['mysql_queries'])
+        self.assertEqual(standins.stats['redis_round_trips'],
+                         before['redis_round_trips'])
+        self.assertEqual((user.username, user.role, user.is_active),
+                         (first.username, first.role, first.is_active))
+        self.assertIsNone(user.password)
+
+    def test_changes_drop_the_entry(self):
+        token = self.bench.token
+        Service._get_user_from_token(token)
+        User(ADMIN[0]).update(role='user')
+        self.assertIsNone(principal_cache.get(token))
+        self.assertEqual(Service._get_user_from_token(token).role, Role.user)
+
+    def test_invalidation_message_drops_the_entry(self):
+        token = self.bench.token
+        Service._get_user_from_token(token)
+        # as the kvs listener of another worker would call it
+        for callback in kvs._handlers[_PRINCIPAL_CHANNEL]:
+            callback(ADMIN[0])
+        self.assertIsNone(principal_cache.get(token))
+
+    def test_entry_keeps_the_cache_ttl_for_long_lived_tokens(self):
+        Service._get_user_from_token(self.bench.token)
+        _, expires = principal_cache._data[self.bench.token]
+        self.assertAlmostEqual(
+            expires - time.time(), config.principal_cache['ttl'], delta=1
+        )
+
+
+class TokenFormatTestCase(StandinTestCase):
+    records = 1
+
+    def test_other_keys_are_no_tokens(self):
+        index_key = config.token_prefix + ':user:' + ADMIN[0]
+        self.assertIsNotNone(kvs.client().get(index_key))
+        for token in (index_key, config.token_prefix + ':revoked',
+                      self.bench.token[len(config.token_prefix) + 1:]):
+            with self.subTest(token):
+                status, _ = self.bench.request(
+                    'user', 'PUT', '/', {'token': token, 'password': 'x'}
+                )
+                self.assertEqual(status, 401)
+        self.assertIsNotNone(User.authenticate(*ADMIN))
+
+
+class DeleteTestCase(StandinTestCase):
+    records = 1
+
+    def test_redis_outage_is_redis_connection_error(self):
+        user = User(ADMIN[0])
+        with mock.patch.object(kvs.client(), 'delete',
+                               side_effect=RedisError('down')), \
+                self.assertRaises(RedisConnectionError):
+            user.delete()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import io
+from unittest import TestCase, mock
+
+from bench import run, standins
+from helpers import StandinTestCase
+
+
+class BenchTestCase(StandinTestCase):
+    def test_every_mix_runs_without_errors(self):
+        for mix in sorted(run.MIXES):
+            with self.subTest(mix):
+                result = self.bench.run(mix, 20, 2)
+                self.assertEqual(sorted(result), sorted(run.COLUMNS))
+                self.assertEqual((result['mix'], result['requests'],
+                                  result['errors']), (mix, 20, 0))
+                self.assertGreater(result['req_per_sec'], 0)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_errors_are_counted(self):
+        with mock.patch.dict(run.MIXES,
+                             {'missing': [(1, 'dns', 'GET', '/0', 'list')]}):
+            result = self.bench.run('missing', 4, 1)
+        self.assertEqual(result['errors'], 4)
+
+    def test_work_per_request(self):
+        # the first listing of each table renders it, the others hit the cache
+        result = self.bench.run('list', 20, 1)
+        self.assertEqual(result['queries_per_req'], 2 / 20)
+        before = dict(standins.stats)
+        status, _ = self.bench.request('dns', 'GET', '/1')
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            standins.stats['mysql_queries'] - before['mysql_queries'], 1
+        )
+
+
+class ReportTestCase(TestCase):
+    def test_percentile(self):
+        values = [n / 100 for n in range(1, 101)]
+        self.assertEqual(run._percentile(values, 50), 0.51)
+        self.assertEqual(run._percentile(values, 99), 1.0)
+        self.assertEqual(run._percentile([], 99), 0.0)
+
+    def test_print_table(self):
+        result = dict.fromkeys(run.COLUMNS, 1.5)
+        result.update({'mix': 'list', 'requests': 10})
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+            run.print_table([result])
+        header, row = out.getvalue().splitlines()
+        self.assertEqual(header.split(), run.COLUMNS)
+        self.assertEqual(row.split()[:5], ['list', '1.50', '1.50', '10',
+                                           '1.50'])
+        self.assertEqual(len(header), len(row))
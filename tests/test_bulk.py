@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from pymysql.constants import ER
+from pymysql.err import IntegrityError
+
+from helpers import StandinTestCase
+from lib import db
+from lib.exceptions import ParameterRequirementsError, RecordConflictError
+from lib.records import DNSRecord
+from lib.superclass import _integrity_guard
+
+
+class BulkTestCase(StandinTestCase):
+    def test_create_rejects_nested_and_unknown_values(self):
+        results = DNSRecord.bulk_create([
+            {'type': 'A', 'host': 'new0', 'ipv4_addr': '10.9.0.0'},
+            {'type': 'A', 'host': ['new1'], 'ipv4_addr': '10.9.0.1'},
+            {'type': 'A', 'host': 'new2', 'ipv4_addr': {'a': 1}},
+            {'type': 'A', 'host': 'new3', 'ipv4_addr': None},
+            {'type': 'A', 'host': 'new4', 'ipv4_addr': '10.9.0.4', 'x': 1},
+            {'type': 'A', 'host': 'new5'},
+            'new6',
+        ])
+        self.assertEqual(
+            [r['status'] for r in results],
+            [201, 400, 400, 400, 400, 400, 400]
+        )
+        self.assertEqual(results[0]['record']['host'], 'new0')
+
+    def test_create_rejects_values_of_other_types(self):
+        results = DNSRecord.bulk_create([
+            {'type': 'A', 'host': 'new0', 'ipv4_addr': True},
+            {'type': 'A', 'host': 'new1', 'ipv4_addr': 10},
+            {'type': 'A', 'host': 1.5, 'ipv4_addr': '10.9.0.2'},
+        ])
+        self.assertEqual([r['status'] for r in results], [400, 400, 400])
+        self.assertEqual(self.count('new%'), 0)
+
+    def test_ids_must_be_ints_or_digit_strings(self):
+        results = DNSRecord.bulk_delete(
+            [True, 2.9, '3.0', ' 4', '-5', -6, '7', 8, {'id_': False}]
+        )
+        self.assertEqual(
+            [r['status'] for r in results],
+            [400, 400, 400, 400, 400, 400, 200, 200, 400]
+        )
+        results = DNSRecord.bulk_update([
+            {'id_': 3.7, 'type': 'A'},
+            {'id_': True, 'type': 'A'},
+            {'id_': '3', 'type': 'AAAA'},
+        ])
+        self.assertEqual([r['status'] for r in results], [400, 400, 200])
+        self.assertEqual(self.count('host%'), 8)
+
+    def test_create_duplicate_key_is_conflict(self):
+        with self.assertRaises(RecordConflictError):
+            DNSRecord.bulk_create([
+                {'type': 'A', 'host': 'host1', 'ipv4_addr': '10.9.0.0'},
+            ])
+
+    def test_update_rejects_nested_values(self):
+        results = DNSRecord.bulk_update([
+            {'id_': 1, 'ipv4_addr': '10.9.0.1'},
+            {'id_': 2, 'ipv4_addr': ['10.9.0.2']},
+            {'id_': 3, 'unknown': 'x'},
+            {'id_': [4]},
+            {'id_': 999, 'type': 'A'},
+        ])
+        self.assertEqual(
+            [r['status'] for r in results], [200, 400, 400, 400, 404]
+        )
+
+    def test_update_duplicate_key_is_conflict(self):
+        with self.assertRaises(RecordConflictError):
+            DNSRecord.bulk_update([{'id_': 1, 'host': 'host2'}])
+
+    def test_single_duplicate_key_is_conflict(self):
+        with self.assertRaises(RecordConflictError):
+            DNSRecord.create(type='A', host='host1', ipv4_addr='10.9.0.0')
+        with self.assertRaises(RecordConflictError):
+            DNSRecord(1).update(host='host2')
+        record = {'token': self.bench.token, 'type': 'A', 'host': 'host1',
+                  'domain': 'charakoba.com', 'ipv4_addr': '10.9.0.0'}
+        status, _ = self.bench.request('dns', 'POST', '/', record)
+        self.assertEqual(status, 409)
+
+    def count(self, pattern):
+        with db.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM dns WHERE host LIKE %s;',
+                           (pattern,))
+            return cursor.fetchone()[0]
+
+    def test_not_null_violation_is_parameter_error(self):
+        with self.assertRaises(ParameterRequirementsError):
+            with _integrity_guard():
+                self.execute(
+                    'INSERT INTO dns (type, host, ipv4_addr) '
+                    'VALUES (%s, %s, %s);',
+                    ('A', 'nullhost', None)
+                )
+
+    def test_guard_maps_errno(self):
+        with self.assertRaises(RecordConflictError):
+            with _integrity_guard():
+                raise IntegrityError(ER.DUP_ENTRY, 'Duplicate entry')
+        with self.assertRaises(ParameterRequirementsError):
+            with _integrity_guard():
+                raise IntegrityError(ER.BAD_NULL_ERROR, 'cannot be null')
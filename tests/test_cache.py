@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import time
+from unittest import TestCase, mock
+
+from lib.cache import LRUCache
+
+_now = time.time
+
+
+class LRUCacheTestCase(TestCase):
+    def later(self, seconds):
+        return mock.patch('lib.cache.time.time', lambda: _now() + seconds)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        cache.set('a', 4)
+        cache.set('d', 5)
+        self.assertEqual(cache.get('a'), 4)
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=10)
+        cache.set('default', 1)
+        cache.set('short', 2, ttl=1)
+        cache.set('long', 3, ttl=100)
+        with self.later(5):
+            self.assertEqual(cache.get('default'), 1)
+            self.assertIsNone(cache.get('short'))
+        with self.later(50):
+            self.assertIsNone(cache.get('default'))
+            self.assertEqual(cache.get('long'), 3)
+        self.assertEqual(len(cache), 1)
+
+    def test_no_ttl_never_expires(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        with self.later(10 ** 6):
+            self.assertEqual(cache.get('a'), 1)
+
+    def test_stats(self):
+        cache = LRUCache(maxsize=3)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        self.assertIs(cache.get('b', False), False)
+        self.assertEqual(cache.stats(), {'size': 1, 'maxsize': 3,
+                                         'hits': 1, 'misses': 2})
+
+    def test_discard_if_and_pop(self):
+        cache = LRUCache()
+        for n in range(4):
+            cache.set(n, n % 2)
+        cache.discard_if(lambda key, value: value == 1)
+        self.assertEqual(sorted(cache._data), [0, 2])
+        cache.pop(0)
+        cache.pop('missing')
+        self.assertEqual(list(cache._data), [2])
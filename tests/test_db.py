@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock
+
+from bench import standins
+from lib import db
+from lib.exceptions import DatabaseConnectionError
+
+
+class Connection(standins.SQLiteConnection):
+    '''SQLite stand-in whose ping() runs self.on_ping'''
+    on_ping = None
+
+    def ping(self, reconnect=True):
+        if self.on_ping is not None:
+            self.on_ping()
+
+
+class PoolTestCase(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='charakoba-test-')
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.path = os.path.join(self.workdir, 'db.sqlite3')
+
+    def pool(self, **kw):
+        kw.setdefault('max_size', 2)
+        kw.setdefault('timeout', 0.1)
+        pool = db.ConnectionPool(
+            lambda: Connection(self.path), {}, **kw
+        )
+        self.addCleanup(pool.clear)
+        return pool
+
+    def test_checkout_times_out_at_max_size(self):
+        pool = self.pool()
+        first, second = pool.get(), pool.get()
+        with self.assertRaises(DatabaseConnectionError):
+            pool.get()
+        self.assertEqual(pool.stats()['waits'], 1)
+        pool.put(first)
+        self.assertIs(pool.get(), first)
+        self.assertEqual(pool.stats()['size'], 2)
+        pool.put(second)
+
+    def test_reset_after_fork(self):
+        pool = self.pool()
+        inherited = pool.get()
+        pool.put(pool.get())
+        with mock.patch('lib.db.os.getpid', return_value=os.getpid() + 1):
+            conn = pool.get()
+            self.assertIsNot(conn, inherited)
+            self.assertEqual(pool.stats()['size'], 1)
+            pool.put(conn)
+        # the connection of the parent is forgotten, not returned
+        pool.put(inherited)
+        self.assertTrue(inherited.open)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_failed_health_check_discards_connection(self):
+        pool = self.pool()
+        broken = pool.get()
+        pool.put(broken)
+        broken.on_ping = mock.Mock(side_effect=OSError('gone'))
+        conn = pool.get()
+        self.assertIsNot(conn, broken)
+        self.assertFalse(broken.open)
+        stats = pool.stats()
+        self.assertEqual(stats['health_check_failures'], 1)
+        self.assertEqual((stats['size'], stats['closed']), (1, 1))
+        pool.put(conn)
+
+    def test_idle_connections_are_reaped_to_min_size(self):
+        pool = self.pool(min_size=1, max_size=3, idle_timeout=0)
+        conns = [pool.get() for _ in range(3)]
+        for conn in conns:
+            pool.put(conn)
+        conn = pool.get()
+        self.assertEqual(sum(not c.open for c in conns), 2)
+        stats = pool.stats()
+        self.assertEqual((stats['size'], stats['closed']), (1, 2))
+        pool.put(conn)
+
+    def test_health_check_does_not_block_other_checkouts(self):
+        pool = self.pool(timeout=5)
+        slow = pool.get()
+        pool.put(slow)
+        pinging, release = threading.Event(), threading.Event()
+
+        def ping():
+            pinging.set()
+            release.wait(5)
+        slow.on_ping = ping
+        thread = threading.Thread(target=pool.get)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        self.assertTrue(pinging.wait(5))
+        started = time.time()
+        conn = pool.get()
+        self.assertLess(time.time() - started, 1)
+        self.assertIsNot(conn, slow)
+        release.set()
+        pool.put(conn)
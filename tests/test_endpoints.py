@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import ast
+import json
+
+from helpers import StandinTestCase
+from lib import listing
+
+
+class RecordEndpointTestCase(StandinTestCase):
+    records = 10
+
+    def get(self, app, path, params=None):
+        return self.bench.request(app, 'GET', path, params)
+
+    def record(self, app, path):
+        status, body = self.get(app, path)
+        self.assertEqual(status, 200)
+        return ast.literal_eval(body)
+
+    def listing(self, app, params):
+        status, body = self.get(app, '/json', params)
+        self.assertEqual(status, 200)
+        return [r['host'] for r in json.loads(body)]
+
+    def test_get_by_id(self):
+        self.assertEqual(self.record('dns', '/4')['host'], 'host3')
+        self.assertEqual(self.record('rproxy', '/4')['upstream'],
+                         '10.0.0.3:80')
+        self.assertEqual(self.get('dns', '/999')[0], 404)
+
+    def test_get_by_host(self):
+        self.assertEqual(self.record('dns', '/host/host3')['id_'], 4)
+        self.assertEqual(self.record('rproxy', '/host/host3')['id_'], 4)
+        self.assertEqual(self.get('dns', '/host/nowhere')[0], 404)
+
+    def test_type_filter(self):
+        self.assertEqual(len(self.listing('dns', {'type': 'A'})), 10)
+        self.assertEqual(self.listing('dns', {'type': 'AAAA'}), [])
+
+    def test_ipv4_prefix_filter(self):
+        self.assertEqual(
+            len(self.listing('dns', {'ipv4_prefix': '10.0.0.'})), 10
+        )
+        self.assertEqual(
+            self.listing('dns', {'ipv4_prefix': '10.0.0.1'}), ['host1']
+        )
+        self.assertEqual(
+            self.listing('dns', {'ipv4_prefix': '10.0.0.1', 'type': 'A'}),
+            ['host1']
+        )
+
+    def test_upstream_filter(self):
+        self.assertEqual(
+            self.listing('rproxy', {'upstream': '10.0.0.3:80'}), ['host3']
+        )
+        self.assertEqual(self.listing('rproxy', {'upstream': '10.0.0.3'}), [])
+
+    def test_invalid_filter_values(self):
+        rejected = [
+            ('dns', {'ipv4_prefix': '10.0.0.%'}),
+            ('dns', {'ipv4_prefix': '10.0.0.&type=A'}),
+            ('dns', {'type': ''}),
+            ('dns', {'type': 'A' * 256}),
+            ('dns', {'after': 'x'}),
+            ('dns', {'fields': 'password'}),
+            ('rproxy', {'upstream': 'a b:80'}),
+            ('rproxy', {'upstream': "a'--"}),
+        ]
+        for app, params in rejected:
+            self.assertEqual(self.get(app, '/json', params)[0], 400, params)
+        self.assertEqual(len(listing.bodies), 0)
+        self.assertEqual(
+            self.get('rproxy', '/json', {'upstream': '[::1]:80'})[0], 200
+        )
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import copy
+from unittest import TestCase
+
+from lib.json2mysql import build_migrations, data_type, declared_indexes
+
+TABLE = {
+    'name': 'dns',
+    'columns': [
+        {'name': 'id', 'type': 'int', 'primary key': True,
+         'auto_increment': True},
+        {'name': 'type', 'type': 'varchar', 'length': 16, 'not null': True},
+        {'name': 'host', 'type': 'varchar', 'length': 64, 'not null': True,
+         'unique': True},
+        {'name': 'ipv4_addr', 'type': 'varchar', 'length': 15,
+         'not null': True},
+    ],
+    'index': [
+        {'name': 'dns_type', 'columns': ['type']},
+    ],
+}
+ROWS = 5000
+
+
+def live_of(table, bytes_per_char=4):
+    '''information_schema view of table as json2mysql would create it'''
+    columns = {}
+    for col in table['columns']:
+        length = col.get('length') if col['type'] == 'varchar' else None
+        columns[col['name']] = {
+            'name': col['name'],
+            'type': 'int(11)' if col['type'] == 'int' else
+            data_type(col).lower(),
+            'nullable': 'NO' if col.get('not null') or col.get('primary key')
+            else 'YES',
+            'default': col.get('default'),
+            'extra': 'auto_increment' if col.get('auto_increment') else '',
+            'chars': length,
+            'octets': length * bytes_per_char if length else None,
+        }
+    return {table['name']: {
+        'rows': ROWS,
+        'columns': columns,
+        'indexes': copy.deepcopy(declared_indexes(table)),
+    }}
+
+
+def column(table, name):
+    return [c for c in table['columns'] if c['name'] == name][0]
+
+
+def add_column(table, live):
+    table['columns'].insert(3, {'name': 'ttl', 'type': 'int',
+                                'not null': True, 'default': 300})
+
+
+def add_auto_increment(table, live):
+    table['columns'].append({'name': 'seq', 'type': 'int',
+                             'auto_increment': True})
+
+
+def drop_column(table, live):
+    live['dns']['columns']['legacy'] = dict(
+        live['dns']['columns']['type'], name='legacy'
+    )
+
+
+def widen_latin1_varchar(table, live):
+    live['dns']['columns'].update(live_of(dict(TABLE, columns=[
+        dict(column(TABLE, 'host'), length=32)
+    ]), bytes_per_char=1)['dns']['columns'])
+
+
+def widen_utf8mb4_varchar(table, live):
+    live['dns']['columns'].update(live_of(dict(TABLE, columns=[
+        dict(column(TABLE, 'type'), length=8)
+    ]))['dns']['columns'])
+
+
+def widen_varchar_to_256_bytes(table, live):
+    column(table, 'host')['length'] = 64
+    live['dns']['columns'].update(live_of(dict(TABLE, columns=[
+        dict(column(TABLE, 'host'), length=63)
+    ]))['dns']['columns'])
+
+
+def shrink_varchar(table, live):
+    column(table, 'ipv4_addr')['length'] = 12
+
+
+def change_type(table, live):
+    live['dns']['columns']['ipv4_addr']['type'] = 'char(15)'
+
+
+def set_not_null(table, live):
+    live['dns']['columns']['ipv4_addr']['nullable'] = 'YES'
+
+
+def add_index(table, live):
+    table['index'].append({'name': 'dns_ipv4_addr', 'columns': ['ipv4_addr']})
+
+
+def change_index(table, live):
+    live['dns']['indexes']['dns_type']['columns'].append('host')
+
+
+def make_index_unique(table, live):
+    live['dns']['indexes']['host']['unique'] = False
+
+
+def drop_index(table, live):
+    live['dns']['indexes']['dns_old'] = {'columns': ['ipv4_addr'],
+                                         'unique': False}
+
+
+def drop_primary_key(table, live):
+    id_ = column(table, 'id')
+    id_.pop('primary key')
+    id_['not null'] = True
+    table['unique'] = [{'name': 'dns_id', 'columns': ['id']}]
+
+
+def change_primary_key(table, live):
+    live['dns']['indexes']['PRIMARY']['columns'].append('host')
+
+
+def new_table(table, live):
+    del live['dns']
+
+
+INPLACE = ', ALGORITHM=INPLACE, LOCK=NONE;'
+COPY = ', ALGORITHM=COPY, LOCK=SHARED;'
+
+# change: [(phase, copy, rows, sql)]
+CASES = [
+    (None, []),
+    (add_column, [
+        ('add column', False, ROWS,
+         'ALTER TABLE dns ADD COLUMN ttl INT NOT NULL DEFAULT 300 '
+         'AFTER host' + INPLACE),
+    ]),
+    (add_auto_increment, [
+        ('add column', True, ROWS,
+         'ALTER TABLE dns ADD COLUMN seq INT AUTO_INCREMENT '
+         'AFTER ipv4_addr' + COPY),
+    ]),
+    (drop_column, [
+        ('extra column', False, 0, None),
+    ]),
+    (widen_latin1_varchar, [
+        ('modify column', False, 0,
+         'ALTER TABLE dns MODIFY COLUMN host VARCHAR(64) NOT NULL' + INPLACE),
+    ]),
+    (widen_utf8mb4_varchar, [
+        ('modify column', False, 0,
+         'ALTER TABLE dns MODIFY COLUMN type VARCHAR(16) NOT NULL' + INPLACE),
+    ]),
+    (widen_varchar_to_256_bytes, [
+        ('modify column', True, ROWS,
+         'ALTER TABLE dns MODIFY COLUMN host VARCHAR(64) NOT NULL' + COPY),
+    ]),
+    (shrink_varchar, [
+        ('modify column', True, ROWS,
+         'ALTER TABLE dns MODIFY COLUMN ipv4_addr VARCHAR(12) NOT NULL' +
+         COPY),
+    ]),
+    (change_type, [
+        ('modify column', True, ROWS,
+         'ALTER TABLE dns MODIFY COLUMN ipv4_addr VARCHAR(15) NOT NULL' +
+         COPY),
+    ]),
+    (set_not_null, [
+        ('modify column', False, ROWS,
+         'ALTER TABLE dns MODIFY COLUMN ipv4_addr VARCHAR(15) NOT NULL' +
+         INPLACE),
+    ]),
+    (add_index, [
+        ('add index', False, ROWS,
+         'ALTER TABLE dns ADD INDEX dns_ipv4_addr (ipv4_addr)' + INPLACE),
+    ]),
+    (change_index, [
+        ('add index', False, ROWS,
+         'ALTER TABLE dns DROP INDEX dns_type, ADD INDEX dns_type (type)' +
+         INPLACE),
+    ]),
+    (make_index_unique, [
+        ('add index', False, ROWS,
+         'ALTER TABLE dns DROP INDEX host, ADD UNIQUE INDEX host (host)' +
+         INPLACE),
+    ]),
+    (drop_index, [
+        ('drop index', False, 0, 'ALTER TABLE dns DROP INDEX dns_old' +
+         INPLACE),
+    ]),
+    (drop_primary_key, [
+        ('add index', False, ROWS,
+         'ALTER TABLE dns ADD UNIQUE INDEX dns_id (id)' + INPLACE),
+        ('drop index', True, 0, 'ALTER TABLE dns DROP PRIMARY KEY' + COPY),
+    ]),
+    (change_primary_key, [
+        ('add index', False, ROWS,
+         'ALTER TABLE dns DROP PRIMARY KEY, ADD PRIMARY KEY (id)' + INPLACE),
+    ]),
+]
+
+
+class BuildMigrationsTestCase(TestCase):
+    def migrations(self, change):
+        table, live = copy.deepcopy(TABLE), live_of(TABLE)
+        if change is not None:
+            change(table, live)
+        return build_migrations({'tables': [table]}, live)
+
+    def test_cases(self):
+        for change, expected in CASES:
+            name = change.__name__ if change else 'no change'
+            with self.subTest(name):
+                self.assertEqual(
+                    [(s['phase'], s['copy'], s['rows'], s['sql'])
+                     for s in self.migrations(change)],
+                    expected
+                )
+
+    def test_new_table(self):
+        steps = self.migrations(new_table)
+        self.assertEqual([s['phase'] for s in steps], ['create table'])
+        self.assertTrue(steps[0]['sql'].startswith('CREATE TABLE dns'))
+
+    def test_phase_order(self):
+        def everything(table, live):
+            for change in (drop_index, add_index, set_not_null, add_column,
+                           drop_column):
+                change(table, live)
+        self.assertEqual(
+            [s['phase'] for s in self.migrations(everything)],
+            ['add column', 'modify column', 'add index', 'drop index',
+             'extra column']
+        )
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import threading
+from unittest import TestCase, mock
+
+from redis import RedisError
+
+from bench import standins
+from lib import kvs
+
+
+class Stop(BaseException):
+    '''Ends kvs._listen(), which only catches Exception subclasses'''
+
+
+class ListenerTestCase(TestCase):
+    def setUp(self):
+        self.redis = standins.FakeRedis()
+        kvs.reset(self.redis)
+        self.received = []
+        # the listener of the process must not pick these handlers up
+        patch = mock.patch.object(kvs, '_listen_enabled', False)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def listen(self, handlers, periodic):
+        '''Run kvs._listen() with handlers and periodic until Stop'''
+        def run():
+            try:
+                kvs._listen()
+            except Stop:
+                pass
+        with mock.patch.dict(kvs._handlers, handlers, clear=True), \
+                mock.patch.object(kvs, '_periodic', periodic):
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def receive(self, message):
+        self.received.append(message)
+        if message == 'stop':
+            raise Stop
+
+    def publish(self, *messages):
+        def publish():
+            for message in messages:
+                self.redis.publish('test', message)
+        return publish
+
+    def test_messages_reach_subscribers(self):
+        self.listen({'test': [self.receive]},
+                    [(3600, self.publish('a', 'b', 'stop'))])
+        self.assertEqual(self.received, ['a', 'b', 'stop'])
+
+    def test_failing_callback_is_logged(self):
+        def fail(message):
+            raise ValueError(message)
+
+        with self.assertLogs('lib.kvs', 'ERROR') as logs:
+            self.listen({'test': [fail, self.receive]},
+                        [(3600, self.publish('a', 'stop'))])
+        self.assertEqual(self.received, ['a', 'stop'])
+        self.assertEqual(len(logs.records), 2)
+
+    def test_periodic_callbacks_run_again_after_redis_errors(self):
+        calls = []
+
+        def reload():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise RedisError('down')
+            raise Stop
+
+        with mock.patch('lib.kvs.time.sleep') as sleep:
+            self.listen({}, [(3600, reload)])
+        self.assertEqual(calls, [0, 1])
+        sleep.assert_called_once_with(1)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import gzip
+import json
+from unittest import TestCase, mock
+
+from bench import standins
+import config
+from helpers import StandinTestCase
+from lib import listing
+from lib.exceptions import RedisConnectionError
+from lib.records import DNSRecord
+
+
+class TagTestCase(TestCase):
+    def test_distinct_params_get_distinct_keys(self):
+        poisoned = listing.tag(DNSRecord, 1, {'ipv4_prefix': '10.0.0.&type=A'})
+        legitimate = listing.tag(
+            DNSRecord, 1, {'ipv4_prefix': '10.0.0.', 'type': 'A'}
+        )
+        self.assertNotEqual(poisoned[0], legitimate[0])
+        self.assertNotEqual(poisoned[1], legitimate[1])
+
+    def test_key_ignores_param_order(self):
+        self.assertEqual(
+            listing.tag(DNSRecord, 1, {'type': 'A', 'fields': 'host'}),
+            listing.tag(DNSRecord, 1, {'fields': 'host', 'type': 'A'})
+        )
+
+
+class ListingCacheTestCase(StandinTestCase):
+    def test_crafted_filter_does_not_poison_cache(self):
+        status, body = self.bench.request(
+            'dns', 'GET', '/json', {'ipv4_prefix': '10.0.0.&type=A'}
+        )
+        self.assertEqual(status, 400)
+        status, body = self.bench.request(
+            'dns', 'GET', '/json', {'ipv4_prefix': '10.0.0.', 'type': 'A'}
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)), self.records)
+
+
+class NegotiateTestCase(TestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.dict(listing.ENCODERS, {'br': bytes, 'gzip': bytes}),
+            mock.patch.dict(config.listing_compression,
+                            {'encodings': ['br', 'gzip']}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_negotiate(self):
+        cases = [
+            (None, None),
+            ('', None),
+            ('identity', None),
+            ('gzip', 'gzip'),
+            ('GZip', 'gzip'),
+            ('gzip, br', 'br'),
+            ('br, gzip', 'br'),
+            ('gzip;q=1.0, br;q=0.5', 'gzip'),
+            ('gzip; q=0.8, br ; q=0.9', 'br'),
+            ('gzip;Q=0.8, br;q=0.7', 'gzip'),
+            ('gzip;q=0.5;x=y, br;q=0.4', 'gzip'),
+            ('gzip;q=2, br;q=0.9', 'gzip'),
+            ('gzip;q=1, br;q=1', 'br'),
+            ('gzip;q=0', None),
+            ('gzip;q=abc, br;q=0.1', 'br'),
+            ('deflate, compress', None),
+            ('*', 'br'),
+            ('*;q=0.5, gzip', 'gzip'),
+            ('*, br;q=0', 'gzip'),
+            ('*;q=0', None),
+            ('gzip, identity;q=0', 'gzip'),
+            ('*;q=0.1, identity;q=0', 'br'),
+            ('identity;q=0', None),
+        ]
+        for header, expected in cases:
+            with self.subTest(header):
+                self.assertEqual(listing.negotiate(header), expected)
+
+    def test_unavailable_coding_is_skipped(self):
+        del listing.ENCODERS['br']
+        self.assertEqual(listing.negotiate('br, gzip;q=0.1'), 'gzip')
+        self.assertIsNone(listing.negotiate('br'))
+
+    def test_config_order_breaks_ties(self):
+        config.listing_compression['encodings'] = ['gzip', 'br']
+        self.assertEqual(listing.negotiate('br, gzip'), 'gzip')
+        self.assertEqual(listing.negotiate('*'), 'gzip')
+
+
+class IterJsonTestCase(StandinTestCase):
+    def ids(self, **params):
+        return [r['id_'] for r in json.loads(DNSRecord.json(**params))]
+
+    def test_one_streamed_query(self):
+        before = standins.stats['mysql_queries']
+        with mock.patch.object(DNSRecord, 'chunk_size', 3):
+            chunks = list(DNSRecord.iter_json())
+        self.assertEqual(standins.stats['mysql_queries'] - before, 1)
+        # [, four chunks of at most 3 records, ]
+        self.assertEqual(len(chunks), 6)
+        records = json.loads(''.join(chunks))
+        self.assertEqual([r['id_'] for r in records], list(range(1, 11)))
+        self.assertEqual(records[0], {'id_': 1, 'type': 'A', 'host': 'host0',
+                                      'ipv4_addr': '10.0.0.0'})
+
+    def test_keyset_pages(self):
+        self.assertEqual(self.ids(limit='4'), [1, 2, 3, 4])
+        self.assertEqual(self.ids(after='4', limit='4'), [5, 6, 7, 8])
+        self.assertEqual(self.ids(after='8', limit=4), [9, 10])
+        self.assertEqual(self.ids(after='10'), [])
+        self.execute('DELETE FROM dns WHERE id=6;')
+        self.assertEqual(self.ids(after='4', limit='4'), [5, 7, 8, 9])
+
+    def test_fields(self):
+        records = json.loads(DNSRecord.json(limit='1', fields='host, type'))
+        self.assertEqual(records, [{'id_': 1, 'host': 'host0', 'type': 'A'}])
+
+    def test_invalid_parameters(self):
+        for params in ({'after': '-1'}, {'limit': 'x'}, {'fields': 'id'},
+                       {'fields': 'host,password'}):
+            with self.subTest(params):
+                status, _ = self.bench.request('dns', 'GET', '/json', params)
+                self.assertEqual(status, 400)
+
+
+class ConditionalGetTestCase(StandinTestCase):
+    def test_not_modified_until_a_write(self):
+        status, headers, body = self.request('dns', 'GET', '/json')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        etag = headers['Etag']
+        for header in ({'If-None-Match': etag},
+                       {'If-None-Match': 'W/' + etag + ', "other"'},
+                       {'If-None-Match': '*'},
+                       {'If-Modified-Since': headers['Last-Modified']}):
+            with self.subTest(header):
+                status, _, body = self.request('dns', 'GET', '/json',
+                                               headers=header)
+                self.assertEqual((status, body), (304, ''))
+        DNSRecord(1).update(ipv4_addr='10.8.0.1')
+        status, headers, body = self.request(
+            'dns', 'GET', '/json', headers={'If-None-Match': etag}
+        )
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers['Etag'], etag)
+        self.assertEqual(json.loads(body)[0]['ipv4_addr'], '10.8.0.1')
+
+    def test_params_have_their_own_etag(self):
+        _, headers, _ = self.request('dns', 'GET', '/json')
+        status, other, _ = self.request(
+            'dns', 'GET', '/json', {'limit': '1'},
+            headers={'If-None-Match': headers['Etag']}
+        )
+        self.assertEqual(status, 200)
+        self.assertNotEqual(other['Etag'], headers['Etag'])
+
+    def test_gzip(self):
+        _, identity, body = self.request('dns', 'GET', '/json')
+        status, headers, data = self.request(
+            'dns', 'GET', '/json', headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Etag'], identity['Etag'][:-1] + '-gzip"')
+        self.assertEqual(gzip.decompress(data).decode('utf-8'), body)
+        with mock.patch.object(listing, 'compress') as compress:
+            _, _, again = self.request(
+                'dns', 'GET', '/json', headers={'Accept-Encoding': 'gzip'}
+            )
+        compress.assert_not_called()
+        self.assertEqual(again, data)
+        status, _, _ = self.request(
+            'dns', 'GET', '/json', headers={'Accept-Encoding': 'gzip',
+                                            'If-None-Match': identity['Etag']}
+        )
+        self.assertEqual(status, 304)
+
+    def test_redis_outage_streams_without_etag(self):
+        with mock.patch.object(DNSRecord, 'version',
+                               side_effect=RedisConnectionError):
+            status, headers, body = self.request('dns', 'GET', '/json')
+        self.assertEqual(status, 200)
+        self.assertNotIn('Etag', headers)
+        self.assertEqual(len(json.loads(body)), self.records)
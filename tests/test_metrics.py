@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase, mock
+
+import config
+from helpers import StandinTestCase
+from lib import metrics
+
+
+def isolate(test_case):
+    '''Give test_case empty counters and histograms'''
+    for state in (metrics._counters, metrics._histograms):
+        patch = mock.patch.dict(state, clear=True)
+        patch.start()
+        test_case.addCleanup(patch.stop)
+
+
+class RenderTestCase(TestCase):
+    def setUp(self):
+        isolate(self)
+        patch = mock.patch.object(metrics, '_gauges', [])
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_counter(self):
+        metrics.inc('charakoba_errors_total', {'class': 'TokenError'})
+        metrics.inc('charakoba_errors_total', {'class': 'TokenError'}, 2)
+        metrics.inc('charakoba_errors_total', {'class': 'a"b\\c'})
+        lines = metrics.render().splitlines()
+        self.assertEqual(lines, [
+            '# HELP charakoba_errors_total Raised CharakobaError by class',
+            '# TYPE charakoba_errors_total counter',
+            'charakoba_errors_total{class="TokenError"} 3.0',
+            'charakoba_errors_total{class="a\\"b\\\\c"} 1.0',
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        labels = {'app': 'dns', 'route': 'GET /'}
+        for value in (0, 2, 2, 7, 500):
+            metrics.observe('charakoba_request_mysql_queries', labels, value)
+        samples = dict(
+            line.rsplit(' ', 1) for line in metrics.render().splitlines()
+            if not line.startswith('#')
+        )
+        name = 'charakoba_request_mysql_queries'
+        prefix = name + '_bucket{app="dns",route="GET /",le="'
+        suffix = '"}'
+        self.assertEqual(samples[prefix + '0' + suffix], '1.0')
+        self.assertEqual(samples[prefix + '2' + suffix], '3.0')
+        self.assertEqual(samples[prefix + '10' + suffix], '4.0')
+        self.assertEqual(samples[prefix + '100' + suffix], '4.0')
+        self.assertEqual(samples[prefix + '+Inf' + suffix], '5.0')
+        labels = '{app="dns",route="GET /"}'
+        self.assertEqual(samples[name + '_sum' + labels], '511.0')
+        self.assertEqual(samples[name + '_count' + labels], '5.0')
+
+    def test_gauges_are_read_on_render(self):
+        values = {(('state', 'idle'),): 1}
+        metrics.register_gauges('charakoba_test_gauge', 'Test',
+                                lambda: dict(values))
+        self.addCleanup(metrics.METRICS.pop, 'charakoba_test_gauge')
+        values[(('state', 'idle'),)] = 4
+        self.assertIn('charakoba_test_gauge{state="idle"} 4.0',
+                      metrics.render().splitlines())
+
+    def test_workers_are_summed(self):
+        metrics_dir = tempfile.mkdtemp(prefix='charakoba-metrics-')
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        metrics.inc('charakoba_redis_round_trips_total', n=2)
+        other = {'counters': [['charakoba_redis_round_trips_total', [], 5]],
+                 'histograms': [], 'gauges': []}
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        for pid in (os.getppid(), exited.pid):
+            with open(os.path.join(metrics_dir, '{}.json'.format(pid)),
+                      'w') as f:
+                json.dump(other, f)
+        with mock.patch.object(config, 'metrics_dir', metrics_dir):
+            rendered = metrics.render()
+        self.assertIn('charakoba_redis_round_trips_total 7.0',
+                      rendered.splitlines())
+        self.assertEqual(
+            sorted(os.listdir(metrics_dir)),
+            sorted('{}.json'.format(p) for p in (os.getpid(), os.getppid()))
+        )
+
+
+class InstrumentTestCase(StandinTestCase):
+    records = 3
+
+    def setUp(self):
+        super().setUp()
+        isolate(self)
+
+    def samples(self):
+        status, body = self.bench.request('dns', 'GET', '/metrics')
+        self.assertEqual(status, 200)
+        return dict(line.rsplit(' ', 1) for line in body.splitlines()
+                    if not line.startswith('#'))
+
+    def test_requests_are_counted_by_route(self):
+        self.assertEqual(self.bench.request('dns', 'GET', '/1')[0], 200)
+        self.assertEqual(self.bench.request('dns', 'GET', '/9')[0], 404)
+        self.assertEqual(self.bench.request('dns', 'GET', '/x/y')[0], 404)
+        samples = self.samples()
+        route = 'charakoba_requests_total{{app="dns",route="{}",' \
+            'status="{}"}}'
+        self.assertEqual(samples[route.format('GET /<id_:int>', 200)], '1.0')
+        self.assertEqual(samples[route.format('GET /<id_:int>', 404)], '1.0')
+        self.assertEqual(samples[route.format('unmatched', 404)], '1.0')
+        queries = 'charakoba_request_mysql_queries_{}' \
+            '{{app="dns",route="GET /<id_:int>"}}'
+        self.assertEqual(samples[queries.format('count')], '2.0')
+        self.assertEqual(samples[queries.format('sum')], '2.0')
+        self.assertEqual(samples['charakoba_mysql_queries_total'], '2.0')
+
+    def test_metrics_are_not_counted_as_requests(self):
+        self.samples()
+        self.assertFalse([name for name in self.samples()
+                          if name.startswith('charakoba_requests_total')])
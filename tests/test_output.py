@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from datetime import date
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from bench import standins
+import config
+from lib import kvs
+from lib.exceptions import RecordNotFoundError
+from lib.superclass import CHANGES
+import output
+
+from helpers import StandinTestCase
+
+REPORT = output.report
+
+
+class Stop(BaseException):
+    '''Ends output.watch(), which catches Exception subclasses'''
+
+
+class WatchTestCase(TestCase):
+    def setUp(self):
+        self.redis = standins.FakeRedis()
+        kvs.reset(self.redis)
+        self.calls = []
+        self.events = []
+        patches = [
+            mock.patch.object(config, 'output_debounce', 0.01),
+            mock.patch.object(config, 'output_retry_delay', 0),
+            mock.patch.object(output, 'output_all', self.output_all),
+            mock.patch.object(output, 'output_dns', self.output_dns),
+            mock.patch.object(output, 'output_rproxy', self.output_rproxy),
+            mock.patch.object(output, 'report', lambda *a, **kw: None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def output_all(self, reload=False):
+        self.calls.append('resync')
+        if not self.events:
+            raise Stop
+        self.redis.publish(CHANGES, self.events.pop(0))
+
+    def output_dns(self):
+        self.calls.append('dns')
+        raise RecordNotFoundError
+
+    def output_rproxy(self, hosts=None):
+        self.calls.append('rproxy')
+        return []
+
+    def test_failing_flush_is_followed_by_resync(self):
+        self.events = [json.dumps({'table': 'dns', 'keys': ['a']})]
+        with self.assertLogs('output', 'ERROR'), self.assertRaises(Stop):
+            output.watch()
+        self.assertEqual(self.calls, ['resync', 'dns', 'resync'])
+
+    def test_malformed_event_is_followed_by_resync(self):
+        self.events = ['not json', json.dumps({'keys': []}), '3']
+        with self.assertLogs('output', 'ERROR') as logs, \
+                self.assertRaises(Stop):
+            output.watch()
+        self.assertEqual(self.calls, ['resync'] * 4)
+        self.assertEqual(len(logs.records), 3)
+
+    def test_working_flush_keeps_watching(self):
+        self.events = [json.dumps({'table': 'rproxy', 'keys': ['a']})]
+        with mock.patch.object(config, 'output_resync_interval', 0.05), \
+                self.assertRaises(Stop):
+            output.watch()
+        self.assertEqual(self.calls, ['resync', 'rproxy', 'resync'])
+
+    def test_failing_reload_is_followed_by_resync(self):
+        self.events = [json.dumps({'table': 'rproxy', 'keys': ['a']})]
+        self.output_rproxy = lambda hosts=None: \
+            self.calls.append('rproxy') or ['a.conf']
+        commands = {'rproxy': [os.path.join(tempfile.gettempdir(),
+                                            'charakoba-missing-reload')]}
+        with mock.patch.object(output, 'report', REPORT), \
+                mock.patch.object(output, 'output_rproxy',
+                                  self.output_rproxy), \
+                mock.patch.object(config, 'reload_commands', commands), \
+                mock.patch('sys.stdout'), \
+                self.assertLogs('output', 'ERROR') as logs, \
+                self.assertRaises(Stop):
+            output.watch()
+        self.assertEqual(self.calls, ['resync', 'rproxy', 'resync'])
+        self.assertIn('FileNotFoundError', logs.output[0])
+
+
+class SerialTestCase(TestCase):
+    def test_next_serial(self):
+        today = int(date.today().strftime('%Y%m%d')) * 100
+        self.assertEqual(output._next_serial(0), today)
+        self.assertEqual(output._next_serial(today - 100), today)
+        self.assertEqual(output._next_serial(today), today + 1)
+        self.assertEqual(output._next_serial(today + 150), today + 151)
+
+
+class DNSOutputTestCase(StandinTestCase):
+    records = 3
+
+    def setUp(self):
+        super().setUp()
+        self.output_dir = tempfile.mkdtemp(prefix='charakoba-output-')
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        patch = mock.patch.object(config, 'output_dir', self.output_dir)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def change(self, n):
+        self.execute(
+            'UPDATE dns SET ipv4_addr=%s WHERE id=1;', ('10.8.0.{}'.format(n),)
+        )
+        return output.output_dns()
+
+    def journal_files(self):
+        return sorted(f for f in os.listdir(self.output_dir)
+                      if f.endswith('.ixfr'))
+
+    def test_journal_has_full_soa(self):
+        output.output_dns()
+        changed = self.change(1)
+        self.assertEqual(len(changed), 2)
+        with open(os.path.join(self.output_dir, changed[1])) as f:
+            lines = f.read().splitlines()
+        soa = [line.split() for line in lines if ' SOA ' in line]
+        self.assertEqual(len(soa), 2)
+        for fields in soa:
+            # sign, owner, class, type, MNAME RNAME SERIAL and 4 timers
+            self.assertEqual(len(fields), 11)
+            self.assertEqual(fields[4:6],
+                             ['charakoba.com.', 'root.charakoba.com.'])
+        self.assertEqual(int(soa[1][6]), int(soa[0][6]) + 1)
+        self.assertIn('- host0 IN A 10.0.0.0', lines)
+        self.assertIn('+ host0 IN A 10.8.0.1', lines)
+
+    def test_journal_rotation(self):
+        output.output_dns()
+        with mock.patch.object(config, 'dns_journal_keep', 2):
+            for n in range(4):
+                self.change(n)
+            files = self.journal_files()
+            self.assertEqual(len(files), 2)
+            manifest = output._load_manifest()
+            journal = manifest['dns'][config.dns_conf_filename]['journal']
+            self.assertEqual(
+                files, [output._journal_filename(s) for s in journal]
+            )
+
+    def test_journal_keep_zero(self):
+        output.output_dns()
+        self.change(1)
+        self.assertEqual(len(self.journal_files()), 1)
+        with mock.patch.object(config, 'dns_journal_keep', 0):
+            changed = self.change(2)
+            self.assertEqual(changed, [config.dns_conf_filename])
+            self.assertEqual(self.journal_files(), [])
+            manifest = output._load_manifest()
+            self.assertEqual(
+                manifest['dns'][config.dns_conf_filename]['journal'], []
+            )
+
+
+class RproxyOutputTestCase(StandinTestCase):
+    records = 4
+
+    def setUp(self):
+        super().setUp()
+        self.output_dir = tempfile.mkdtemp(prefix='charakoba-output-')
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        patch = mock.patch.multiple(config, output_dir=self.output_dir,
+                                    output_workers=1)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def conf(self, n):
+        return config.rproxy_conf_filename.format(host='host{}'.format(n))
+
+    def files(self):
+        return sorted(os.listdir(self.output_dir))
+
+    def test_only_changed_files_are_written(self):
+        self.assertEqual(sorted(output.output_rproxy()),
+                         [self.conf(n) for n in range(4)])
+        self.assertEqual(output.output_rproxy(), [])
+        self.execute("UPDATE rproxy SET upstream='10.8.0.1:80' WHERE id=2;")
+        self.assertEqual(output.output_rproxy(), [self.conf(1)])
+        with open(os.path.join(self.output_dir, self.conf(1))) as f:
+            self.assertIn('10.8.0.1:80', f.read())
+
+    def test_deleted_hosts_lose_their_files(self):
+        output.output_rproxy()
+        self.execute('DELETE FROM rproxy WHERE id=3;')
+        self.assertEqual(output.output_rproxy(), [self.conf(2)])
+        self.assertNotIn(self.conf(2), self.files())
+        self.assertNotIn(self.conf(2),
+                         output._load_manifest()['rproxy'])
+
+    def test_missing_file_is_rewritten(self):
+        output.output_rproxy()
+        os.remove(os.path.join(self.output_dir, self.conf(0)))
+        self.assertEqual(output.output_rproxy(), [self.conf(0)])
+
+    def test_hosts_limit_the_files_considered(self):
+        output.output_rproxy()
+        self.execute("UPDATE rproxy SET upstream='10.8.0.1:80';")
+        self.execute('DELETE FROM rproxy WHERE id=4;')
+        self.assertEqual(output.output_rproxy(hosts={'host0', 'host3'}),
+                         [self.conf(0), self.conf(3)])
+        self.assertEqual(output.output_rproxy(hosts=set()), [])
+        self.assertEqual(sorted(output.output_rproxy()),
+                         [self.conf(1), self.conf(2)])
+
+    def test_failed_write_keeps_the_old_file(self):
+        output.output_rproxy()
+        path = os.path.join(self.output_dir, self.conf(0))
+        with open(path) as f:
+            before = f.read()
+        self.execute("UPDATE rproxy SET upstream='10.8.0.1:80' WHERE id=1;")
+        with mock.patch('output.os.replace', side_effect=OSError('full')), \
+                self.assertRaises(OSError):
+            output.output_rproxy()
+        with open(path) as f:
+            self.assertEqual(f.read(), before)
+        self.assertFalse([f for f in self.files() if f.startswith('.')
+                          and f != output.MANIFEST_FILENAME])
+        self.assertEqual(output.output_rproxy(), [self.conf(0)])
+
+    def test_parallel_rendering_writes_the_same_files(self):
+        rows = [{'host': 'host{}'.format(n),
+                 'upstream': '10.0.0.{}:80'.format(n)} for n in range(7)]
+        with mock.patch.object(config, 'output_chunk_size', 2):
+            changed = output.write_rproxy(rows, workers=3)
+        self.assertEqual(changed, [self.conf(n) for n in range(7)])
+        contents = {}
+        for n in range(7):
+            with open(os.path.join(self.output_dir, self.conf(n))) as f:
+                contents[n] = f.read()
+        manifest = output._load_manifest()
+        shutil.rmtree(self.output_dir)
+        os.mkdir(self.output_dir)
+        self.assertEqual(output.write_rproxy(rows, workers=1), changed)
+        self.assertEqual(output._load_manifest(), manifest)
+        for n in range(7):
+            with open(os.path.join(self.output_dir, self.conf(n))) as f:
+                self.assertEqual(f.read(), contents[n])
+        self.assertIn('proxy_pass http://10.0.0.6:80;', contents[6])
+
+    def test_unchanged_dns_records_keep_the_serial(self):
+        self.assertEqual(output.output_dns(), [config.dns_conf_filename])
+        self.execute("UPDATE dns SET host='host9' WHERE id=1;")
+        self.execute("UPDATE dns SET host='host0' WHERE id=1;")
+        self.assertEqual(output.output_dns(), [])
+
+    def test_output_all(self):
+        with mock.patch('sys.stdout'):
+            changed = output.output_all()
+        self.assertEqual(changed['dns'], [config.dns_conf_filename])
+        self.assertEqual(len(changed['rproxy']), 4)
+        with mock.patch('sys.stdout'):
+            self.assertEqual(output.output_all(), {'dns': [], 'rproxy': []})
+
+
+class RproxyMapTestCase(TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='charakoba-output-')
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        patch = mock.patch.object(config, 'output_dir', self.output_dir)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def read(self, filename):
+        with open(os.path.join(self.output_dir, filename)) as f:
+            return f.read()
+
+    def test_upstream_names_are_unique(self):
+        self.assertNotEqual(output._upstream_name('a.b:80'),
+                            output._upstream_name('a_b:80'))
+
+    def test_invalid_upstreams_are_left_out(self):
+        rows = [
+            {'host': 'dot', 'upstream': 'a.b:80'},
+            {'host': 'underscore', 'upstream': 'a_b:80'},
+            {'host': 'path', 'upstream': 'a.b:80/app'},
+            {'host': 'scheme', 'upstream': 'http://a.b:80'},
+            {'host': 'inject', 'upstream': 'a.b:80; server evil:80'},
+        ]
+        with self.assertLogs('output', 'WARNING') as logs:
+            output.write_rproxy_map(rows)
+        self.assertEqual(len(logs.records), 3)
+        map_lines = self.read(config.rproxy_map_filename).splitlines()
+        self.assertEqual([line.split()[0] for line in map_lines],
+                         ['dot.charakoba.com', 'underscore.charakoba.com'])
+        conf = self.read(config.rproxy_map_conf_filename)
+        names = [line.split()[1] for line in conf.splitlines()
+                 if line.startswith('upstream ')]
+        self.assertEqual(len(names), 2)
+        self.assertEqual(len(set(names)), 2)
+        self.assertNotIn('evil', conf)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from unittest import mock
+
+from helpers import StandinTestCase
+from lib.exceptions import RecordNotFoundError
+from lib.records import DNSRecord
+from lib.superclass import record_cache
+
+
+class CachedWriteTestCase(StandinTestCase):
+    '''Writes must not act on the values record_cache holds'''
+    records = 3
+
+    def row(self, id_):
+        record_cache.clear()
+        return DNSRecord(id_).as_dict()
+
+    def test_update_keeps_columns_changed_elsewhere(self):
+        self.assertEqual(self.bench.request('dns', 'GET', '/1')[0], 200)
+        self.execute('UPDATE dns SET ipv4_addr=%s WHERE id=1;', ('9.9.9.9',))
+        status, _ = self.bench.request(
+            'dns', 'PUT', '/1', {'token': self.bench.token, 'type': 'AAAA'}
+        )
+        self.assertEqual(status, 200)
+        row = self.row(1)
+        self.assertEqual((row['type'], row['ipv4_addr']), ('AAAA', '9.9.9.9'))
+
+    def test_update_of_record_deleted_elsewhere(self):
+        record = DNSRecord(2)
+        self.execute('DELETE FROM dns WHERE id=2;')
+        with self.assertRaises(RecordNotFoundError):
+            DNSRecord(2).update(type='AAAA')
+        with self.assertRaises(RecordNotFoundError):
+            record.delete()
+
+    def test_delete_announces_the_current_key(self):
+        record = DNSRecord(3)
+        self.execute('UPDATE dns SET host=%s WHERE id=3;', ('renamed',))
+        with mock.patch.object(DNSRecord, '_changed') as changed:
+            record.delete()
+        changed.assert_called_once_with([3], ['renamed'])
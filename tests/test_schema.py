@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from unittest import TestCase, mock
+
+from lib import schema, warmup
+from lib.records import DNSRecord, ReverseProxyRecord
+from lib.superclass import BaseRecord
+from lib.user import Role, User
+
+
+class CheckTestCase(TestCase):
+    def test_record_classes_match_schema(self):
+        warmup._check_schema()
+
+    def test_unknown_filter_column(self):
+        class Record(BaseRecord):
+            tablename = 'dns'
+            filters = {'address': ('ipv6_addr', 'eq')}
+        with self.assertRaisesRegex(ValueError, 'ipv6_addr'):
+            schema.check(Record)
+
+    def test_unknown_unique_column(self):
+        class Record(BaseRecord):
+            tablename = 'rproxy'
+            unique_column = 'hostname'
+        with self.assertRaisesRegex(ValueError, 'hostname'):
+            schema.check(Record)
+
+    def test_unknown_decoder_column(self):
+        class Record(BaseRecord):
+            tablename = 'dns'
+            decoders = {'ttl': int}
+        with self.assertRaisesRegex(ValueError, 'ttl'):
+            schema.check(Record)
+
+
+class RecordTypeTestCase(TestCase):
+    def test_generated_attributes(self):
+        self.assertEqual(DNSRecord.columns, ['type', 'host', 'ipv4_addr'])
+        self.assertEqual((DNSRecord.key, DNSRecord.key_attribute),
+                         ('id', 'id_'))
+        self.assertEqual(DNSRecord.fields,
+                         ('id_', 'type', 'host', 'ipv4_addr'))
+        self.assertEqual(ReverseProxyRecord.columns, ['host', 'upstream'])
+        self.assertEqual(DNSRecord.value_types['host'], (str,))
+
+    def test_generated_sql(self):
+        self.assertEqual(
+            DNSRecord.select_sql,
+            'SELECT type, host, ipv4_addr FROM dns WHERE id=%s;'
+        )
+        self.assertEqual(
+            DNSRecord.insert_sql,
+            'INSERT INTO dns (type, host, ipv4_addr) VALUES (%s, %s, %s);'
+        )
+        self.assertEqual(
+            DNSRecord.update_sql,
+            'UPDATE dns SET type=%s, host=%s, ipv4_addr=%s WHERE id=%s;'
+        )
+        self.assertEqual(DNSRecord.delete_sql,
+                         'DELETE FROM dns WHERE id=%s;')
+
+    def test_natural_key_and_ignored_columns(self):
+        self.assertEqual(User.key_attribute, 'username')
+        self.assertEqual(User.columns, ['password', 'role', 'is_active'])
+        self.assertEqual(
+            User.insert_sql,
+            'INSERT INTO users (username, password, role, is_active) '
+            'VALUES (%s, %s, %s, %s);'
+        )
+        self.assertEqual(User.decoders['is_active'], bool)
+        self.assertIs(User.decoders['role']('admin'), Role.admin)
+
+    def test_slots(self):
+        record = DNSRecord.__new__(DNSRecord)
+        self.assertFalse(hasattr(record, '__dict__'))
+        with self.assertRaises(AttributeError):
+            record.ttl = 300
+        user = User.__new__(User)
+        user.token = 'token'
+        self.assertFalse(hasattr(user, '__dict__'))
+
+    def test_load_decodes_and_clear_drops_fields(self):
+        user = User.__new__(User)
+        user.username = 'alice'
+        user._load({'password': 'x' * 128, 'role': 'user', 'is_active': 0})
+        self.assertIs(user.role, Role.user)
+        self.assertIs(user.is_active, False)
+        user._clear()
+        self.assertFalse(any(hasattr(user, name) for name in User.fields))
+
+    def test_class_without_table(self):
+        class Base(BaseRecord):
+            chunk_size = 10
+        self.assertEqual((Base.columns, Base.fields), ([], ()))
+
+    def test_classes_follow_the_schema(self):
+        tables = dict(schema.tables())
+        dns = dict(tables['dns'])
+        dns['columns'] = dns['columns'] + [
+            {'name': 'ttl', 'type': 'int', 'not null': True}
+        ]
+        tables['dns'] = dns
+        with mock.patch.object(schema, 'tables', lambda: tables):
+            class Record(BaseRecord):
+                tablename = 'dns'
+        self.assertEqual(Record.columns[-1], 'ttl')
+        self.assertIn('ttl', Record.__slots__)
+        self.assertEqual(Record.value_types['ttl'], (int,))
+        self.assertTrue(Record.update_sql.startswith(
+            'UPDATE dns SET type=%s, host=%s, ipv4_addr=%s, ttl=%s '
+        ))
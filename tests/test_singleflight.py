@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import asyncio
+from unittest import TestCase
+
+from lib.singleflight import AsyncGroup
+
+
+class AsyncGroupTestCase(TestCase):
+    def setUp(self):
+        self.group = AsyncGroup('test')
+        self.calls = 0
+
+    async def read(self, result='row', delay=0.05):
+        self.calls += 1
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def test_callers_share_one_call(self):
+        async def run():
+            return await asyncio.gather(*[
+                self.group.do('key', self.read) for _ in range(3)
+            ])
+        self.assertEqual(asyncio.run(run()), ['row'] * 3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.group._calls, {})
+
+    def test_cancelled_leader_leaves_followers_the_result(self):
+        async def run():
+            leader = asyncio.ensure_future(self.group.do('key', self.read))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(self.group.do('key', self.read))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            result = await follower
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return result
+        self.assertEqual(asyncio.run(run()), 'row')
+        self.assertEqual(self.calls, 1)
+
+    def test_cancelled_follower_leaves_leader_the_result(self):
+        async def run():
+            leader = asyncio.ensure_future(self.group.do('key', self.read))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(self.group.do('key', self.read))
+            await asyncio.sleep(0.01)
+            follower.cancel()
+            return await leader
+        self.assertEqual(asyncio.run(run()), 'row')
+
+    def test_error_is_shared_and_not_kept(self):
+        error = ValueError('boom')
+
+        async def run():
+            results = await asyncio.gather(*[
+                self.group.do('key', lambda: self.read(error))
+                for _ in range(2)
+            ], return_exceptions=True)
+            self.assertEqual(self.group._calls, {})
+            results.append(await self.group.do('key', self.read))
+            return results
+        self.assertEqual(asyncio.run(run()), [error, error, 'row'])
+        self.assertEqual(self.calls, 2)
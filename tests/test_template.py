@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from unittest import TestCase, mock
+
+from lib import template
+from lib.template import Template, TemplateError
+import output
+
+
+class TemplateTestCase(TestCase):
+    def test_render(self):
+        compiled = Template('{{ {host}: {upstream} }}', 'test',
+                            {'host', 'upstream'})
+        self.assertEqual(compiled.fields, {'host', 'upstream'})
+        self.assertEqual(compiled.render(host='a', upstream='b:80'),
+                         '{ a: b:80 }')
+
+    def test_invalid_templates(self):
+        cases = [
+            ('{host', None),
+            ('{host}}', None),
+            ('{0}', None),
+            ('{}', None),
+            ('{host.name}', None),
+            ('{host[0]}', None),
+            ('{host}', {'host', 'upstream'}),
+            ('{host} {port}', {'host'}),
+        ]
+        for text, fields in cases:
+            with self.subTest(text):
+                with self.assertRaisesRegex(TemplateError, '^test: '):
+                    Template(text, 'test', fields)
+
+
+class LoadTestCase(TestCase):
+    def setUp(self):
+        patch = mock.patch.dict(template._templates, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_loaded_once(self):
+        with mock.patch('builtins.open', wraps=open) as opened:
+            first = template.load('rproxy', output.RPROXY_FIELDS)
+            self.assertIs(template.load('rproxy'), first)
+            self.assertIs(template.load('rproxy', output.RPROXY_FIELDS),
+                          first)
+        self.assertEqual(opened.call_count, 1)
+
+    def test_unexpected_fields(self):
+        template.load('rproxy')
+        with self.assertRaises(TemplateError):
+            template.load('rproxy', {'host'})
+        with self.assertRaises(TemplateError):
+            template.load('dns', {'serial'})
+
+    def test_shipped_templates(self):
+        for name, fields in [('dns', output.DNS_FIELDS),
+                             ('rproxy', output.RPROXY_FIELDS),
+                             ('rproxy_map', output.RPROXY_MAP_FIELDS),
+                             ('rproxy_upstream', output.UPSTREAM_FIELDS)]:
+            with self.subTest(name):
+                self.assertEqual(template.load(name, fields).fields, fields)
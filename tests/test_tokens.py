@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import json
+import threading
+import time
+from unittest import TestCase, mock
+
+from bench import standins
+import config
+from helpers import clear_caches
+from lib import kvs, tokens
+from lib.exceptions import TokenError
+from lib.user import Role
+
+_now = time.time
+
+
+class TokensTestCase(TestCase):
+    def setUp(self):
+        kvs.reset(standins.FakeRedis())
+        clear_caches()
+        self.addCleanup(clear_caches)
+        patch = mock.patch.multiple(
+            config, token_format='signed', token_secret='test-secret'
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_sign_and_verify(self):
+        token = tokens.sign('alice', Role.admin)
+        self.assertTrue(tokens.is_signed(token))
+        self.assertFalse(tokens.is_signed(config.token_prefix + '-uuid'))
+        self.assertEqual(tokens.verify(token), ('alice', 'admin'))
+
+    def test_expired(self):
+        with mock.patch.object(config, 'token_ttl', 1):
+            token = tokens.sign('alice', Role.user)
+        self.assertEqual(tokens.verify(token), ('alice', 'user'))
+        with mock.patch.object(time, 'time', lambda: _now() + 3601):
+            with self.assertRaises(TokenError):
+                tokens.verify(token)
+
+    def test_tampered(self):
+        token = tokens.sign('alice', Role.user)
+        prefix, payload, signature = token.split('.')
+        forged_payload = tokens._b64encode(
+            tokens._b64decode(payload).replace(b'user', b'admin')
+        )
+        forged = [
+            '.'.join([prefix, forged_payload, signature]),
+            '.'.join([prefix, payload, signature[:-2] + 'AA']),
+            '.'.join([prefix, payload, '']),
+            '.'.join([prefix, 'bm90IGpzb24', tokens._signature(
+                prefix + '.bm90IGpzb24'
+            )]),
+            token + '.extra',
+        ]
+        for token in forged:
+            with self.subTest(token):
+                with self.assertRaises(TokenError):
+                    tokens.verify(token)
+
+    def test_other_secret(self):
+        token = tokens.sign('alice', Role.user)
+        with mock.patch.object(config, 'token_secret', 'other-secret'):
+            with self.assertRaises(TokenError):
+                tokens.verify(token)
+
+    def test_revoked(self):
+        old = tokens.sign('alice', Role.user)
+        other = tokens.sign('bob', Role.user)
+        tokens.revoke('alice')
+        with self.assertRaises(TokenError):
+            tokens.verify(old)
+        self.assertEqual(tokens.verify(other), ('bob', 'user'))
+        time.sleep(0.002)
+        self.assertEqual(
+            tokens.verify(tokens.sign('alice', Role.user)), ('alice', 'user')
+        )
+
+    def test_revocation_reaches_other_processes(self):
+        old = tokens.sign('alice', Role.user)
+        tokens.revoke('alice')
+        tokens._revoked.clear()
+        tokens._loaded_pid = None
+        with self.assertRaises(TokenError):
+            tokens.verify(old)
+
+    def test_check_config(self):
+        tokens.check_config()
+        with mock.patch.object(config, 'token_secret', None):
+            with self.assertRaisesRegex(ValueError, 'token_secret'):
+                tokens.check_config()
+        with mock.patch.object(config, 'token_format', 'jwt'):
+            with self.assertRaisesRegex(ValueError, 'token_format'):
+                tokens.check_config()
+        with mock.patch.multiple(config, token_format='uuid',
+                                 token_secret=None):
+            tokens.check_config()
+
+
+    def test_reload_keeps_concurrent_revocations(self):
+        kvs.client().hset(tokens.REVOKED_KEY, 'alice', tokens._now_ms())
+        usernames = ['user{}'.format(n) for n in range(2000)]
+        done = threading.Event()
+
+        def reload():
+            while not done.is_set():
+                tokens.reload()
+        thread = threading.Thread(target=reload)
+        thread.start()
+        try:
+            for username in usernames:
+                tokens._apply(json.dumps([username, tokens._now_ms()]))
+        finally:
+            done.set()
+            thread.join()
+        self.assertLessEqual(set(usernames) | {'alice'}, set(tokens._revoked))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from unittest import mock
+
+import config
+from helpers import StandinTestCase, clear_caches
+from lib import db, kvs, listing, warmup
+from lib.exceptions import RedisConnectionError
+from lib.records import DNSRecord
+
+
+class WarmupTestCase(StandinTestCase):
+    records = 3
+
+    def setUp(self):
+        super().setUp()
+        patches = [
+            mock.patch.dict(warmup.timings, clear=True),
+            mock.patch.dict(config.warmup, {'preload': True,
+                                            'listings': True,
+                                            'connections': True}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        # loading the apps may have preloaded this process already
+        clear_caches()
+
+    def test_preload_runs_once(self):
+        with mock.patch.object(warmup, '_import_modules') as imports:
+            timings = warmup.preload()
+            warmup.preload()
+        imports.assert_called_once_with()
+        self.assertEqual(sorted(timings), ['imports', 'listings', 'preload',
+                                           'schema', 'templates'])
+
+    def test_preload_primes_listings_without_keeping_sockets(self):
+        warmup.preload()
+        self.assertEqual(len(listing.bodies), 2)
+        self.assertEqual(db.pool.stats()['idle'], 0)
+        misses = listing.bodies.misses
+        status, _ = self.bench.request('dns', 'GET', '/json')
+        self.assertEqual(status, 200)
+        self.assertEqual(listing.bodies.misses, misses)
+
+    def test_preload_can_be_turned_off(self):
+        config.warmup.update(preload=False)
+        self.assertEqual(warmup.preload(), {})
+        config.warmup.update(preload=True, listings=False)
+        self.assertNotIn('listings', warmup.preload())
+        self.assertEqual(len(listing.bodies), 0)
+
+    def test_listings_are_skipped_while_redis_is_down(self):
+        with mock.patch.object(DNSRecord, 'version',
+                               side_effect=RedisConnectionError):
+            warmup.preload()
+        self.assertEqual(len(listing.bodies), 0)
+
+    def test_schema_mismatch_fails_preload(self):
+        with mock.patch.object(DNSRecord, 'unique_column', 'hostname'), \
+                self.assertRaisesRegex(ValueError, 'hostname'):
+            warmup.preload()
+
+    def test_postfork_opens_connections(self):
+        db.pool.clear()
+        with mock.patch.object(kvs.client(), 'ping') as ping:
+            warmup.postfork()
+        ping.assert_called_once_with()
+        self.assertEqual(db.pool.stats()['idle'], db.pool.min_size)
+        self.assertIn('connections', warmup.timings)
+        config.warmup.update(connections=False)
+        warmup.timings.clear()
+        warmup.postfork()
+        self.assertEqual(warmup.timings, {})